@@ -17,6 +17,7 @@ export default function VideoChat() {
   const mediaRecorderRef = useRef(null)
   const recognitionRef = useRef(null)
   const chunksRef = useRef([])
+  const recordingRef = useRef<Promise<Blob> | null>(null)
   const lastMessageRef = useRef('')
   const { t, i18n } = useTranslation()
   const changeLanguage = (lang: string) => {
@@ -45,10 +46,13 @@ export default function VideoChat() {
     }
   }, [isRecording]) // Ensures re-initialization on dependency changes
 
-  const fetchVideoAnalysis = async () => {
+  const fetchVideoAnalysis = async (video: Blob) => {
     try {
+      // Send the recording itself; the server streams it straight to Gemini
       const response = await fetch("http://127.0.0.1:5000/VideoAnalyzer", {
-        method: "GET",
+        method: "POST",
+        headers: { "Content-Type": video.type },
+        body: video,
       });
       const data = await response.json();
       console.log('Video analysis result:', data);
@@ -71,17 +75,11 @@ export default function VideoChat() {
           chunksRef.current.push(e.data)
         }
 
-        mediaRecorder.onstop = async () => {
-          const blob = new Blob(chunksRef.current, { type: 'video/webm' })
-          const url = URL.createObjectURL(blob)
-          const a = document.createElement('a')
-          a.href = url
-          a.download = `Video.mp4`
-          document.body.appendChild(a)
-          a.click()
-          document.body.removeChild(a)
-          URL.revokeObjectURL(url)
-        }
+        recordingRef.current = new Promise((resolve) => {
+          mediaRecorder.onstop = () => {
+            resolve(new Blob(chunksRef.current, { type: 'video/webm' }))
+          }
+        })
 
         mediaRecorderRef.current = mediaRecorder
         mediaRecorder.start()
@@ -115,7 +113,8 @@ const stopRecording = async () => {
     setIsProcessing(true);
 
     // Fetch backend analysis (bot reply only)
-    const { response } = await fetchVideoAnalysis();
+    const video = await recordingRef.current;
+    const { response } = await fetchVideoAnalysis(video);
 
     setMessages((prev) => [
       ...prev,
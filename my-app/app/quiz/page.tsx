@@ -8,6 +8,7 @@ import Sidebar from '../../components/Sidebar'
 import QuizBox from '../../components/QuizBox'
 import Bot from '../../components/Bot'
 import { Button } from '@/components/ui/button'
+import { readJsonLines } from '@/lib/streaming'
 
 const questions = [
   {
@@ -80,20 +81,23 @@ export default function QuizPage() {
       const response = await fetch('http://localhost:5000/QuizBot', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ text: storyText , age: age}),
+        body: JSON.stringify({ text: storyText , age: age, stream: true }),
       });
 
-      const data = await response.json();
-      console.log('Fetched Questions1 :', data);
-      const fetchedQuestions = data.response.map((item) => ({
-        question: item.question,
-        options: item.options,
-        correctAnswer: item.correctAnswer,
-      }))
-      console.log('Fetched Questions2 :', data.response);
-      console.log('Fetched Questions3 :', fetchedQuestions);
-
-      setQuestions(fetchedQuestions);
+      // Questions arrive one per line as soon as the model has finished each one
+      setQuestions([]);
+      await readJsonLines(response, (item) => {
+        if (item.error) {
+          console.error('Error fetching questions:', item.error);
+          return;
+        }
+        console.log('Fetched Question :', item);
+        setQuestions((prev) => [...prev, {
+          question: item.question,
+          options: item.options,
+          correctAnswer: item.correctAnswer,
+        }]);
+      });
     } catch (error) {
       console.error('Error fetching questions:', error);
     } finally {
@@ -148,7 +152,7 @@ export default function QuizPage() {
             <Button 
               onClick={startQuiz} 
               className="bg-purple-500 hover:bg-purple-600 text-white font-bold py-2 px-4 rounded-full text-xl"
-              disabled={isButtonDisabled} // Disable button until countdown reaches 0
+              disabled={isButtonDisabled && questions.length === 0} // Disable button until the first question or countdown reaches 0
             >
               {currentQuestion > 0 ? 'Play Again' : 'Start Quiz'}
             </Button>
@@ -0,0 +1,701 @@
+"""Async serving mode for the upstream-bound routes.
+
+server.py runs on Flask, where every request holds a thread for the whole
+Gemini call (or, for /VideoAnalyzer, for minutes of polling). This module
+serves the same API from an aiohttp event loop. Each route awaits Gemini
+through generate_content_async, so a request that is waiting on the model
+costs a coroutine rather than a thread. The exception is a server pointed at
+GEMINI_API_ENDPOINT (the bench stubs, a proxy). That uses the REST transport,
+which has no async client, so its Gemini calls and stream reads run on the
+thread pool.
+
+Worker model
+------------
+- One event loop per process. Upstream calls are async and limited by
+  ASYNC_UPSTREAM_CONCURRENCY (an asyncio.Semaphore) plus the same
+  per-backend rate limits and circuit breakers as server.py.
+- Work that has no async client runs on the default thread pool: image
+  decoding, Gemini file uploads, and cold-start suggestion generation.
+  Story illustrations always render as a background job on server.py's
+  pool (the same API as {"async": true}), and the response carries its
+  job_id.
+- Run a single process, either directly with `python async_server.py` or
+  with gunicorn:
+      gunicorn async_server:create_app --bind 0.0.0.0:5000 \\
+          --worker-class aiohttp.GunicornWebWorker --workers 1
+  Story jobs, LearnBot sessions and quiz prefetches are kept in process
+  memory. Several processes therefore need sticky routing per client,
+  otherwise job polls get 404s and chats lose their context.
+
+The Flask app in server.py stays the development server, and it is the
+only one with debug reloading.
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import time
+
+from aiohttp import web
+
+import server
+from server import (
+    build_quiz_prompt, build_story_prompt, get_age_band,
+    quiz_cache_key, response_cache, story_cache_key,
+    video_upload_type, QuizStreamParser, VideoSpool, VIDEO_CHUNK_SIZE
+)
+from image_ingest import ImageTooLarge
+from image_store import IMAGE_NAME
+from llm_router import generation_kwargs
+from singleflight import AsyncSingleFlight
+from telemetry import span, start_span, current_span, http_seconds, stats_samples, REGISTRY
+import telemetry
+from upstream import UpstreamError
+
+ASYNC_UPSTREAM_CONCURRENCY = int(os.environ.get("ASYNC_UPSTREAM_CONCURRENCY", "256"))
+# Base64 images in /LearnBot bodies are well over aiohttp's 1 MB default
+ASYNC_MAX_BODY_SIZE = int(os.environ.get("ASYNC_MAX_BODY_SIZE", str(server.LEARN_MAX_BODY_BYTES)))
+
+upstream_slots = asyncio.Semaphore(ASYNC_UPSTREAM_CONCURRENCY)
+generation_flights = AsyncSingleFlight()
+
+# With GEMINI_API_ENDPOINT, server.py configures the REST transport, which has no
+# async client: Gemini calls then run on the thread pool instead
+GEMINI_ASYNC_CLIENT = not server.GEMINI_API_ENDPOINT
+
+
+async def gemini_generate(contents, timeout=None, target=None, stage="generate", **kwargs):
+    with span(f"gemini.{stage}", model=server.MODEL_NAME) as s:
+        response = await gemini_open(contents, timeout, target, **kwargs)
+        server.record_usage(s, response)
+        return response
+
+
+async def generate_text(task, prompt, system=None, **options):
+    # Gemini-only tasks stay on the event loop; anything else goes through the router on a thread
+    if server.llm_router.chain(task) == ["gemini"]:
+        response = await gemini_generate(prompt, target=system, stage=task, **generation_kwargs(**options))
+        return response.text
+    return await run_blocking(server.llm_router.generate, task, prompt, system=system, **options)
+
+
+async def gemini_open(contents, timeout=None, target=None, **kwargs):
+    # Building a handle can be a network call (a context cache, on first use and after it expires)
+    model = await run_blocking((target or server.model).get)
+
+    def call(remaining):
+        if GEMINI_ASYNC_CLIENT:
+            return model.generate_content_async(contents, request_options={"timeout": remaining}, **kwargs)
+        return run_blocking(model.generate_content, contents, request_options={"timeout": remaining}, **kwargs)
+
+    return await server.gemini_upstream.acall(call, upstream_slots, timeout=timeout)
+
+
+async def iterate_blocking(iterable):
+    # A blocking iterator (a REST stream) read one item at a time on the thread pool
+    iterator = iter(iterable)
+    done = object()
+    while True:
+        item = await run_blocking(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+async def gemini_stream(contents, stage="stream", **kwargs):
+    # As in server.gemini_stream, the span covers the whole stream and is ended by hand
+    s = start_span(f"gemini.{stage}", model=server.MODEL_NAME, stream=True)
+    status = "error"
+    chunk = None
+    try:
+        response = await gemini_open(contents, stream=True, **kwargs)
+        async for chunk in (response if GEMINI_ASYNC_CLIENT else iterate_blocking(response)):
+            if "first_chunk_ms" not in s.attrs:
+                s.set(first_chunk_ms=round((time.monotonic() - s.start) * 1000, 3))
+            if chunk.parts:
+                yield chunk.text
+        server.record_usage(s, chunk)
+        status = "ok"
+    except GeneratorExit:
+        status = "cancelled"
+        raise
+    finally:
+        s.end(status)
+
+
+def cache_requested(request, input_data):
+    if "no-cache" in request.headers.get("Cache-Control", ""):
+        return False
+    return input_data.get("cache", True) is not False
+
+
+async def run_blocking(fn, *args, **kwargs):
+    # Runs in a copy of the current context so spans opened by fn keep their parent
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(context.run, fn, *args, **kwargs)
+    )
+
+
+# ============ MIDDLEWARE ============
+
+@web.middleware
+async def cors_middleware(request, handler):
+    if request.method == "OPTIONS":
+        response = web.Response()
+    else:
+        response = await handler(request)
+    if not response.prepared:
+        response.headers["Access-Control-Allow-Origin"] = "*"
+        response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+    return response
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    route = request.match_info.route.resource.canonical if request.match_info.route.resource else "unmatched"
+    request_span = start_span("http.request", method=request.method, path=request.path, route=route)
+    token = current_span.set(request_span)
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        current_span.reset(token)
+        http_seconds.observe(
+            time.monotonic() - request_span.start, route=route, method=request.method, status=status
+        )
+        request_span.set(status_code=status)
+        request_span.end("ok" if status < 500 else "error")
+
+
+@web.middleware
+async def upstream_error_middleware(request, handler):
+    try:
+        return await handler(request)
+    except UpstreamError as e:
+        print("Upstream unavailable:", e)
+        return web.json_response({"error": str(e)}, status=503)
+
+
+# ============ STREAMING HELPERS ============
+
+async def open_stream(request, content_type):
+    response = web.StreamResponse(headers={
+        "Content-Type": content_type,
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        "Access-Control-Allow-Origin": "*",
+    })
+    await response.prepare(request)
+    return response
+
+
+async def stream_sse(request, contents, on_complete=None, stage="stream", target=None):
+    response = await open_stream(request, "text/event-stream")
+    chunks = []
+    try:
+        async for text in gemini_stream(contents, stage=stage, target=target):
+            chunks.append(text)
+            await response.write(server.sse_event({"delta": text}).encode("utf-8"))
+
+        text = "".join(chunks)
+        extra = await on_complete(text) if on_complete else {}
+        await response.write(server.sse_event({"response": text, **extra}, event="done").encode("utf-8"))
+    except Exception as e:
+        print("Error streaming response:", e)
+        await response.write(server.sse_event({"error": "Failed to generate response"}, event="error").encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+# ============ ROUTES ============
+
+async def story_teller(request):
+    input_data = await request.json()
+    input_text = input_data.get("text", "")
+    age = input_data.get("age", 10)
+    key = story_cache_key(input_text, age)
+
+    story = response_cache.get(key) if cache_requested(request, input_data) else None
+    if not story:
+        async def generate():
+            return await generate_text("story", build_story_prompt(input_text), system=server.story_model(age))
+
+        with span("story.generate", age_band=get_age_band(age)):
+            story = await generation_flights.do(("story", key), generate)
+        if story:
+            response_cache.set(key, story)
+
+    server.prefetch_quiz(story, age)
+    story_id = await run_blocking(server.save_story, input_text, story, age)
+    return web.json_response({"response": story, "story_id": story_id, "job_id": server.start_story_job(story)})
+
+
+async def story_teller_stream(request):
+    input_data = await request.json()
+    input_text = input_data.get("text", "")
+    age = input_data.get("age", 10)
+    key = story_cache_key(input_text, age)
+
+    cached = response_cache.get(key) if cache_requested(request, input_data) else None
+    if cached:
+        server.prefetch_quiz(cached, age)
+        response = await open_stream(request, "text/event-stream")
+        await response.write(server.sse_event({"delta": cached}).encode("utf-8"))
+        story_id = await run_blocking(server.save_story, input_text, cached, age)
+        done = {"response": cached, "story_id": story_id, "job_id": server.start_story_job(cached)}
+        await response.write(server.sse_event(done, event="done").encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    async def finish_story(story):
+        if story:
+            response_cache.set(key, story)
+            server.prefetch_quiz(story, age)
+        story_id = await run_blocking(server.save_story, input_text, story, age)
+        return {"story_id": story_id, "job_id": server.start_story_job(story)}
+
+    return await stream_sse(
+        request, build_story_prompt(input_text), on_complete=finish_story, stage="story", target=server.story_model(age)
+    )
+
+
+async def story_job_status(request):
+    job = server.get_story_job(request.match_info["job_id"])
+    if job is None:
+        return web.json_response({"error": "Unknown story job"}, status=404)
+    return web.json_response(job)
+
+
+async def image_file(request):
+    name = request.match_info["name"]
+    path = server.image_store.path(name)
+    if not IMAGE_NAME.match(name) or not os.path.exists(path):
+        raise web.HTTPNotFound()
+    return web.FileResponse(path, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
+async def quiz_bot(request):
+    input_data = await request.json()
+    input_text = input_data.get("text", "")
+    age = input_data.get("age", 10)
+    key = quiz_cache_key(input_text, age)
+    use_cache = cache_requested(request, input_data)
+    if input_data.get("stream"):
+        # Only a finished prefetch, so the stream starts right away
+        cached = server.claim_prefetched_quiz(input_text, age, use_cache, wait=False)
+    else:
+        # Waiting on a prefetch still in flight happens off the event loop
+        cached = await run_blocking(server.claim_prefetched_quiz, input_text, age, use_cache)
+    cached = cached or (response_cache.get(key) if use_cache else None)
+
+    if input_data.get("stream"):
+        response = await open_stream(request, "application/x-ndjson")
+        if cached:
+            for question in cached:
+                await response.write((json.dumps(question) + "\n").encode("utf-8"))
+        else:
+            parser = QuizStreamParser()
+            quiz_data = []
+            try:
+                story = await run_blocking(server.compact_story, input_text)
+                async for text in gemini_stream(build_quiz_prompt(story), stage="quiz", target=server.quiz_model(age)):
+                    for question in parser.feed(text):
+                        quiz_data.append(question)
+                        await response.write((json.dumps(question) + "\n").encode("utf-8"))
+                for question in parser.close():
+                    quiz_data.append(question)
+                    await response.write((json.dumps(question) + "\n").encode("utf-8"))
+                if quiz_data:
+                    response_cache.set(key, quiz_data)
+                    await run_blocking(server.save_quiz, input_text, quiz_data, age)
+            except Exception as e:
+                print("Error streaming quiz:", e)
+                await response.write((json.dumps({"error": "Failed to generate quiz"}) + "\n").encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    if not cached:
+        cached = await generate_quiz(input_text, age)
+
+    return web.json_response({"response": cached})
+
+
+async def generate_quiz(input_text, age=10):
+    key = quiz_cache_key(input_text, age)
+
+    async def generate():
+        story = await run_blocking(server.compact_story, input_text)
+        return await generate_quiz_questions(story, age)
+
+    with span("quiz.generate", age_band=get_age_band(age)) as s:
+        quiz_data = await generation_flights.do(("quiz", key), generate)
+        s.set(questions=len(quiz_data))
+    if quiz_data:
+        response_cache.set(key, quiz_data)
+        await run_blocking(server.save_quiz, input_text, quiz_data, age)
+    return quiz_data
+
+
+async def generate_quiz_questions(story, age=10):
+    # As server.generate_quiz_questions: structured output, then only the malformed questions again
+    system = server.quiz_model(age)
+
+    async def ask(count, avoid=()):
+        prompt = server.build_quiz_json_prompt(story, count, avoid)
+        text = await generate_text("quiz", prompt, system=system, schema=server.QUIZ_SCHEMA)
+        return server.parse_quiz_json(text, count)
+
+    questions, malformed = await ask(server.QUIZ_QUESTIONS)
+    server.quiz_questions.inc(len(questions), outcome="ok")
+    server.quiz_questions.inc(malformed, outcome="malformed")
+    for _ in range(server.QUIZ_REPAIR_ATTEMPTS):
+        if not malformed:
+            break
+        repaired, _ = await ask(malformed, [question["question"] for question in questions])
+        repaired = repaired[:malformed]
+        server.quiz_questions.inc(len(repaired), outcome="repaired")
+        server.quiz_questions.inc(malformed - len(repaired), outcome="malformed")
+        questions += repaired
+        malformed -= len(repaired)
+    return questions
+
+
+async def run_quiz_batch_item(index, item, use_cache=True):
+    # Same result lines as server.run_quiz_batch_item, generated on the event loop
+    result, text, age, error = server.check_quiz_batch_item(index, item)
+    if error:
+        return {**result, "error": error}
+    try:
+        quiz = response_cache.get(quiz_cache_key(text, age)) if use_cache else None
+        quiz = quiz or await generate_quiz(text, age)
+    except UpstreamError as e:
+        return {**result, "error": str(e)}
+    except Exception as e:
+        print(f"Error generating quiz for batch item {index}:", e)
+        quiz = None
+    if not quiz:
+        return {**result, "error": "Failed to generate quiz"}
+    return {**result, "response": quiz}
+
+
+async def quiz_batch(request):
+    input_data = await request.json()
+    items, error = server.read_quiz_batch(input_data)
+    if error:
+        return web.json_response({"error": error}, status=400)
+    use_cache = cache_requested(request, input_data)
+
+    # At most QUIZ_BATCH_WORKERS items of this batch wait on Gemini at once
+    slots = asyncio.Semaphore(server.QUIZ_BATCH_WORKERS)
+
+    async def run(index, item):
+        async with slots:
+            return await run_quiz_batch_item(index, item, use_cache)
+
+    response = await open_stream(request, "application/x-ndjson")
+    tasks = [asyncio.ensure_future(run(index, item)) for index, item in enumerate(items)]
+    failed = 0
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            failed += "error" in result
+            await response.write((json.dumps(result) + "\n").encode("utf-8"))
+    finally:
+        for task in tasks:
+            task.cancel()
+    await response.write((json.dumps({"done": True, "items": len(items), "failed": failed}) + "\n").encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def read_image_part(part):
+    # Reads a multipart image without ever buffering more than LEARN_IMAGE_MAX_BYTES + one chunk
+    chunks, size = [], 0
+    chunk = await part.read_chunk()
+    while chunk:
+        size += len(chunk)
+        if size > server.learn_images.max_bytes:
+            raise ImageTooLarge(f"Image is larger than {server.learn_images.max_bytes} bytes")
+        chunks.append(chunk)
+        chunk = await part.read_chunk()
+    return b"".join(chunks)
+
+
+def ingest_image(load, data):
+    with span("learn.image_ingest") as s:
+        image = load(data)
+        s.bytes(read=len(data), written=len(image["data"]))
+        return image
+
+
+async def read_learn_input(request):
+    # Returns (turn, error_response) for both LearnBot routes; JSON with base64 or multipart
+    fields, image = {}, None
+    try:
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            async for part in reader:
+                if part.name in ("text", "session_id", "image_hash"):
+                    fields[part.name] = await part.text()
+                elif part.name == "image":
+                    data = await read_image_part(part)
+                    image = await run_blocking(ingest_image, server.learn_images.from_bytes, data) if data else None
+        elif request.content_type == "application/x-www-form-urlencoded":
+            # A form without a file is not sent as multipart
+            fields = dict(await request.post())
+        else:
+            fields = await request.json()
+            image_base64 = fields.get("image", "")
+            if image_base64:
+                image = await run_blocking(ingest_image, server.learn_images.from_base64, image_base64)
+    except ImageTooLarge as e:
+        print("Rejected image:", e)
+        return None, web.json_response({"error": str(e)}, status=413)
+    except Exception as e:
+        print("Error decoding or verifying image:", e)
+        return None, web.json_response({"error": "Invalid image data"}, status=400)
+
+    turn, error = server.start_learn_turn(
+        fields.get("session_id"), fields.get("text", ""), image, fields.get("image_hash")
+    )
+    if error is not None:
+        return None, web.json_response({"error": error}, status=400)
+    return turn, None
+
+
+async def learn_bot(request):
+    turn, error = await read_learn_input(request)
+    if error is not None:
+        return error
+
+    try:
+        response = await gemini_generate(turn["contents"], stage="learn")
+        return web.json_response({"response": response.text, **server.finish_learn_turn(turn, response.text)})
+    except UpstreamError:
+        raise
+    except Exception as e:
+        print("Error generating response:", e)
+        return web.json_response({"error": "Failed to generate response"}, status=500)
+
+
+async def learn_bot_stream(request):
+    turn, error = await read_learn_input(request)
+    if error is not None:
+        return error
+
+    async def finish_turn(reply):
+        return server.finish_learn_turn(turn, reply)
+
+    return await stream_sse(request, turn["contents"], on_complete=finish_turn, stage="learn")
+
+
+async def ai_suggestion_bot(request):
+    age = request.query.get("age")
+    try:
+        band = get_age_band(age) if age else None
+    except ValueError:
+        return web.json_response({"error": "Invalid age"}, status=400)
+
+    # Warm bands are a memory read; only a cold band waits on the pool's generator thread
+    try:
+        return web.json_response({"response": await run_blocking(server.suggestion_pool.get, band)})
+    except Exception as e:
+        print("Error generating suggestions:", e)
+        return web.json_response({"error": "Failed to generate suggestions"}, status=500)
+
+
+async def wait_for_video(video_file):
+    delay = server.VIDEO_POLL_INITIAL
+    with span("video.processing_wait") as s:
+        polls = 0
+        while video_file.state.name == "PROCESSING":
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, server.VIDEO_POLL_MAX)
+            video_file = await run_blocking(server.gemini_upstream.call, lambda remaining: server.genai_module.get().get_file(video_file.name))
+            polls += 1
+        s.set(polls=polls)
+
+    if video_file.state.name == "FAILED":
+        raise ValueError(video_file.state.name)
+    return video_file
+
+
+async def analyze_video(path, digest, mime_type=None):
+    # Returns (reply text, pre-processing report); encoding and upload run off the event loop
+    key = f"{server.VIDEO_PROFILE}:{digest}"
+
+    async def upload():
+        video_file = await run_blocking(server.find_uploaded_video, key)
+        if video_file is not None:
+            print(f"Reusing upload {video_file.name} for identical video")
+            report = {"reused_upload": True}
+        else:
+            video_file, report = await run_blocking(server.preprocess_and_upload, path, mime_type)
+            server.remember_uploaded_video(key, video_file.name)
+        return await wait_for_video(video_file), report
+
+    video_file, report = await generation_flights.do(("video", key), upload)
+    print(f'Video processing complete: {video_file.uri}')
+
+    response = await gemini_generate(
+        [server.VIDEO_PROMPT, video_file], timeout=600, target=server.video_model, stage="video"
+    )
+    return response.text, report
+
+
+async def video_analyzer_upload(request):
+    # The recording arrives as multipart ("video" field) or as the raw request body
+    if request.content_type.startswith("multipart/"):
+        reader = await request.multipart()
+        part = await reader.next()
+        while part is not None and part.name != "video":
+            part = await reader.next()
+        if part is None:
+            return web.json_response({"error": "No video provided"}, status=400)
+        mime_type, suffix = video_upload_type(part.headers.get("Content-Type", "").split(";")[0])
+        read_chunk = part.read_chunk
+    else:
+        mime_type, suffix = video_upload_type(request.content_type)
+        read_chunk = request.content.read
+
+    spool = VideoSpool(suffix)
+    try:
+        with span("video.receive") as s:
+            chunk = await read_chunk(VIDEO_CHUNK_SIZE)
+            while chunk:
+                spool.write(chunk)
+                chunk = await read_chunk(VIDEO_CHUNK_SIZE)
+            s.bytes(written=spool.size)
+    except ValueError as e:
+        spool.discard()
+        return web.json_response({"error": str(e)}, status=413)
+    digest = spool.close()
+
+    try:
+        if spool.size == 0:
+            return web.json_response({"error": "No video provided"}, status=400)
+        response, report = await analyze_video(spool.path, digest, mime_type)
+        return web.json_response({"response": response, "video": report})
+    except UpstreamError:
+        raise
+    except Exception as e:
+        print("Error analyzing video:", e)
+        return web.json_response({"error": "Failed to analyze video"}, status=500)
+    finally:
+        spool.discard()
+
+
+async def library_stories(request):
+    limit, offset, error = server.read_page_args(request.query)
+    if error:
+        return web.json_response({"error": error}, status=400)
+    found, total = await run_blocking(server.story_library.list, limit, offset, request.query.get("age_band") or None)
+    return web.json_response({"stories": [server.library_summary(story) for story in found], "total": total})
+
+
+async def library_search(request):
+    limit, _, error = server.read_page_args(request.query)
+    if error:
+        return web.json_response({"error": error}, status=400)
+    found = await run_blocking(server.story_library.search, request.query.get("q", ""), limit)
+    return web.json_response({"stories": [server.library_summary(story) for story in found]})
+
+
+async def library_story(request):
+    found = await run_blocking(server.story_library.get, request.match_info["story_key"])
+    if found is None:
+        return web.json_response({"error": "Unknown story"}, status=404)
+    images = found.pop("images")
+    return web.json_response({**found, **server.image_urls(images)})
+
+
+async def cache_stats(request):
+    return web.json_response({
+        **response_cache.stats(),
+        "flights": generation_flights.stats(),
+        "suggestions": server.suggestion_pool.stats(),
+        "learn_images": server.learn_images.stats(),
+        "image_store": server.image_store.stats(),
+        "quiz_prefetch": server.quiz_prefetcher.stats(),
+        "story_library": server.story_library.stats(),
+        "learn_sessions": server.learn_sessions.stats(),
+        "compaction": server.compactor.stats()
+    })
+
+
+async def upstream_stats(request):
+    return web.json_response({
+        **{name: backend.stats() for name, backend in server.upstream_backends().items()},
+        "router": server.llm_router.stats(),
+        "models": server.model_registry.stats(),
+        "video_preprocess": server.video_preprocessor.stats()
+    })
+
+
+@REGISTRY.collector
+def async_component_metrics():
+    return [
+        ("app_component_stat", "gauge", "Counters and sizes also reported by /CacheStats and /UpstreamStats.",
+         stats_samples({"async_flights": generation_flights.stats()})),
+    ]
+
+
+async def healthz(request):
+    return web.json_response({"status": "ok"})
+
+
+async def readyz(request):
+    return web.json_response(server.warmup.report(), status=200 if server.warmup.ready else 503)
+
+
+async def run_warmup(request):
+    report = await run_blocking(server.warmup.run)
+    return web.json_response(report, status=200 if report["state"] == "ready" else 503)
+
+
+async def metrics(request):
+    return web.Response(
+        body=telemetry.render().encode("utf-8"), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+
+async def create_app():
+    app = web.Application(
+        middlewares=[metrics_middleware, cors_middleware, upstream_error_middleware],
+        client_max_size=ASYNC_MAX_BODY_SIZE
+    )
+    app.add_routes([
+        web.post("/StoryTeller", story_teller),
+        web.post("/StoryTeller/stream", story_teller_stream),
+        web.get("/StoryTeller/jobs/{job_id}", story_job_status),
+        web.get("/images/{name}", image_file),
+        web.get("/stories", library_stories),
+        web.get("/stories/search", library_search),
+        web.get("/stories/{story_key}", library_story),
+        web.post("/QuizBot", quiz_bot),
+        web.post("/QuizBot/batch", quiz_batch),
+        web.post("/LearnBot", learn_bot),
+        web.post("/LearnBot/stream", learn_bot_stream),
+        web.get("/AiSuggestionBot", ai_suggestion_bot),
+        web.post("/VideoAnalyzer", video_analyzer_upload),
+        web.get("/CacheStats", cache_stats),
+        web.get("/UpstreamStats", upstream_stats),
+        web.get("/healthz", healthz),
+        web.get("/readyz", readyz),
+        web.post("/warmup", run_warmup),
+        web.get("/metrics", metrics),
+    ])
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), port=int(os.environ.get("PORT", "5000")))
@@ -0,0 +1,423 @@
+"""Offline load test for server.py and async_server.py.
+
+Starts the stub backends (bench/stubs.py) and the server pointed at them,
+then drives each route at a fixed concurrency and prints a JSON baseline:
+p50/p95/p99 latency, time to first byte for streaming routes, throughput,
+error counts, and server RSS (peak for the whole run and per route). The
+server's /UpstreamStats and /CacheStats are included at the end.
+
+    cd my-app
+    python -m bench.run --concurrency 16 --requests 64 --output baseline.json
+    python -m bench.run --routes quiz,story_job --gemini-error-rate 0.05
+    python -m bench.run --server-env GEMINI_RATE_LIMIT=50 --server-env VIDEO_PROFILE=balanced
+    python -m bench.run --routes story,suggestions --local-llm --local-latency 0.2
+    python -m bench.run --server async --routes story,quiz_stream,learn
+
+Every request carries unique text so the response cache does not hide the
+backends; --repeat-ratio sends that share of requests with a fixed text to
+measure cache hits. --target runs against an already running server
+instead of starting one; in that case RSS is only reported when --pid is
+given.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from io import BytesIO
+
+import aiohttp
+from PIL import Image
+
+from bench import stubs
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STORY_SEED = "A curious fox finds a golden key in the forest"
+
+
+# ============ SCENARIOS ============
+# Each scenario sends one request and returns the time to first byte (or None)
+
+async def story(session, base, text, ctx):
+    async with session.post(f"{base}/StoryTeller", json={"text": text, "age": ctx.age}) as response:
+        await expect_ok(response)
+        await response.read()
+
+
+async def story_job(session, base, text, ctx):
+    # Latency covers the story and every illustration; first byte is the story itself
+    started = time.monotonic()
+    async with session.post(f"{base}/StoryTeller", json={"text": text, "age": ctx.age, "async": True}) as response:
+        await expect_ok(response)
+        job_id = (await response.json())["job_id"]
+    first_byte = time.monotonic() - started
+
+    while True:
+        async with session.get(f"{base}/StoryTeller/jobs/{job_id}") as response:
+            await expect_ok(response)
+            job = await response.json()
+        if job["status"] not in ("queued", "running"):
+            if job["status"] == "failed":
+                raise RuntimeError("story job failed")
+            return first_byte
+        await asyncio.sleep(0.25)
+
+
+async def story_stream(session, base, text, ctx):
+    return await read_stream(session.post(f"{base}/StoryTeller/stream", json={"text": text, "age": ctx.age}))
+
+
+async def quiz(session, base, text, ctx):
+    async with session.post(f"{base}/QuizBot", json={"text": text, "age": ctx.age}) as response:
+        await expect_ok(response)
+        if not (await response.json()).get("response"):
+            raise RuntimeError("empty quiz")
+
+
+async def quiz_stream(session, base, text, ctx):
+    return await read_stream(session.post(f"{base}/QuizBot", json={"text": text, "age": ctx.age, "stream": True}))
+
+
+async def learn(session, base, text, ctx):
+    async with session.post(f"{base}/LearnBot", json={"text": text}) as response:
+        await expect_ok(response)
+        await response.read()
+
+
+async def learn_image(session, base, text, ctx):
+    form = aiohttp.FormData()
+    form.add_field("text", text)
+    form.add_field("image", ctx.image, filename="drawing.jpg", content_type="image/jpeg")
+    async with session.post(f"{base}/LearnBot", data=form) as response:
+        await expect_ok(response)
+        await response.read()
+
+
+async def learn_stream(session, base, text, ctx):
+    return await read_stream(session.post(f"{base}/LearnBot/stream", json={"text": text}))
+
+
+async def suggestions(session, base, text, ctx):
+    async with session.get(f"{base}/AiSuggestionBot", params={"age": str(ctx.age)}) as response:
+        await expect_ok(response)
+        await response.read()
+
+
+async def video(session, base, text, ctx):
+    # Unique bytes per request unless repeated, so upload dedupe only kicks in on purpose
+    body = ctx.video if text == ctx.repeat_text else ctx.video + text.encode("utf-8")
+    async with session.post(f"{base}/VideoAnalyzer", data=body, headers={"Content-Type": "video/webm"}) as response:
+        await expect_ok(response)
+        await response.read()
+
+
+SCENARIOS = {
+    "story": story,
+    "story_job": story_job,
+    "story_stream": story_stream,
+    "quiz": quiz,
+    "quiz_stream": quiz_stream,
+    "learn": learn,
+    "learn_image": learn_image,
+    "learn_stream": learn_stream,
+    "suggestions": suggestions,
+    "video": video,
+}
+
+
+async def expect_ok(response):
+    if response.status >= 400:
+        raise RuntimeError(f"HTTP {response.status}")
+
+
+async def read_stream(request):
+    started = time.monotonic()
+    first_byte = None
+    body = b""
+    async with request as response:
+        await expect_ok(response)
+        async for chunk in response.content.iter_any():
+            if first_byte is None:
+                first_byte = time.monotonic() - started
+            body += chunk
+    # Streams answer 200 before the model does, so a failure shows up as an error event
+    if b"event: error" in body or b'"error"' in body:
+        raise RuntimeError("stream ended with an error")
+    return first_byte
+
+
+# ============ MEASUREMENT ============
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return round(ordered[index], 4)
+
+
+def summarize(values):
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "mean": round(sum(values) / len(values), 4) if values else None,
+        "max": round(max(values), 4) if values else None,
+    }
+
+
+def read_rss(pid):
+    # (current RSS, peak RSS) in bytes from /proc; None where unavailable
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return None, None
+    to_bytes = lambda name: int(fields[name].split()[0]) * 1024 if name in fields else None
+    return to_bytes("VmRSS"), to_bytes("VmHWM")
+
+
+async def run_route(name, session, base, ctx):
+    scenario = SCENARIOS[name]
+    latencies, first_bytes, errors = [], [], {}
+    peak_rss = 0
+    queue = asyncio.Queue()
+    for i in range(ctx.requests):
+        # Spreads the repeated inputs evenly through the run
+        repeat = int((i + 1) * ctx.repeat_ratio) > int(i * ctx.repeat_ratio)
+        queue.put_nowait(ctx.repeat_text if repeat else f"{STORY_SEED} ({ctx.run_id} {name} #{i})")
+
+    async def worker():
+        while not queue.empty():
+            text = queue.get_nowait()
+            started = time.monotonic()
+            try:
+                first_byte = await asyncio.wait_for(scenario(session, base, text, ctx), ctx.timeout)
+            except Exception as e:
+                reason = "timeout" if isinstance(e, asyncio.TimeoutError) else str(e) or type(e).__name__
+                errors[reason] = errors.get(reason, 0) + 1
+                continue
+            latencies.append(time.monotonic() - started)
+            if first_byte is not None:
+                first_bytes.append(first_byte)
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            rss, _ = read_rss(ctx.pid) if ctx.pid else (None, None)
+            peak_rss = max(peak_rss, rss or 0)
+            await asyncio.sleep(0.1)
+
+    sampler = asyncio.create_task(sample_rss())
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(ctx.concurrency)))
+    elapsed = time.monotonic() - started
+    sampler.cancel()
+
+    result = {
+        "requests": ctx.requests,
+        "ok": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 3) if elapsed else None,
+        "latency": summarize(latencies),
+    }
+    if first_bytes:
+        result["first_byte"] = summarize(first_bytes)
+    if ctx.pid:
+        result["peak_rss_bytes"] = peak_rss or None
+    return result
+
+
+# ============ PROCESSES ============
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stubs(args, port):
+    command = [sys.executable, "-m", "bench.stubs", "--port", str(port)]
+    for action in stub_actions():
+        command += [action.option_strings[0], str(getattr(args, action.dest))]
+    return subprocess.Popen(command, cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def stub_actions():
+    parser = argparse.ArgumentParser()
+    stubs.add_arguments(parser)
+    return [action for action in parser._actions if action.option_strings and action.dest != "help"]
+
+
+def start_server(args, port, stub_port, log):
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    env = {
+        **os.environ,
+        "GEMINI_API_ENDPOINT": stub_url,
+        "GEMINI_API_KEY": "bench",
+        "HF_INFERENCE_URL": f"{stub_url}/sdxl",
+        "HF_TOKEN": "",
+        "RESPONSE_CACHE_DIR": "",
+        "IMAGE_STORE_DIR": tempfile.mkdtemp(prefix="bench-images-"),
+        "STORY_LIBRARY_DB": os.path.join(tempfile.mkdtemp(prefix="bench-library-"), "stories.sqlite3"),
+        "SUGGESTION_PREWARM": "0",
+        "VIDEO_PROFILE": "off",
+        "PYTHONUNBUFFERED": "1",
+    }
+    if args.local_llm:
+        env["LOCAL_LLM_URL"] = stub_url
+    for item in args.server_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    if args.server == "async":
+        env["PORT"] = str(port)
+        command = [sys.executable, "async_server.py"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "server", "run",
+                   "--port", str(port), "--no-reload", "--no-debugger", "--with-threads"]
+    return subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_until_up(session, url, process=None, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode}")
+        try:
+            async with session.get(url) as response:
+                if response.status < 500:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def fetch_json(session, url):
+    try:
+        async with session.get(url) as response:
+            return await response.json()
+    except Exception as e:
+        return {"error": str(e)}
+
+
+# ============ MAIN ============
+
+def make_image(width=2400, height=1800):
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+async def main(args):
+    routes = [route.strip() for route in args.routes.split(",") if route.strip()]
+    unknown = [route for route in routes if route not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown routes: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    ctx = argparse.Namespace(
+        age=args.age,
+        requests=args.requests,
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        repeat_ratio=args.repeat_ratio,
+        repeat_text=STORY_SEED,
+        run_id=uuid.uuid4().hex[:8],
+        image=make_image(),
+        video=open(args.video_file, "rb").read() if args.video_file else os.urandom(args.video_bytes),
+        pid=args.pid,
+    )
+
+    processes = []
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        try:
+            if args.target:
+                base = args.target.rstrip("/")
+            else:
+                stub_port, server_port = free_port(), free_port()
+                stub_process = start_stubs(args, stub_port)
+                processes.append(stub_process)
+                await wait_until_up(session, f"http://127.0.0.1:{stub_port}/stats", stub_process)
+
+                server_process = start_server(args, server_port, stub_port, log)
+                processes.append(server_process)
+                base = f"http://127.0.0.1:{server_port}"
+                await wait_until_up(session, f"{base}/readyz", server_process)
+                ctx.pid = server_process.pid
+
+            results = {}
+            for route in routes:
+                print(f"▶ {route}: {args.requests} requests at concurrency {args.concurrency}", file=sys.stderr)
+                results[route] = await run_route(route, session, base, ctx)
+                latency = results[route]["latency"]
+                print(f"  p50 {latency['p50']}s  p95 {latency['p95']}s  p99 {latency['p99']}s  "
+                      f"{results[route]['throughput']} req/s  errors {results[route]['errors']}", file=sys.stderr)
+
+            rss, peak = read_rss(ctx.pid) if ctx.pid else (None, None)
+            report = {
+                "config": {
+                    key: value for key, value in vars(args).items()
+                    if key not in ("output", "server_log")
+                },
+                "routes": results,
+                "server": {"rss_bytes": rss, "peak_rss_bytes": peak},
+                "upstream_stats": await fetch_json(session, f"{base}/UpstreamStats"),
+                "cache_stats": await fetch_json(session, f"{base}/CacheStats"),
+            }
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            if args.server_log:
+                log.close()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Baseline written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", default=",".join(SCENARIOS), help="comma-separated scenarios to run, in order")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=32, help="requests per route")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before a request counts as failed")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="share of requests that reuse one fixed input")
+    parser.add_argument("--age", type=int, default=8)
+    parser.add_argument("--video-file", help="recording to send to /VideoAnalyzer (default: random bytes)")
+    parser.add_argument("--video-bytes", type=int, default=2 * 1024 * 1024)
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for server.py; repeatable")
+    parser.add_argument("--server", choices=("flask", "async"), default="flask",
+                        help="serve with server.py (Flask) or async_server.py (aiohttp)")
+    parser.add_argument("--server-log", help="file to write the server's output to")
+    parser.add_argument("--local-llm", action="store_true",
+                        help="route small tasks to the stub's Ollama-compatible endpoint (LOCAL_LLM_URL)")
+    parser.add_argument("--target", help="URL of a server that is already running; no processes are started")
+    parser.add_argument("--pid", type=int, help="pid of --target, for RSS sampling")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    stubs.add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,416 @@
+"""Local stand-ins for the Gemini and Hugging Face backends.
+
+One aiohttp server answers the calls server.py makes when it is started
+with GEMINI_API_ENDPOINT / HF_INFERENCE_URL pointing here:
+
+- Gemini REST generateContent, streamGenerateContent and countTokens.
+  Replies are shaped like the real thing, chosen from the prompt and the
+  system instruction: a four-paragraph story, a quiz (as text, or as JSON
+  with --quiz-malformed-rate of its questions broken), a JSON array of
+  image prompts, or a short chat reply.
+- Context caching (POST /v1beta/cachedContents). Contents smaller than
+  --cache-min-tokens are refused, as Gemini refuses small caches. Calls
+  that use a cache report its tokens as cachedContentTokenCount.
+- The File API used by genai.upload_file and genai.get_file: the discovery
+  document, a resumable upload, then PROCESSING for --file-processing
+  seconds before the file turns ACTIVE.
+- SDXL text-to-image (POST /sdxl), which returns a PNG.
+- An Ollama-compatible local model: POST /api/generate (non-streaming) and
+  GET /api/tags, with replies chosen the same way as Gemini's.
+
+Every endpoint waits for a configurable latency (plus uniform jitter) and
+fails a configurable share of calls with a 503, so retries, circuit
+breakers and scheduling can be exercised without spending quota.
+
+    python -m bench.stubs --port 8001 --gemini-latency 0.8 --gemini-error-rate 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from io import BytesIO
+
+from aiohttp import web
+from PIL import Image
+
+STORY = [
+    "Once upon a time, a small fox named Pip lived at the edge of a bright green forest.",
+    "One morning Pip found a shiny key under an old oak tree and wondered what it could open.",
+    "Pip asked the wise owl, who hooted that the key belonged to the forgotten garden by the river.",
+    "At the garden gate Pip turned the key, and a hundred flowers opened to greet the sun. "
+    "From that day on, Pip looked after the garden and shared it with every animal in the forest.",
+]
+
+QUIZ = """Question 1: What animal is Pip?
+a) A rabbit
+b) A fox
+c) An owl
+d) A bear
+Correct Answer: b
+
+Question 2: Where did Pip find the key?
+a) Under an oak tree
+b) In the river
+c) On a rock
+d) In a nest
+Correct Answer: a
+
+Question 3: Who helped Pip?
+a) A frog
+b) A deer
+c) The wise owl
+d) A squirrel
+Correct Answer: c
+"""
+
+QUIZ_JSON = [
+    {"question": "What animal is Pip?", "options": ["A rabbit", "A fox", "An owl", "A bear"], "answer": "b"},
+    {"question": "Where did Pip find the key?", "options": ["Under an oak tree", "In the river", "On a rock", "In a nest"],
+     "answer": "a"},
+    {"question": "Who helped Pip?", "options": ["A frog", "A deer", "The wise owl", "A squirrel"], "answer": "c"},
+]
+
+CHAT = "Great job! That sentence is almost right. Remember to start it with a capital letter."
+
+
+class Stubs:
+    def __init__(self, args):
+        self.args = args
+        self.files = {}
+        self.uploads = {}
+        self.caches = {}
+        self.counters = {"generate": 0, "stream": 0, "local": 0, "caches": 0, "cached_calls": 0, "images": 0, "uploads": 0, "file_gets": 0, "errors": 0}
+        self.png = self._make_png(args.image_size)
+
+    # ---- helpers ----
+
+    async def _delay(self, latency, jitter):
+        await asyncio.sleep(max(latency + random.uniform(-jitter, jitter), 0))
+
+    def _fail(self, rate):
+        if random.random() < rate:
+            self.counters["errors"] += 1
+            return web.json_response(
+                {"error": {"code": 503, "message": "stub backend overloaded", "status": "UNAVAILABLE"}}, status=503
+            )
+        return None
+
+    def _make_png(self, size):
+        image = Image.linear_gradient("L").resize((size, size)).convert("RGB")
+        output = BytesIO()
+        image.save(output, format="PNG")
+        return output.getvalue()
+
+    def _base_url(self, request):
+        return f"{request.scheme}://{request.host}"
+
+    def _reply_text(self, body):
+        cached = self.caches.get(body.get("cachedContent"), {})
+        contents = [body.get("systemInstruction") or {}, cached.get("systemInstruction") or {}, *body.get("contents", [])]
+        prompt = " ".join(part.get("text", "") for content in contents for part in content.get("parts", []))
+        config = body.get("generationConfig", {})
+        if config.get("responseMimeType") == "application/json" and "multiple-choice questions" in prompt.lower():
+            match = re.search(r"(\d+) multiple-choice questions", prompt)
+            return json.dumps([self._quiz_question(i) for i in range(int(match.group(1)) if match else 3)])
+        if config.get("responseMimeType") == "application/json":
+            match = re.search(r"following (\d+) story paragraphs", prompt)
+            count = int(match.group(1)) if match else 1
+            # A fresh tag per call so every story renders new pictures, as real prompts would
+            tag = uuid.uuid4().hex[:6]
+            return json.dumps([f"A storybook illustration of scene {i + 1} ({tag})" for i in range(count)])
+        lowered = prompt.lower()
+        if "multiple-choice questions" in lowered:
+            return QUIZ
+        if "tell a story" in lowered:
+            return "\n\n".join(STORY).replace("Pip", f"Pip the {random.randint(2, 999)}th", 1)
+        return CHAT
+
+    def _quiz_question(self, index):
+        question = dict(QUIZ_JSON[index % len(QUIZ_JSON)])
+        question["question"] = f"{question['question']} ({index + 1})"
+        if random.random() < self.args.quiz_malformed_rate:
+            # The ways a real reply goes wrong: a lost option, or an answer that is not a letter
+            broken = random.choice(("options", "answer"))
+            question[broken] = question["options"][:2] if broken == "options" else "the fox"
+        return question
+
+    def _prompt_tokens(self, body):
+        # As Gemini counts them: the system instruction and the request contents, plus any cached content
+        tokens = len(json.dumps([body.get("systemInstruction"), body.get("contents", [])])) // 4
+        cached = self.caches.get(body.get("cachedContent"))
+        return tokens + (cached["tokens"] if cached else 0), (cached["tokens"] if cached else 0)
+
+    def _candidate(self, text, prompt_tokens=0, cached_tokens=0):
+        usage = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": len(text) // 4,
+            "totalTokenCount": prompt_tokens + len(text) // 4,
+        }
+        if cached_tokens:
+            usage["cachedContentTokenCount"] = cached_tokens
+        return {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": usage,
+        }
+
+    # ---- Gemini generateContent ----
+
+    async def generate(self, request):
+        action = request.match_info["action"]
+        body = await request.json()
+        prompt_tokens, cached_tokens = self._prompt_tokens(body)
+        self.counters["cached_calls"] += bool(cached_tokens)
+        args = self.args
+
+        if action == "countTokens":
+            # Used by the server's warmup check; free and fast, as upstream
+            return web.json_response({"totalTokens": prompt_tokens})
+
+        if action == "streamGenerateContent":
+            self.counters["stream"] += 1
+            await self._delay(args.gemini_ttft, args.gemini_jitter)
+            failure = self._fail(args.gemini_error_rate)
+            if failure is not None:
+                return failure
+            return await self._stream(request, self._reply_text(body), prompt_tokens, cached_tokens)
+
+        self.counters["generate"] += 1
+        await self._delay(args.gemini_latency, args.gemini_jitter)
+        failure = self._fail(args.gemini_error_rate)
+        if failure is not None:
+            return failure
+        return web.json_response(self._candidate(self._reply_text(body), prompt_tokens, cached_tokens))
+
+    async def _stream(self, request, text, prompt_tokens, cached_tokens=0):
+        # The REST transport reads one JSON array whose elements arrive over time
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        await response.prepare(request)
+
+        # Split on spaces only, so paragraph and line breaks survive inside the pieces
+        words = text.split(" ")
+        size = max(len(words) // self.args.stream_chunks, 1)
+        pieces = [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)]
+        pieces[-1] = pieces[-1].rstrip(" ")
+        await response.write(b"[")
+        for i, piece in enumerate(pieces):
+            if i:
+                await response.write(b",\r\n")
+                await asyncio.sleep(self.args.stream_interval)
+            await response.write(json.dumps(self._candidate(piece, prompt_tokens, cached_tokens)).encode("utf-8"))
+        await response.write(b"]")
+        await response.write_eof()
+        return response
+
+    # ---- Gemini context caching ----
+
+    async def create_cache(self, request):
+        body = await request.json()
+        tokens = len(json.dumps([body.get("systemInstruction"), body.get("contents", [])])) // 4
+        if tokens < self.args.cache_min_tokens:
+            message = f"Cached content is too small. total_token_count={tokens}, min_total_token_count={self.args.cache_min_tokens}"
+            return web.json_response({"error": {"code": 400, "message": message, "status": "INVALID_ARGUMENT"}}, status=400)
+
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        ttl = float(str(body.get("ttl", "3600s")).rstrip("s"))
+        self.caches[name] = {"systemInstruction": body.get("systemInstruction"), "tokens": tokens}
+        self.counters["caches"] += 1
+        now = time.time()
+        return web.json_response({
+            "name": name,
+            "model": body.get("model", ""),
+            "displayName": body.get("displayName", ""),
+            "createTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)),
+            "updateTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)),
+            "expireTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now + ttl)),
+            "usageMetadata": {"totalTokenCount": tokens},
+        })
+
+    # ---- Ollama-compatible local model ----
+
+    async def local_generate(self, request):
+        body = await request.json()
+        self.counters["local"] += 1
+        await self._delay(self.args.local_latency, self.args.local_jitter)
+        failure = self._fail(self.args.local_error_rate)
+        if failure is not None:
+            return failure
+
+        # Reuse the Gemini reply logic by wrapping the prompt in a generateContent body
+        gemini_body = {"contents": [{"parts": [{"text": body.get("prompt", "")}]}]}
+        if body.get("system"):
+            gemini_body["systemInstruction"] = {"parts": [{"text": body["system"]}]}
+        # "json", or a JSON schema for structured output
+        if body.get("format"):
+            gemini_body["generationConfig"] = {"responseMimeType": "application/json"}
+        text = self._reply_text(gemini_body)
+        return web.json_response({
+            "model": body.get("model", "stub"),
+            "response": text,
+            "done": True,
+            "prompt_eval_count": len(body.get("prompt", "")) // 4,
+            "eval_count": len(text) // 4,
+        })
+
+    async def local_tags(self, request):
+        return web.json_response({"models": [{"name": "stub"}]})
+
+    # ---- File API ----
+
+    async def discovery(self, request):
+        base = self._base_url(request) + "/"
+        return web.json_response(discovery_document(base))
+
+    async def start_upload(self, request):
+        # Resumable upload, step 1: metadata in, upload URL out
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = {"metadata": await request.json() if request.can_read_body else {}}
+        location = f"{self._base_url(request)}/upload/v1beta/files?upload_id={upload_id}"
+        return web.Response(headers={"Location": location}, status=200)
+
+    async def finish_upload(self, request):
+        upload_id = request.query.get("upload_id")
+        if upload_id not in self.uploads:
+            return await self.start_upload(request)
+
+        size = 0
+        async for chunk in request.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+        del self.uploads[upload_id]
+        self.counters["uploads"] += 1
+
+        await self._delay(self.args.upload_latency, 0)
+        failure = self._fail(self.args.upload_error_rate)
+        if failure is not None:
+            return failure
+
+        file_id = uuid.uuid4().hex[:12]
+        self.files[file_id] = {"created": time.monotonic(), "size": size, "mime_type": request.content_type}
+        return web.json_response({"file": self._file(file_id)})
+
+    async def get_file(self, request):
+        self.counters["file_gets"] += 1
+        file_id = request.match_info["file_id"]
+        if file_id not in self.files:
+            return web.json_response({"error": {"code": 404, "message": "not found", "status": "NOT_FOUND"}}, status=404)
+        await self._delay(self.args.gemini_latency / 4, 0)
+        return web.json_response(self._file(file_id))
+
+    def _file(self, file_id):
+        entry = self.files[file_id]
+        processing = time.monotonic() - entry["created"] < self.args.file_processing
+        return {
+            "name": f"files/{file_id}",
+            "mimeType": entry["mime_type"],
+            "sizeBytes": str(entry["size"]),
+            "uri": f"https://stub.invalid/v1beta/files/{file_id}",
+            "state": "PROCESSING" if processing else "ACTIVE",
+        }
+
+    # ---- SDXL ----
+
+    async def text_to_image(self, request):
+        await request.read()
+        self.counters["images"] += 1
+        await self._delay(self.args.sdxl_latency, self.args.sdxl_jitter)
+        failure = self._fail(self.args.sdxl_error_rate)
+        if failure is not None:
+            return failure
+        return web.Response(body=self.png, content_type="image/png")
+
+    async def stats(self, request):
+        return web.json_response(self.counters)
+
+
+def discovery_document(base):
+    # Just enough of the generativelanguage discovery document for media.upload
+    return {
+        "kind": "discovery#restDescription",
+        "discoveryVersion": "v1",
+        "id": "generativelanguage:v1beta",
+        "name": "generativelanguage",
+        "version": "v1beta",
+        "rootUrl": base,
+        "servicePath": "",
+        "baseUrl": base,
+        "batchPath": "batch",
+        "parameters": {"key": {"type": "string", "location": "query"}},
+        "schemas": {
+            "File": {"id": "File", "type": "object", "properties": {
+                "name": {"type": "string"}, "displayName": {"type": "string"}, "mimeType": {"type": "string"},
+            }},
+            "CreateFileRequest": {"id": "CreateFileRequest", "type": "object", "properties": {"file": {"$ref": "File"}}},
+            "CreateFileResponse": {"id": "CreateFileResponse", "type": "object", "properties": {"file": {"$ref": "File"}}},
+        },
+        "resources": {"media": {"methods": {"upload": {
+            "id": "generativelanguage.media.upload",
+            "path": "v1beta/files",
+            "flatPath": "v1beta/files",
+            "httpMethod": "POST",
+            "parameters": {},
+            "parameterOrder": [],
+            "request": {"$ref": "CreateFileRequest"},
+            "response": {"$ref": "CreateFileResponse"},
+            "supportsMediaUpload": True,
+            "mediaUpload": {
+                "accept": ["*/*"],
+                "maxSize": "2147483648",
+                "protocols": {
+                    "simple": {"multipart": True, "path": "/upload/v1beta/files"},
+                    "resumable": {"multipart": True, "path": "/resumable/upload/v1beta/files"},
+                },
+            },
+        }}}},
+    }
+
+
+def create_app(args):
+    stubs = Stubs(args)
+    app = web.Application(client_max_size=1024 ** 3)
+    app.add_routes([
+        web.post("/v1beta/models/{model}:{action}", stubs.generate),
+        web.post("/v1beta/cachedContents", stubs.create_cache),
+        web.get("/$discovery/rest", stubs.discovery),
+        web.post("/upload/v1beta/files", stubs.start_upload),
+        web.post("/resumable/upload/v1beta/files", stubs.start_upload),
+        web.put("/upload/v1beta/files", stubs.finish_upload),
+        web.get("/v1beta/files/{file_id}", stubs.get_file),
+        web.post("/sdxl", stubs.text_to_image),
+        web.post("/api/generate", stubs.local_generate),
+        web.get("/api/tags", stubs.local_tags),
+        web.get("/stats", stubs.stats),
+    ])
+    return app
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("stub backends")
+    group.add_argument("--gemini-latency", type=float, default=0.8, help="seconds per generateContent call")
+    group.add_argument("--gemini-ttft", type=float, default=0.3, help="seconds before the first streamed chunk")
+    group.add_argument("--gemini-jitter", type=float, default=0.2)
+    group.add_argument("--gemini-error-rate", type=float, default=0.0, help="share of Gemini calls answered 503")
+    group.add_argument("--quiz-malformed-rate", type=float, default=0.0, help="share of JSON quiz questions broken")
+    group.add_argument("--cache-min-tokens", type=int, default=0, help="smallest context cache accepted")
+    group.add_argument("--stream-chunks", type=int, default=20, help="chunks per streamed reply")
+    group.add_argument("--stream-interval", type=float, default=0.05, help="seconds between streamed chunks")
+    group.add_argument("--local-latency", type=float, default=0.2, help="seconds per local /api/generate call")
+    group.add_argument("--local-jitter", type=float, default=0.05)
+    group.add_argument("--local-error-rate", type=float, default=0.0)
+    group.add_argument("--sdxl-latency", type=float, default=3.0, help="seconds per text_to_image call")
+    group.add_argument("--sdxl-jitter", type=float, default=0.5)
+    group.add_argument("--sdxl-error-rate", type=float, default=0.0)
+    group.add_argument("--image-size", type=int, default=1024, help="side of the PNG returned by SDXL")
+    group.add_argument("--upload-latency", type=float, default=0.5, help="seconds to accept a file upload")
+    group.add_argument("--upload-error-rate", type=float, default=0.0)
+    group.add_argument("--file-processing", type=float, default=5.0, help="seconds a file stays PROCESSING")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8001)
+    add_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(create_app(args), port=args.port)
@@ -0,0 +1,254 @@
+"""Server-side LearnBot conversations with a bounded history.
+
+A session holds the exchanges of one chat (the child's message, the hash of
+any image sent with it, and the reply) plus a running summary of older
+exchanges. The client sends only its session id and the new message. The
+server rebuilds the context, so the request size does not grow with the
+conversation.
+
+History is kept within a token budget, estimated at about four characters
+per token plus what Gemini bills for each image (258 tokens per 768px tile):
+- once a session is over token_budget, its older exchanges are folded into
+  the summary by summarize(summary, exchanges) in the background, keeping
+  the last keep_turns exchanges verbatim
+- if summaries fall behind (or fail), exchanges past twice the budget are
+  dropped oldest first, so the context Gemini gets stays bounded either way
+
+Images are stored once per session, keyed by the hash of the prepared JPEG.
+A later message can refer to one by that hash instead of uploading it again.
+With upload(image), a new image is sent inline with its own message and
+uploaded in the background (Gemini's File API). Later turns then refer to
+the uploaded file instead of resending the bytes, so a request stays small
+however many pictures the history holds. Images whose exchanges have been
+summarized are dropped along with them; Gemini deletes the uploaded files
+itself after 48 hours.
+
+Sessions are evicted least recently used past max_sessions and expire after
+ttl seconds idle.
+"""
+
+import contextvars
+import hashlib
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+IMAGE_TOKENS = 258  # what Gemini bills for an image up to 384px, and for each 768px tile of a larger one
+IMAGE_TILE = 768
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1 if text else 0
+
+
+def image_tokens(data):
+    # Reads only the image header
+    try:
+        with Image.open(BytesIO(data)) as image:
+            width, height = image.size
+    except Exception:
+        return IMAGE_TOKENS
+    if width <= 384 and height <= 384:
+        return IMAGE_TOKENS
+    return IMAGE_TOKENS * math.ceil(width / IMAGE_TILE) * math.ceil(height / IMAGE_TILE)
+
+
+def exchange_tokens(exchange, images):
+    tokens = estimate_tokens(exchange["text"]) + estimate_tokens(exchange["reply"])
+    if exchange["image"]:
+        stored = images.get(exchange["image"])
+        tokens += stored["tokens"] if stored else IMAGE_TOKENS
+    return tokens
+
+
+class ChatSessions:
+    def __init__(self, summarize, upload=None, max_sessions=1000, ttl=1800, token_budget=4000, keep_turns=2,
+                 max_images=8, workers=2):
+        self.summarize = summarize
+        self.upload = upload  # upload(image) -> file reference Gemini accepts in place of the blob
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.max_images = max_images
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-summary")
+        self.sessions = OrderedDict()  # id -> session, least recently used first
+        self.lock = threading.Lock()
+        self.counters = {
+            "created": 0, "resumed": 0, "expired": 0, "evicted": 0, "turns": 0, "image_refs": 0,
+            "summaries": 0, "summary_failures": 0, "summarized_turns": 0, "trimmed_turns": 0,
+            "image_uploads": 0, "image_upload_failures": 0,
+        }
+
+    def open(self, session_id=None):
+        """Returns the id of the live session session_id, or of a new one if it is unknown or expired."""
+        with self.lock:
+            self._expire()
+            session = self.sessions.get(session_id) if session_id else None
+            if session is not None:
+                self.sessions.move_to_end(session_id)
+                session["used"] = time.time()
+                self.counters["resumed"] += 1
+                return session_id
+
+            while len(self.sessions) >= self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.counters["evicted"] += 1
+            session_id = uuid.uuid4().hex
+            self.sessions[session_id] = {
+                "summary": "", "exchanges": [], "images": OrderedDict(), "used": time.time(), "compacting": False,
+            }
+            self.counters["created"] += 1
+            return session_id
+
+    def add_image(self, session_id, image):
+        """Keeps an image blob in the session and returns the hash that refers to it."""
+        digest = hashlib.sha256(image["data"]).hexdigest()
+        tokens = image_tokens(image["data"])
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return digest
+            stored = session["images"].get(digest)
+            if stored is None:
+                stored = session["images"][digest] = {"blob": image, "file": None, "tokens": tokens}
+                if self.upload:
+                    self.executor.submit(contextvars.copy_context().run, self._upload, stored)
+            session["images"].move_to_end(digest)
+            self._cap_images(session)
+        return digest
+
+    def image(self, session_id, digest):
+        """Returns what to send Gemini for a stored image (its uploaded file, or the blob until that exists)."""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            stored = session["images"].get(digest) if session else None
+            if stored is None:
+                return None
+            self.counters["image_refs"] += 1
+            return stored["file"] or stored["blob"]
+
+    def history(self, session_id):
+        """Returns (summary, [{"text", "image": file, blob or None, "reply"}, ...]) for building the next prompt."""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return "", []
+            exchanges = []
+            for exchange in session["exchanges"]:
+                stored = session["images"].get(exchange["image"]) if exchange["image"] else None
+                exchanges.append({**exchange, "image": (stored["file"] or stored["blob"]) if stored else None})
+            return session["summary"], exchanges
+
+    def record(self, session_id, text, image_digest, reply):
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return
+            session["exchanges"].append({"text": text, "image": image_digest, "reply": reply})
+            session["used"] = time.time()
+            self.counters["turns"] += 1
+
+            tokens = self._tokens(session)
+            if tokens > 2 * self.token_budget:
+                self._trim(session)
+            if tokens > self.token_budget and not session["compacting"] and self._foldable(session):
+                session["compacting"] = True
+                self.executor.submit(contextvars.copy_context().run, self._compact, session)
+
+    def stats(self):
+        with self.lock:
+            return {
+                **self.counters,
+                "sessions": len(self.sessions),
+                "history_tokens": sum(self._tokens(session) for session in self.sessions.values()),
+            }
+
+    def _compact(self, session):
+        with self.lock:
+            folded = session["exchanges"][:self._foldable(session)]
+            summary = session["summary"]
+
+        try:
+            summary = self.summarize(summary, folded)
+        except Exception as e:
+            print(f"⚠️ Summarizing a LearnBot session failed: {e}")
+            with self.lock:
+                session["compacting"] = False
+                self.counters["summary_failures"] += 1
+            return
+
+        with self.lock:
+            # Exchanges trimmed while the summary was being written are already gone
+            folded_ids = {id(exchange) for exchange in folded}
+            session["exchanges"] = [exchange for exchange in session["exchanges"] if id(exchange) not in folded_ids]
+            session["summary"] = summary
+            session["compacting"] = False
+            self._drop_images(session, folded)
+            self.counters["summaries"] += 1
+            self.counters["summarized_turns"] += len(folded)
+
+    def _upload(self, stored):
+        try:
+            uploaded = self.upload(stored["blob"])
+        except Exception as e:
+            # The image keeps going inline
+            print(f"⚠️ Uploading a LearnBot image failed: {e}")
+            self._count("image_upload_failures")
+            return
+        with self.lock:
+            stored["file"] = uploaded
+            self.counters["image_uploads"] += 1
+
+    def _foldable(self, session):
+        # Called with the lock held: how many of the oldest exchanges can go into the summary
+        return max(len(session["exchanges"]) - self.keep_turns, 0)
+
+    def _trim(self, session):
+        # Called with the lock held
+        trimmed = []
+        while self._tokens(session) > 2 * self.token_budget and self._foldable(session):
+            trimmed.append(session["exchanges"].pop(0))
+            self.counters["trimmed_turns"] += 1
+        self._drop_images(session, trimmed)
+
+    def _tokens(self, session):
+        images = session["images"]
+        return estimate_tokens(session["summary"]) + sum(exchange_tokens(e, images) for e in session["exchanges"])
+
+    def _drop_images(self, session, removed):
+        # Called with the lock held: images only the removed exchanges used go with them
+        remaining = {exchange["image"] for exchange in session["exchanges"]}
+        for exchange in removed:
+            if exchange["image"] not in remaining:
+                session["images"].pop(exchange["image"], None)
+
+    def _cap_images(self, session):
+        # Called with the lock held: past max_images, images no exchange uses go first, oldest first
+        images = session["images"]
+        referenced = {exchange["image"] for exchange in session["exchanges"]}
+        for digest in [digest for digest in images if digest not in referenced] + list(images):
+            if len(images) <= self.max_images:
+                break
+            images.pop(digest, None)
+
+    def _expire(self):
+        # Called with the lock held; sessions are in last-use order
+        cutoff = time.time() - self.ttl
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if session["used"] >= cutoff:
+                break
+            self.sessions.popitem(last=False)
+            self.counters["expired"] += 1
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
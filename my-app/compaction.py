@@ -0,0 +1,164 @@
+"""Shortening long stories before they go into quiz and image prompts.
+
+A quiz or a set of 20-word image prompts does not need every sentence of a
+long story, but the prompt cost grows with the input. Texts estimated at
+more than threshold_tokens are compacted paragraph by paragraph, so the
+image prompt path still gets one (shorter) paragraph per illustration:
+
+- extractive (default): keep the sentences that carry the most of the
+  text's frequent content words, up to ratio of each paragraph's tokens.
+  Local, no upstream call.
+- chunked: summarize(paragraph, target_tokens) rewrites each paragraph in
+  parallel (through the router's small tier). A paragraph whose summary
+  fails falls back to the extractive version.
+
+Quality is checked as coverage: the share of the text's key terms (its most
+frequent content words) that survive. Below min_coverage, the extract is
+retried with a larger ratio, and the full text is kept if even that is not
+enough. The caller caches the result per story hash so the quiz and image
+prompt paths compact each story once.
+"""
+
+import contextvars
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from chat_sessions import estimate_tokens
+from telemetry import span
+
+STOPWORDS = frozenset("""
+about above after again against also among because been before being below between both could does doing down
+during each even every from further have having here into itself just like many more most much must once only
+other over same should some such than that their them then there these they this those through under until upon
+very were what when where which while will with would your yours said says
+""".split())
+
+SENTENCE = re.compile(r"[^.!?]+(?:[.!?]+[\"')\]]*|$)")
+WORD = re.compile(r"[A-Za-z][A-Za-z'-]+")
+
+
+def split_sentences(paragraph):
+    return [sentence.strip() for sentence in SENTENCE.findall(paragraph) if sentence.strip()]
+
+
+def content_words(text):
+    return [word for word in (w.lower() for w in WORD.findall(text)) if len(word) > 3 and word not in STOPWORDS]
+
+
+def key_terms(text, limit=30):
+    return [word for word, _ in Counter(content_words(text)).most_common(limit)]
+
+
+def coverage(terms, text):
+    if not terms:
+        return 1.0
+    kept = set(content_words(text))
+    return sum(term in kept for term in terms) / len(terms)
+
+
+def extract(paragraph, ratio, weights):
+    """The highest-scoring sentences of paragraph, in their original order, within ratio of its tokens."""
+    sentences = split_sentences(paragraph)
+    if len(sentences) <= 1:
+        return paragraph
+
+    def score(item):
+        index, sentence = item
+        words = content_words(sentence)
+        value = sum(weights[word] for word in set(words)) / (1 + len(words)) ** 0.5
+        # The opening sentence usually sets the scene, so it gets a head start
+        return value * (1.5 if index == 0 else 1.0)
+
+    budget = estimate_tokens(paragraph) * ratio
+    chosen, used = [], 0
+    for index, sentence in sorted(enumerate(sentences), key=score, reverse=True):
+        tokens = estimate_tokens(sentence)
+        if chosen and used + tokens > budget:
+            continue
+        chosen.append(index)
+        used += tokens
+    return " ".join(sentences[index] for index in sorted(chosen))
+
+
+class Compactor:
+    def __init__(self, threshold_tokens=1500, ratio=0.4, min_coverage=0.6, summarize=None, workers=4):
+        self.threshold_tokens = threshold_tokens
+        self.ratio = ratio
+        self.min_coverage = min_coverage
+        self.summarize = summarize  # set for chunked mode
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="compaction") if summarize else None
+        self.lock = threading.Lock()
+        self.counters = {
+            "passthrough": 0, "compacted": 0, "low_coverage": 0, "summary_failures": 0, "tokens_in": 0, "tokens_out": 0,
+        }
+
+    @property
+    def mode(self):
+        return "chunked" if self.summarize else "extractive"
+
+    def should_compact(self, text):
+        if estimate_tokens(text) > self.threshold_tokens:
+            return True
+        self._count("passthrough")
+        return False
+
+    def compact(self, paragraphs):
+        """Returns the paragraphs shortened (or, if no version keeps enough of the key terms, unchanged)."""
+        text = "\n\n".join(paragraphs)
+        terms = key_terms(text)
+        weights = Counter(content_words(text))
+
+        with span("compaction", mode=self.mode, paragraphs=len(paragraphs)) as s:
+            compacted = self._summarize(paragraphs, weights) if self.summarize else None
+            ratio = self.ratio
+            while compacted is None or coverage(terms, " ".join(compacted)) < self.min_coverage:
+                if ratio >= 1:
+                    compacted = None
+                    break
+                compacted = [extract(paragraph, ratio, weights) for paragraph in paragraphs]
+                ratio = min(ratio + 0.2, 1.0)
+
+            tokens_in = estimate_tokens(text)
+            if compacted is None:
+                self._count("low_coverage")
+                compacted = list(paragraphs)
+            tokens_out = estimate_tokens("\n\n".join(compacted))
+            score = coverage(terms, " ".join(compacted))
+            s.set(tokens_in=tokens_in, tokens_out=tokens_out, coverage=round(score, 3))
+
+        with self.lock:
+            self.counters["compacted"] += 1
+            self.counters["tokens_in"] += tokens_in
+            self.counters["tokens_out"] += tokens_out
+        return compacted
+
+    def stats(self):
+        with self.lock:
+            tokens_in = self.counters["tokens_in"]
+            return {
+                **self.counters,
+                "mode": self.mode,
+                "compression": round(self.counters["tokens_out"] / tokens_in, 3) if tokens_in else 1.0,
+            }
+
+    def _summarize(self, paragraphs, weights):
+        def rewrite(paragraph):
+            target = max(int(estimate_tokens(paragraph) * self.ratio), 1)
+            if len(split_sentences(paragraph)) <= 1:
+                return paragraph
+            try:
+                return self.summarize(paragraph, target).strip() or extract(paragraph, self.ratio, weights)
+            except Exception as e:
+                print(f"⚠️ Summarizing a paragraph failed, using an extract: {e}")
+                self._count("summary_failures")
+                return extract(paragraph, self.ratio, weights)
+
+        futures = [self.executor.submit(contextvars.copy_context().run, rewrite, paragraph) for paragraph in paragraphs]
+        return [future.result() for future in futures]
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
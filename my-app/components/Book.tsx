@@ -6,19 +6,62 @@ import PeekingCharacters from './PeekingCharacters'
 import Img4 from '../public/Image4.png'
 
 
-export default function Book({ storyData }: { storyData: string }) {
+type ImageMap = Record<string, string>
+type StoryData = string | { response?: string; job_id?: string; images?: ImageMap; thumbnails?: ImageMap }
+
+// Illustrations are served by the backend's image store under content-hashed URLs
+const BACKEND_URL = 'http://localhost:5000'
+const backendImage = (path?: string) => (path ? `${BACKEND_URL}${path}` : undefined)
+
+export default function Book({ storyData }: { storyData: StoryData }) {
   const [currentPage, setCurrentPage] = useState(0)
   const [isFlipping, setIsFlipping] = useState(false)
   const [flipDirection, setFlipDirection] = useState<'left' | 'right'>('right')
+  const [jobImages, setJobImages] = useState<{ images: ImageMap; thumbnails: ImageMap }>({ images: {}, thumbnails: {} })
 
   console.log('Story data in Book component:', storyData);
 
   // ...existing code...
 const storyText = typeof storyData === "string" ? storyData : storyData.response ?? "";
+const jobId = typeof storyData === "string" ? undefined : storyData.job_id;
+// Illustrations for job-mode stories arrive one by one while the server renders them
+const storyImages = jobId ? jobImages : {
+  images: (typeof storyData === "string" ? undefined : storyData.images) ?? {},
+  thumbnails: (typeof storyData === "string" ? undefined : storyData.thumbnails) ?? {},
+};
 const pages = storyText.split('\n\n').map((paragraph, index) => ({
   content: paragraph.trim(),
-  image: `/Images/Image${index}.png?timestamp=${new Date().getTime()}`,
+  image: backendImage(storyImages.images[String(index)]),
+  thumbnail: backendImage(storyImages.thumbnails[String(index)]),
 }));
+const rightPageImage = jobId ? pages[currentPage + 1]?.image : (pages[currentPage + 1]?.image || Img4);
+
+useEffect(() => {
+  if (!jobId) return;
+  let cancelled = false;
+  let timer: ReturnType<typeof setTimeout>;
+
+  const pollImages = async () => {
+    try {
+      const response = await fetch(`http://localhost:5000/StoryTeller/jobs/${jobId}`);
+      const job = await response.json();
+      if (cancelled) return;
+      setJobImages({ images: job.images || {}, thumbnails: job.thumbnails || {} });
+      if (job.status === "queued" || job.status === "running") {
+        timer = setTimeout(pollImages, 2000);
+      }
+    } catch (error) {
+      console.error('Error fetching story images:', error);
+    }
+  };
+
+  setJobImages({ images: {}, thumbnails: {} });
+  pollImages();
+  return () => {
+    cancelled = true;
+    clearTimeout(timer);
+  };
+}, [jobId]);
 // ...existing code...
   const stopReading = () => {
     window.speechSynthesis.cancel();
@@ -136,12 +179,18 @@ const speakText = (text: string) => {
             {/* Right page */}
             <div className="absolute left-[400px] w-[400px] h-full bg-white p-8">
               <div className="w-full h-full relative">
-                <Image
-                  src={pages[currentPage + 1]?.image || Img4}
-                  alt="Story illustration"
-                  fill
-                  className="object-cover rounded-lg"
-                />
+                {rightPageImage ? (
+                  <Image
+                    src={rightPageImage}
+                    alt="Story illustration"
+                    fill
+                    className="object-cover rounded-lg"
+                  />
+                ) : (
+                  <div className="w-full h-full flex items-center justify-center rounded-lg bg-yellow-50 text-blue-600 font-serif text-lg animate-pulse">
+                    Drawing your picture...
+                  </div>
+                )}
               </div>
             </div>
 
@@ -172,7 +221,7 @@ const speakText = (text: string) => {
                     ) : (
                       <div className="w-full h-full relative">
                         <Image
-                          src={pages[currentPage]?.image || "/placeholder.svg"}
+                          src={pages[currentPage]?.thumbnail || "/placeholder.svg"}
                           alt="Story illustration"
                           fill
                           className="object-cover rounded-lg"
@@ -191,7 +240,7 @@ const speakText = (text: string) => {
                     {flipDirection === 'right' ? (
                       <div className="w-full h-full relative">
                         <Image
-                          src={pages[currentPage + 1]?.image || ''}
+                          src={pages[currentPage + 1]?.thumbnail || ''}
                           alt="Story illustration"
                           fill
                           className="object-cover rounded-lg"
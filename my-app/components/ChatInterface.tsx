@@ -5,6 +5,7 @@ import { Button } from "@/components/ui/button";
 import VoiceRecorder from "./VoiceRecorder";
 import { ImageIcon } from 'lucide-react';
 import { useTranslation } from 'react-i18next';
+import { readEventStream } from "@/lib/streaming";
 
 interface Message {
   text: string;
@@ -17,107 +18,84 @@ export default function ChatInterface() {
   const [inputText, setInputText] = useState("");
   const [selectedImage, setSelectedImage] = useState<File | null>(null);
   const fileInputRef = useRef<HTMLInputElement>(null);
+  // The server keeps the conversation; each message only carries the session id
+  const sessionIdRef = useRef<string | null>(null);
   const { t, i18n } = useTranslation()
   const changeLanguage = (lang: string) => {
     i18n.changeLanguage(lang)
   }
 
+  // Streams the LearnBot reply into a new bot message while it is being generated
+  const streamBotReply = async (body: { text?: string; image?: File | null }) => {
+    setMessages((prev) => [...prev, { text: "", isUser: false }]);
+    const updateReply = (text: string) =>
+      setMessages((prev) => [...prev.slice(0, -1), { text, isUser: false }]);
+
+    try {
+      // Images go up as raw multipart bytes rather than a base64 data URL
+      let request: RequestInit;
+      const sessionId = sessionIdRef.current;
+      if (body.image) {
+        const form = new FormData();
+        form.append("text", body.text || "");
+        form.append("image", body.image);
+        if (sessionId) {
+          form.append("session_id", sessionId);
+        }
+        request = { method: "POST", body: form };
+      } else {
+        request = {
+          method: "POST",
+          headers: {
+            "Content-Type": "application/json",
+          },
+          body: JSON.stringify({ ...body, session_id: sessionId }),
+        };
+      }
+      const response = await fetch("http://127.0.0.1:5000/LearnBot/stream", request);
+
+      if (!response.ok) {
+        updateReply("Sorry, I didn't understand that.");
+        return;
+      }
+
+      let reply = "";
+      await readEventStream(response, ({ event, data }) => {
+        if (event === "done") {
+          sessionIdRef.current = data.session_id || null;
+          updateReply(data.response || "Sorry, I didn't understand that.");
+        } else if (event === "error") {
+          updateReply("An error occurred. Please try again later.");
+        } else {
+          reply += data.delta;
+          updateReply(reply);
+        }
+      });
+    } catch (error) {
+      console.error("Error communicating with the server:", error);
+      updateReply("An error occurred. Please try again later.");
+    }
+  };
+
   const handleSendMessage = async () => {
     const newMessage: Message = { text: inputText, isUser: true };
-    let imageBase64: string | null = null;
 
     if (selectedImage) {
-      const reader = new FileReader();
-      reader.readAsDataURL(selectedImage);
-      reader.onloadend = async () => {
-        imageBase64 = reader.result as string;
-        newMessage.image = imageBase64;
-
-        setMessages([...messages, newMessage]);
-
-        try {
-          const response = await fetch("http://127.0.0.1:5000/LearnBot", {
-            method: "POST",
-            headers: {
-              "Content-Type": "application/json",
-            },
-            body: JSON.stringify({ text: inputText, image: imageBase64 }),
-          });
-
-          const data = await response.json();
-          const botResponse = data.response || "Sorry, I didn't understand that.";
-
-          setMessages((prev) => [...prev, { text: botResponse, isUser: false }]);
-        } catch (error) {
-          console.error("Error communicating with the server:", error);
-          setMessages((prev) => [
-            ...prev,
-            { text: "An error occurred. Please try again later.", isUser: false },
-          ]);
-        }
+      newMessage.image = URL.createObjectURL(selectedImage);
+
+      setMessages([...messages, newMessage]);
 
-        setInputText("");
-        setSelectedImage(null);
-      };
+      await streamBotReply({ text: inputText, image: selectedImage });
+
+      setInputText("");
+      setSelectedImage(null);
     } else if (inputText.trim()) {
       newMessage.text = inputText;
       setMessages([...messages, newMessage]);
 
-      try {
-        const response = await fetch("http://127.0.0.1:5000/LearnBot", {
-          method: "POST",
-          headers: {
-            "Content-Type": "application/json",
-          },
-          body: JSON.stringify({ text: inputText }),
-        });
-
-        const data = await response.json();
-        const botResponse = data.response || "Sorry, I didn't understand that.";
-
-        setMessages((prev) => [...prev, { text: botResponse, isUser: false }]);
-      } catch (error) {
-        console.error("Error communicating with the server:", error);
-        setMessages((prev) => [
-          ...prev,
-          { text: "An error occurred. Please try again later.", isUser: false },
-        ]);
-      }
+      await streamBotReply({ text: inputText });
 
       setInputText("");
-    } else if (selectedImage) {
-      const reader = new FileReader();
-      reader.readAsDataURL(selectedImage);
-      reader.onloadend = async () => {
-        imageBase64 = reader.result as string;
-        newMessage.image = imageBase64;
-
-        setMessages([...messages, newMessage]);
-
-        try {
-          const response = await fetch("http://127.0.0.1:5000/LearnBot", {
-            method: "POST",
-            headers: {
-              "Content-Type": "application/json",
-            },
-            body: JSON.stringify({ image: imageBase64 }),
-          });
-
-          const data = await response.json();
-          const botResponse = data.response || "Sorry, I didn't understand that.";
-
-          setMessages((prev) => [...prev, { text: botResponse, isUser: false }]);
-        } catch (error) {
-          console.error("Error communicating with the server:", error);
-          setMessages((prev) => [
-            ...prev,
-            { text: "An error occurred. Please try again later.", isUser: false },
-          ]);
-        }
-
-        setInputText("");
-        setSelectedImage(null);
-      };
     }
   };
 
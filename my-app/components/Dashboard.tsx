@@ -97,7 +97,8 @@ export default function Dashboard() {
     
     // Fetch AI suggestions
     try {
-      const response = await axios.get("http://localhost:5000/AiSuggestionBot");
+      const user = JSON.parse(sessionStorage.getItem("user") || "{}");
+      const response = await axios.get("http://localhost:5000/AiSuggestionBot", { params: { age: user?.age } });
       const rawSuggestions = response.data.response;
       const suggestions = rawSuggestions
         .split('\n\n')
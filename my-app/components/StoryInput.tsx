@@ -4,6 +4,7 @@ import { useState } from "react"
 import { ArrowRight } from 'lucide-react'
 import { useTranslation } from "react-i18next"
 import { DotLottieReact } from '@lottiefiles/dotlottie-react' // Import the Lottie component
+import { readEventStream } from "@/lib/streaming"
 
 interface StoryInputProps {
   onSubmit: (storyData: string) => void
@@ -13,11 +14,13 @@ interface StoryInputProps {
 export default function StoryInput({ onSubmit, triggerCanvasDownload }: StoryInputProps) {
   const [input, setInput] = useState("")
   const [isLoading, setIsLoading] = useState(false) // Added loading state
+  const [streamedStory, setStreamedStory] = useState("") // Story text shown while it is being written
   const { t } = useTranslation()
 
   const handleSubmit = async () => {
     // Set loading state to true when submit is clicked
     setIsLoading(true)
+    setStreamedStory("")
     
     // Trigger the canvas download
     triggerCanvasDownload()
@@ -29,17 +32,24 @@ export default function StoryInput({ onSubmit, triggerCanvasDownload }: StoryInp
 // Get the age from the stored user object
         const age = user?.age || 10; // fallback to 10 if not found
 
-        // Then send it in the request
-        const response = await fetch("http://localhost:5000/StoryTeller", {
+        // Then send it in the request; the story streams in as it is written
+        const response = await fetch("http://localhost:5000/StoryTeller/stream", {
           method: "POST",
           headers: {
             "Content-Type": "application/json",
           },
           body: JSON.stringify({ text: input, age: age }),
         });
-      const data = await response.json()
-      console.log("Response from server:", data)
-      onSubmit(data)
+      await readEventStream(response, ({ event, data }) => {
+        if (event === "done") {
+          console.log("Response from server:", data)
+          onSubmit(data)
+        } else if (event === "error") {
+          console.error("Error:", data.error)
+        } else {
+          setStreamedStory((prev) => prev + data.delta)
+        }
+      })
     } catch (error) {
       console.error("Error:", error)
     } finally {
@@ -76,6 +86,9 @@ export default function StoryInput({ onSubmit, triggerCanvasDownload }: StoryInp
     <div className="text-center">
       <div className="animate-spin rounded-full h-16 w-16 border-t-4 border-blue-500 border-solid mx-auto mb-4"></div>
       <p className="text-lg font-semibold text-blue-700">Loading your story...</p>
+      {streamedStory && (
+        <p className="mt-4 max-w-2xl whitespace-pre-line text-left font-serif text-gray-800">{streamedStory}</p>
+      )}
     </div>
   </div>
 )}
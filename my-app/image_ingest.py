@@ -0,0 +1,135 @@
+"""Bounded-memory ingest for images sent to LearnBot.
+
+Canvas drawings and camera photos arrive either as raw bytes (multipart
+upload) or as a base64 data URL. Before anything is decoded, the encoded
+size is checked against max_bytes, and the pixel count from the image
+header is checked against max_pixels. JPEGs are decoded at a reduced scale
+(PIL draft mode). Every image is then downscaled to max_side and
+re-encoded as JPEG on a worker pool, so what reaches Gemini has a bounded
+size whatever the client sent.
+
+Results are cached by a hash of the encoded bytes, so the same picture sent
+again (a retry, the same worksheet photo) is not decoded twice.
+"""
+
+import base64
+import binascii
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def prepare_image(data, max_pixels, max_side, quality):
+    # Runs on the worker pool; returns a Gemini inline blob
+    try:
+        opened = Image.open(BytesIO(data))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+
+    with opened as image:
+        width, height = image.size
+        if width * height > max_pixels:
+            raise ImageTooLarge(f"Image is {width}x{height}; the limit is {max_pixels} pixels")
+
+        # Lets the JPEG decoder skip straight to a smaller scale
+        image.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        output = BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+    return {"mime_type": "image/jpeg", "data": output.getvalue()}
+
+
+class ImageIngest:
+    def __init__(self, max_bytes=10 * 1024 * 1024, max_pixels=40_000_000, max_side=1024,
+                 quality=85, workers=2, cache_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.max_side = max_side
+        self.quality = quality
+        self.cache_bytes = cache_bytes
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-ingest")
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {"decoded": 0, "hits": 0, "rejected": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def from_base64(self, text):
+        if text.startswith("data:"):
+            text = text.split(",", 1)[1]
+        # Four base64 characters carry three bytes; reject before decoding anything
+        if len(text) * 3 // 4 > self.max_bytes:
+            self._count("rejected")
+            raise ImageTooLarge(f"Image is larger than {self.max_bytes} bytes")
+        try:
+            data = base64.b64decode(text, validate=True)
+        except binascii.Error:
+            data = base64.b64decode(text)
+        return self.from_bytes(data)
+
+    def from_stream(self, read_chunk, chunk_size=64 * 1024):
+        # Reads at most max_bytes + 1 so an oversized upload is never held in memory in full
+        chunks, size = [], 0
+        for chunk in iter(lambda: read_chunk(chunk_size), b""):
+            size += len(chunk)
+            if size > self.max_bytes:
+                self._count("rejected")
+                raise ImageTooLarge(f"Image is larger than {self.max_bytes} bytes")
+            chunks.append(chunk)
+        return self.from_bytes(b"".join(chunks))
+
+    def from_bytes(self, data):
+        if len(data) > self.max_bytes:
+            self._count("rejected")
+            raise ImageTooLarge(f"Image is larger than {self.max_bytes} bytes")
+
+        key = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            blob = self.cache.get(key)
+            if blob is not None:
+                self.cache.move_to_end(key)
+                self.counters["hits"] += 1
+                return blob
+
+        try:
+            blob = self.executor.submit(prepare_image, data, self.max_pixels, self.max_side, self.quality).result()
+        except ImageTooLarge:
+            self._count("rejected")
+            raise
+
+        with self.lock:
+            self.counters["decoded"] += 1
+            self.counters["bytes_in"] += len(data)
+            self.counters["bytes_out"] += len(blob["data"])
+            if key not in self.cache:
+                self.cache[key] = blob
+                self.cached_bytes += len(blob["data"])
+            while self.cached_bytes > self.cache_bytes and self.cache:
+                _, evicted = self.cache.popitem(last=False)
+                self.cached_bytes -= len(evicted["data"])
+        return blob
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "cached": len(self.cache), "cached_bytes": self.cached_bytes}
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
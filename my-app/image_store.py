@@ -0,0 +1,144 @@
+"""Content-addressed store for generated story illustrations.
+
+Each render is saved once under the hash of its pixels as a compact WebP
+(<key>.webp) plus a small thumbnail (<key>.thumb.webp), and as AVIF too when
+Pillow was built with an AVIF encoder. Because a key never changes meaning,
+the files can be served with a year-long immutable cache header, and
+stories no longer overwrite each other's pictures.
+
+A prompt index maps the hash of (model, prompt) to the key it produced, so
+the same prompt is only rendered once. Index entries whose files have been
+pruned are ignored.
+
+The thumbnail and the full-size WebP are written before put() returns, the
+thumbnail first, so both URLs from urls() can be fetched as soon as a key
+exists. AVIF variants are encoded later on the store's own worker pool.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+Image.init()
+AVIF_SUPPORTED = "AVIF" in Image.SAVE
+
+IMAGE_NAME = re.compile(r"^[0-9a-f]{64}(\.thumb)?\.(webp|avif)$")
+
+
+class ImageStore:
+    def __init__(self, root, quality=80, thumb_size=320, max_files=4096, workers=2):
+        self.root = root
+        self.prompts_dir = os.path.join(root, "prompts")
+        self.quality = quality
+        self.thumb_size = thumb_size
+        self.max_files = max_files
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-store")
+        self.lock = threading.Lock()
+        self.counters = {"stored": 0, "duplicates": 0, "prompt_hits": 0, "prompt_misses": 0}
+        self.writes = 0
+
+        os.makedirs(self.prompts_dir, exist_ok=True)
+
+    def put(self, image):
+        """Save a PIL image and return its key; an identical image is stored once."""
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        digest = hashlib.sha256(f"{image.mode}:{image.size}".encode("utf-8"))
+        digest.update(image.tobytes())
+        key = digest.hexdigest()
+
+        path = self.path(f"{key}.webp")
+        thumb_path = self.path(f"{key}.thumb.webp")
+        if os.path.exists(path):
+            if not os.path.exists(thumb_path):
+                self._write_thumbnail(thumb_path, image)
+            self._count("duplicates")
+            return key
+
+        self._write_thumbnail(thumb_path, image)
+        self._write(path, lambda f: image.save(f, format="WEBP", quality=self.quality, method=4))
+        if AVIF_SUPPORTED:
+            self.executor.submit(self._encode_avif, key, image)
+        self._count("stored")
+
+        with self.lock:
+            self.writes += 1
+            prune = self.writes % 64 == 0
+        if prune:
+            self.executor.submit(self._prune)
+        return key
+
+    def lookup_prompt(self, prompt_hash):
+        try:
+            with open(self._prompt_path(prompt_hash), encoding="utf-8") as f:
+                key = json.load(f)["key"]
+        except (OSError, ValueError, KeyError):
+            key = None
+
+        if key is not None and os.path.exists(self.path(f"{key}.webp")):
+            self._count("prompt_hits")
+            return key
+        self._count("prompt_misses")
+        return None
+
+    def remember_prompt(self, prompt_hash, key):
+        self._write(self._prompt_path(prompt_hash), lambda f: f.write(json.dumps({"key": key}).encode("utf-8")))
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def urls(self, key, base="/images"):
+        return {"image": f"{base}/{key}.webp", "thumbnail": f"{base}/{key}.thumb.webp"}
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "avif": AVIF_SUPPORTED}
+
+    def _write_thumbnail(self, path, image):
+        thumb = image.copy()
+        thumb.thumbnail((self.thumb_size, self.thumb_size), Image.LANCZOS)
+        self._write(path, lambda f: thumb.save(f, format="WEBP", quality=self.quality))
+
+    def _encode_avif(self, key, image):
+        try:
+            self._write(self.path(f"{key}.avif"), lambda f: image.save(f, format="AVIF", quality=self.quality))
+        except Exception as e:
+            print(f"❌ Error encoding AVIF variant for {key}: {e}")
+
+    def _prompt_path(self, prompt_hash):
+        return os.path.join(self.prompts_dir, f"{prompt_hash}.json")
+
+    def _write(self, path, save):
+        # Write to a temp file and rename, so a file that exists is always complete
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            save(f)
+        os.replace(tmp_path, path)
+
+    def _prune(self):
+        # Drop the oldest renders (all variants) once the store grows past max_files
+        renders = [
+            entry for entry in os.scandir(self.root)
+            if entry.name.endswith(".webp") and not entry.name.endswith(".thumb.webp")
+        ]
+        excess = len(renders) - self.max_files
+        if excess <= 0:
+            return
+        renders.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in renders[:excess]:
+            key = entry.name[:-len(".webp")]
+            for name in (f"{key}.webp", f"{key}.thumb.webp", f"{key}.avif"):
+                try:
+                    os.remove(self.path(name))
+                except OSError:
+                    pass
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
@@ -0,0 +1,65 @@
+export interface StreamEvent {
+  event: string
+  data: any
+}
+
+// Reads a text/event-stream response and calls onEvent for every complete event
+export async function readEventStream(response: Response, onEvent: (event: StreamEvent) => void) {
+  if (!response.body) {
+    throw new Error("Response has no body to stream")
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ""
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+
+    let boundary = buffer.indexOf("\n\n")
+    while (boundary !== -1) {
+      const rawEvent = buffer.slice(0, boundary)
+      buffer = buffer.slice(boundary + 2)
+
+      let event = "message"
+      const dataLines: string[] = []
+      for (const line of rawEvent.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim()
+        else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim())
+      }
+      if (dataLines.length) {
+        onEvent({ event, data: JSON.parse(dataLines.join("\n")) })
+      }
+
+      boundary = buffer.indexOf("\n\n")
+    }
+  }
+}
+
+// Reads an application/x-ndjson response and calls onItem for every complete line
+export async function readJsonLines(response: Response, onItem: (item: any) => void) {
+  if (!response.body) {
+    throw new Error("Response has no body to stream")
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ""
+
+  const flush = (line: string) => {
+    if (line.trim()) onItem(JSON.parse(line))
+  }
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+
+    const lines = buffer.split("\n")
+    buffer = lines.pop() ?? ""
+    lines.forEach(flush)
+  }
+  flush(buffer)
+}
@@ -0,0 +1,187 @@
+"""Tiered routing of text generations across LLM backends.
+
+Every task (story, quiz, image_prompts, suggestions) belongs to a tier, and
+every tier has an ordered chain of backends. Short, high-volume tasks can
+then run on a local Ollama-compatible model while long-form writing stays on
+Gemini.
+
+The first backend in the chain is the primary:
+- Hedging: if the primary has not answered within its p95 latency for that
+  tier, the same request also goes to the next backend, and the first
+  success wins. Until min_samples latencies have been seen, hedge_default
+  seconds is used (None: no hedging yet).
+- Fallback: if a backend fails (error, open circuit, timeout) and nothing
+  else is running, the next one is tried at once.
+
+Only text prompts are routed. Streaming, images and video need Gemini and
+call it directly.
+
+Options every backend understands: json_output, schema (a JSON schema the
+output must follow), temperature, and system (a ModelProfile: Gemini uses
+its prebuilt model handle, other backends its instruction text).
+"""
+
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from telemetry import span
+
+
+def generation_kwargs(json_output=False, schema=None, temperature=None):
+    # generate_content keyword arguments for the router's options
+    config = {}
+    if json_output or schema:
+        config["response_mime_type"] = "application/json"
+    if schema:
+        config["response_schema"] = schema
+    if temperature is not None:
+        config["temperature"] = temperature
+    return {"generation_config": config} if config else {}
+
+
+class GeminiBackend:
+    def __init__(self, generate):
+        # generate is server.gemini_generate, which already applies the Gemini upstream limits
+        self.generate_fn = generate
+
+    def generate(self, prompt, task, json_output=False, schema=None, temperature=None, system=None, timeout=None):
+        kwargs = generation_kwargs(json_output, schema, temperature)
+        return self.generate_fn(prompt, timeout=timeout, stage=task, target=system, **kwargs).text
+
+
+class OllamaBackend:
+    """Any server speaking Ollama's POST /api/generate (non-streaming)."""
+
+    def __init__(self, url, model, upstream, session):
+        self.url = url.rstrip("/")
+        self.model = model
+        self.upstream = upstream
+        self.session = session  # Lazy holder for the pooled requests session
+
+    def generate(self, prompt, task, json_output=False, schema=None, temperature=None, system=None, timeout=None):
+        payload = {"model": self.model, "prompt": prompt, "stream": False}
+        if system is not None:
+            payload["system"] = system.instruction
+        if json_output or schema:
+            payload["format"] = schema or "json"
+        if temperature is not None:
+            payload["options"] = {"temperature": temperature}
+
+        def call(remaining):
+            response = self.session.get().post(f"{self.url}/api/generate", json=payload, timeout=remaining)
+            response.raise_for_status()
+            return response.json()
+
+        with span(f"local.{task}", model=self.model) as s:
+            data = self.upstream.call(call, timeout=timeout)
+            s.tokens(prompt=data.get("prompt_eval_count"), output=data.get("eval_count"))
+            return data["response"]
+
+
+class LLMRouter:
+    def __init__(self, backends, tiers, tasks, hedge_default=None, min_samples=20, window=200, workers=16):
+        self.backends = backends  # name -> backend
+        self.tiers = {tier: self._available(tier, chain) for tier, chain in tiers.items()}
+        self.tasks = tasks  # task -> tier
+        self.hedge_default = hedge_default
+        self.min_samples = min_samples
+        self.window = window
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-router")
+        self.latencies = {}  # (backend, tier) -> recent successful latencies
+        self.lock = threading.Lock()
+        self.counters = {"calls": 0, "hedged": 0, "hedge_wins": 0, "fallbacks": 0, "fallback_wins": 0, "failures": 0}
+
+    def chain(self, task):
+        return self.tiers[self.tasks.get(task, "large")]
+
+    def generate(self, task, prompt, timeout=None, **options):
+        """Returns the generated text from the first backend in the task's chain that succeeds."""
+        tier = self.tasks.get(task, "large")
+        chain = self.chain(task)
+        queue = list(chain)
+        pending = {}
+        hedged = False
+        error = None
+        self._count("calls")
+
+        def launch():
+            name = queue.pop(0)
+            future = self.executor.submit(
+                contextvars.copy_context().run, self._call, name, tier, task, prompt, timeout, options
+            )
+            pending[future] = name
+
+        launch()
+        while pending:
+            # Only the primary is hedged, and only once
+            hedge_after = None if hedged or not queue else self.hedge_delay(chain[0], tier)
+            done, _ = wait(pending, timeout=hedge_after, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                self._count("hedged")
+                launch()
+                continue
+
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    text = future.result()
+                except Exception as e:
+                    print(f"⚠️ {name} failed for {task}: {e}")
+                    error = e
+                    if queue and not pending:
+                        self._count("fallbacks")
+                        launch()
+                    continue
+
+                if name != chain[0]:
+                    self._count("hedge_wins" if hedged else "fallback_wins")
+                return text
+
+        self._count("failures")
+        raise error
+
+    def hedge_delay(self, name, tier):
+        with self.lock:
+            samples = self.latencies.get((name, tier))
+            if not samples or len(samples) < self.min_samples:
+                return self.hedge_default
+            ordered = sorted(samples)
+        return ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+
+    def stats(self):
+        p95 = {}
+        for name, tier in list(self.latencies):
+            delay = self.hedge_delay(name, tier)
+            if delay is not None:
+                p95[f"{name}/{tier}"] = round(delay, 3)
+        with self.lock:
+            return {**self.counters, "tiers": self.tiers, "hedge_after": p95}
+
+    def _available(self, tier, chain):
+        # Backends that are not configured are skipped; a tier left empty (say LLM_SMALL_BACKENDS=local
+        # without LOCAL_LLM_URL) uses the first configured backend instead
+        available = [name.strip() for name in chain if name.strip() in self.backends]
+        if available:
+            return available
+        if not self.backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        fallback = next(iter(self.backends))
+        print(f"⚠️ None of the {tier} tier's backends ({', '.join(chain)}) are configured; using {fallback}")
+        return [fallback]
+
+    def _call(self, name, tier, task, prompt, timeout, options):
+        started = time.monotonic()
+        text = self.backends[name].generate(prompt, task, timeout=timeout, **options)
+        with self.lock:
+            samples = self.latencies.setdefault((name, tier), deque(maxlen=self.window))
+            samples.append(time.monotonic() - started)
+        return text
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
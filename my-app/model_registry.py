@@ -0,0 +1,107 @@
+"""Prebuilt model handles, one per instruction set.
+
+The story and quiz instructions depend only on the age band. Instead of
+being pasted into every prompt, each set is registered once as the system
+instruction of its own Gemini model handle, so a request carries only the
+child's input. Profiles also hand their instruction text to non-Gemini
+backends (Ollama's "system" field).
+
+With context_cache, each instruction set is also stored upstream as cached
+content (Gemini context caching), and its handle is built on that cache, so
+those tokens are billed at the cached rate. A cache is recreated shortly
+before its TTL runs out. Gemini only caches contents above a minimum size
+(1024 tokens for 2.5 Flash). When creating the cache fails, the handle falls
+back to a plain system instruction, which still gives Gemini's implicit
+prefix caching a stable prefix.
+"""
+
+import datetime
+import threading
+import time
+
+from telemetry import span
+
+
+class ModelProfile:
+    def __init__(self, name, instruction, build):
+        self.name = name
+        self.instruction = instruction
+        self.build = build  # build(profile) -> (model, expires at or None)
+        self.value = None
+        self.expires = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        value = self.value
+        if value is None or self._expired():
+            with self.lock:
+                if self.value is None or self._expired():
+                    with span(f"init.model.{self.name}"):
+                        self.value, self.expires = self.build(self)
+                value = self.value
+        return value
+
+    def _expired(self):
+        return self.expires is not None and time.time() >= self.expires
+
+    @property
+    def initialized(self):
+        return self.value is not None
+
+
+class ModelRegistry:
+    def __init__(self, genai, model_name, context_cache=False, cache_ttl=3600):
+        self.genai = genai  # Lazy holder for the configured google.generativeai module
+        self.model_name = model_name
+        self.context_cache = context_cache
+        self.cache_ttl = cache_ttl
+
+        self.profiles = {}
+        self.lock = threading.Lock()
+        self.counters = {"built": 0, "context_caches": 0, "context_cache_failures": 0}
+
+    def register(self, kind, band, instruction):
+        name = f"{kind}.{band}"
+        self.profiles[(kind, band)] = ModelProfile(name, instruction, self._build)
+
+    def profile(self, kind, band):
+        return self.profiles[(kind, band)]
+
+    def warm(self):
+        for profile in self.profiles.values():
+            profile.get()
+
+    def stats(self):
+        with self.lock:
+            return {
+                **self.counters,
+                "profiles": len(self.profiles),
+                "ready": sum(profile.initialized for profile in self.profiles.values()),
+                "cached": sum(profile.expires is not None for profile in self.profiles.values()),
+            }
+
+    def _build(self, profile):
+        genai = self.genai.get()
+        if self.context_cache:
+            try:
+                from google.generativeai import caching
+                cached = caching.CachedContent.create(
+                    model=self.model_name,
+                    display_name=profile.name,
+                    system_instruction=profile.instruction,
+                    ttl=datetime.timedelta(seconds=self.cache_ttl)
+                )
+                self._count("context_caches")
+                # Rebuilt a little before the upstream copy expires
+                expires = time.time() + self.cache_ttl - min(60, self.cache_ttl / 10)
+                return genai.GenerativeModel.from_cached_content(cached), expires
+            except Exception as e:
+                print(f"⚠️ No context cache for {profile.name}, using a system instruction: {e}")
+                self._count("context_cache_failures")
+
+        self._count("built")
+        return genai.GenerativeModel(self.model_name, system_instruction=profile.instruction), None
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
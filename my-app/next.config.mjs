@@ -1,4 +1,12 @@
 /** @type {import('next').NextConfig} */
-const nextConfig = {};
+const nextConfig = {
+  images: {
+    // Story illustrations from the backend's image store (see server.py /images/)
+    remotePatterns: [
+      { protocol: 'http', hostname: 'localhost', port: '5000', pathname: '/images/**' },
+      { protocol: 'http', hostname: '127.0.0.1', port: '5000', pathname: '/images/**' },
+    ],
+  },
+};
 
 export default nextConfig;
@@ -0,0 +1,105 @@
+"""Speculative background work that a later request can claim.
+
+Right after a story is generated, the quiz for it is very likely to be asked
+for next. prefetch(key, fn) starts fn on a small worker pool. take(key) then
+hands the request the finished result, or waits for the one still running,
+instead of making a second upstream call. A request that cannot wait (one
+that streams) takes only a finished result, with wait=False.
+
+Speculating spends upstream quota, so it runs on a budget:
+- at most max_in_flight prefetches run at once; extra ones are skipped
+- at most max_entries unclaimed results are kept, oldest evicted first
+- unclaimed results expire after ttl seconds
+
+stats() reports the hit rate (claimed / asked for) and how many prefetches
+were wasted (evicted or expired before anyone asked), which shows whether
+prefetching pays for itself.
+"""
+
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prefetcher:
+    def __init__(self, workers=2, max_in_flight=4, max_entries=128, ttl=1800):
+        self.max_in_flight = max_in_flight
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.entries = OrderedDict()  # key -> (created, future)
+        self.lock = threading.Lock()
+        self.counters = {
+            "started": 0, "duplicates": 0, "skipped": 0, "hits": 0, "in_flight_hits": 0,
+            "not_ready": 0, "misses": 0, "failed": 0, "evicted": 0, "expired": 0,
+        }
+
+    def prefetch(self, key, fn):
+        """Starts fn() in the background unless key is already pending or the budget is spent."""
+        with self.lock:
+            self._expire()
+            if key in self.entries:
+                self.counters["duplicates"] += 1
+                return False
+            if sum(not future.done() for _, future in self.entries.values()) >= self.max_in_flight:
+                self.counters["skipped"] += 1
+                return False
+            while len(self.entries) >= self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["evicted"] += 1
+
+            future = self.executor.submit(contextvars.copy_context().run, fn)
+            self.entries[key] = (time.time(), future)
+            self.counters["started"] += 1
+        return True
+
+    def take(self, key, timeout=None, wait=True):
+        """Returns the prefetched result for key (waiting if it is still running, unless not wait), or None."""
+        with self.lock:
+            self._expire()
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            future = entry[1]
+            if not wait and not future.done():
+                # Left for a later request that can wait
+                self.counters["not_ready"] += 1
+                return None
+            del self.entries[key]
+            self.counters["hits" if future.done() else "in_flight_hits"] += 1
+
+        try:
+            return future.result(timeout)
+        except Exception as e:
+            print(f"⚠️ Prefetched result for {key[:12]} failed: {e}")
+            self._count("failed")
+            return None
+
+    def stats(self):
+        with self.lock:
+            claimed = self.counters["hits"] + self.counters["in_flight_hits"]
+            asked = claimed + self.counters["misses"]
+            return {
+                **self.counters,
+                "pending": len(self.entries),
+                "hit_rate": round(claimed / asked, 3) if asked else 0.0,
+                "wasted": self.counters["evicted"] + self.counters["expired"],
+            }
+
+    def _expire(self):
+        # Called with the lock held; entries are in creation order
+        cutoff = time.time() - self.ttl
+        while self.entries:
+            created, future = next(iter(self.entries.values()))
+            if created >= cutoff or not future.done():
+                break
+            self.entries.popitem(last=False)
+            self.counters["expired"] += 1
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
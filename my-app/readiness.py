@@ -0,0 +1,107 @@
+"""Lazy backend construction and warmup-driven readiness.
+
+Importing the Gemini and Hugging Face client libraries and building their
+clients takes most of a cold start, so each backend is wrapped in a Lazy
+holder that imports and builds it on first use. get() is thread-safe and
+builds exactly once.
+
+Warmup runs a list of named checks: build the clients, open connections,
+prime caches. A replica is ready once every required check has passed; until
+then /readyz answers 503 so a load balancer keeps traffic away. Optional
+checks are reported but never block readiness. start() runs warmup in the
+background and retries failed required checks every retry_interval seconds.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import span
+
+
+class Lazy:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.value = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        value = self.value
+        if value is None:
+            with self.lock:
+                if self.value is None:
+                    with span(f"init.{self.name}"):
+                        self.value = self.factory()
+                value = self.value
+        return value
+
+    @property
+    def initialized(self):
+        return self.value is not None
+
+
+class Warmup:
+    def __init__(self, retry_interval=10.0):
+        self.retry_interval = retry_interval
+        self.checks = []
+        self.results = {}
+        self.state = "cold"
+        self.started = time.monotonic()
+        self.ready_after = None
+        self.lock = threading.Lock()
+        self.run_lock = threading.Lock()
+
+    def check(self, name, required=True):
+        """Decorator registering fn() as a warmup check; raising means it failed."""
+        def register(fn):
+            self.checks.append((name, fn, required))
+            return fn
+        return register
+
+    def run(self):
+        # Concurrent callers (the background thread and POST /warmup) share one run
+        with self.run_lock:
+            with self.lock:
+                self.state = "ready" if self.state == "ready" else "warming"
+            with ThreadPoolExecutor(max_workers=max(len(self.checks), 1), thread_name_prefix="warmup") as pool:
+                results = dict(zip(
+                    (name for name, _, _ in self.checks),
+                    pool.map(self._run_check, self.checks)
+                ))
+
+            ready = all(results[name]["ok"] for name, _, required in self.checks if required)
+            with self.lock:
+                self.results = results
+                if ready and self.ready_after is None:
+                    self.ready_after = round(time.monotonic() - self.started, 3)
+                self.state = "ready" if ready or self.state == "ready" else "failed"
+            return self.report()
+
+    def start(self):
+        def loop():
+            while self.run()["state"] != "ready":
+                time.sleep(self.retry_interval)
+
+        threading.Thread(target=loop, daemon=True, name="warmup").start()
+
+    @property
+    def ready(self):
+        with self.lock:
+            return self.state == "ready"
+
+    def report(self):
+        with self.lock:
+            return {"state": self.state, "ready_after": self.ready_after, "checks": dict(self.results)}
+
+    def _run_check(self, check):
+        name, fn, required = check
+        started = time.monotonic()
+        try:
+            with span(f"warmup.{name}"):
+                fn()
+            result = {"ok": True}
+        except Exception as e:
+            print(f"⚠️ Warmup check {name} failed: {e}")
+            result = {"ok": False, "error": str(e)}
+        return {**result, "required": required, "seconds": round(time.monotonic() - started, 3)}
@@ -0,0 +1,157 @@
+"""Content-addressed cache for Gemini responses.
+
+Keys are a hash of the normalized input text, the age band and the model
+name, so the same story seed asked for the same age group is only sent to
+Gemini once. Entries live in an in-memory LRU tier and, when a directory is
+configured, in an on-disk tier that survives restarts. Both tiers share one
+TTL.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    return " ".join(str(text).split())
+
+
+def cache_key(kind, text, age_band, model_name):
+    payload = json.dumps([kind, normalize_text(text), age_band, model_name])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=256, ttl=86400, disk_dir=None, max_disk_entries=4096):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "bypasses": 0, "evictions": 0}
+        self.disk_writes = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return value
+                del self.entries[key]
+
+        entry = self._read_disk(key, now)
+        with self.lock:
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+            self._remember(key, entry)
+            return entry[1]
+
+    def set(self, key, value):
+        entry = (time.time(), value)
+        with self.lock:
+            self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def get_or_compute(self, key, compute, bypass=False):
+        # A bypass skips the lookup but still stores the fresh result
+        if bypass:
+            with self.lock:
+                self.counters["bypasses"] += 1
+        else:
+            value = self.get(key)
+            if value is not None:
+                return value
+
+        value = compute()
+        if value:
+            self.set(key, value)
+        return value
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hit_rate = (self.counters["hits"] + self.counters["disk_hits"]) / lookups if lookups else 0.0
+            return {
+                **self.counters,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "disk": bool(self.disk_dir),
+                "hit_rate": round(hit_rate, 4),
+            }
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    # ---- on-disk tier ----
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if now - stored["created"] >= self.ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return stored["created"], stored["value"]
+
+    def _write_disk(self, key, entry):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"created": entry[0], "value": entry[1]}, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError) as e:
+            print(f"❌ Error writing response cache entry: {e}")
+            return
+
+        with self.lock:
+            self.disk_writes += 1
+            prune = self.disk_writes % 64 == 0
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        # Drop the oldest files once the disk tier grows past its limit
+        files = [entry for entry in os.scandir(self.disk_dir) if entry.name.endswith(".json")]
+        excess = len(files) - self.max_disk_entries
+        if excess <= 0:
+            return
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:excess]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
@@ -1,24 +1,249 @@
-from flask import Flask, request, jsonify
-from langchain_community.llms import Ollama
+from flask import Flask, request, jsonify, Response, stream_with_context, send_from_directory, abort, g
 from flask_cors import CORS
-import google.generativeai as genai
+from werkzeug.exceptions import RequestEntityTooLarge
 import re
-from PIL import Image
-import base64
-from io import BytesIO
+import json
 import time
-import requests
 import io
-from huggingface_hub import InferenceClient
+import contextvars
+import copy
 import os
-import shutil
+import threading
+import uuid
+import hashlib
+import mimetypes
+import tempfile
+import textwrap
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+from chat_sessions import ChatSessions
+from compaction import Compactor
+from image_ingest import ImageIngest, ImageTooLarge
+from image_store import ImageStore, IMAGE_NAME
+from llm_router import LLMRouter, GeminiBackend, OllamaBackend
+from model_registry import ModelRegistry
+from prefetch import Prefetcher
+from readiness import Lazy, Warmup
+from response_cache import ResponseCache, cache_key
+from singleflight import SingleFlight
+from story_library import StoryLibrary, story_id
+from suggestion_pool import SuggestionPool
+from telemetry import span, start_span, configure_trace_log, current_span, http_seconds, stats_samples, REGISTRY
+import telemetry
+from upstream import Upstream, UpstreamError, pooled_session
+from video_preprocess import VideoPreprocessor, find_ffmpeg
 
 app = Flask(__name__)
 CORS(app)
 
-client = InferenceClient("stabilityai/stable-diffusion-xl-base-1.0", token="")
-genai.configure(api_key="")
-model = genai.GenerativeModel("gemini-2.5-flash")
+# Illustration pipeline limits: how many prompt+render tasks run at once and
+# how long a single image may take, counted from when its render starts (not
+# while it waits for a free worker), before the story is returned without it.
+IMAGE_GEN_CONCURRENCY = int(os.environ.get("IMAGE_GEN_CONCURRENCY", "4"))
+IMAGE_GEN_TIMEOUT = float(os.environ.get("IMAGE_GEN_TIMEOUT", "90"))
+# Whatever the queue, a story's whole batch of illustrations gets at most
+# IMAGE_BATCH_TIMEOUT from submission; the frontend shows its placeholder for
+# any picture still missing then.
+IMAGE_BATCH_TIMEOUT = float(os.environ.get("IMAGE_BATCH_TIMEOUT", str(2 * IMAGE_GEN_TIMEOUT)))
+
+# Finished illustrations are kept by content hash and served from /images/
+IMAGE_STORE_DIR = os.environ.get("IMAGE_STORE_DIR", "image_store")
+IMAGE_STORE_MAX_FILES = int(os.environ.get("IMAGE_STORE_MAX_FILES", "4096"))
+
+# Every generated story, with its quizzes and image keys, is kept in this
+# SQLite file and can be listed, reopened and searched under /stories
+STORY_LIBRARY_DB = os.environ.get("STORY_LIBRARY_DB", "story_library.sqlite3")
+
+# Story and quiz responses are cached by input text + age band + model.
+# Set RESPONSE_CACHE_DIR to keep them on disk across restarts as well.
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR", "")
+
+# Every upstream call and pipeline stage is timed as a span and exported on
+# /metrics. Set TRACE_LOG to a file path (or "-" for stderr) to also write
+# each span as a JSON line.
+TRACE_LOG = os.environ.get("TRACE_LOG", "")
+configure_trace_log(TRACE_LOG)
+
+# Upstream backends. GEMINI_API_ENDPOINT / HF_INFERENCE_URL can point at local
+# stand-in servers (e.g. http://127.0.0.1:8001) for testing.
+MODEL_NAME = "gemini-2.5-flash"
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
+GEMINI_API_ENDPOINT = os.environ.get("GEMINI_API_ENDPOINT", "")
+HF_TOKEN = os.environ.get("HF_TOKEN", "")
+HF_INFERENCE_URL = os.environ.get("HF_INFERENCE_URL", "stabilityai/stable-diffusion-xl-base-1.0")
+
+# Limits shared by every upstream call: in-flight calls across all backends,
+# requests/second per backend, default deadline and retries per call, and
+# how many consecutive failures open a backend's circuit breaker.
+UPSTREAM_MAX_CONCURRENCY = int(os.environ.get("UPSTREAM_MAX_CONCURRENCY", "16"))
+UPSTREAM_RETRIES = int(os.environ.get("UPSTREAM_RETRIES", "2"))
+GEMINI_RATE_LIMIT = float(os.environ.get("GEMINI_RATE_LIMIT", "5"))
+GEMINI_TIMEOUT = float(os.environ.get("GEMINI_TIMEOUT", "120"))
+HF_RATE_LIMIT = float(os.environ.get("HF_RATE_LIMIT", "2"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", "30"))
+
+# The client libraries are imported and configured on first use (or by warmup),
+# which keeps them out of the import path of a cold start.
+def build_hf_client():
+    from huggingface_hub import InferenceClient, configure_http_backend
+    configure_http_backend(backend_factory=hf_session.get)
+    return InferenceClient(HF_INFERENCE_URL, token=HF_TOKEN or None, timeout=IMAGE_GEN_TIMEOUT)
+
+
+def build_genai():
+    import google.generativeai as genai
+    from google.generativeai import client as genai_client
+    if GEMINI_API_ENDPOINT:
+        genai.configure(api_key=GEMINI_API_KEY, transport="rest", client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+        # upload_file fetches its API description from a fixed googleapis.com URL; send it to the stand-in too
+        genai_client.GENAI_API_DISCOVERY_URL = f"{GEMINI_API_ENDPOINT.rstrip('/')}/$discovery/rest"
+    else:
+        genai.configure(api_key=GEMINI_API_KEY)
+    return genai
+
+
+# huggingface_hub and the local model send every request through one keep-alive pool
+hf_session = Lazy("http", lambda: pooled_session(UPSTREAM_MAX_CONCURRENCY))
+hf_client = Lazy("huggingface", build_hf_client)
+genai_module = Lazy("genai", build_genai)
+model = Lazy("gemini", lambda: genai_module.get().GenerativeModel(MODEL_NAME))
+
+upstream_slots = threading.BoundedSemaphore(UPSTREAM_MAX_CONCURRENCY)
+gemini_upstream = Upstream(
+    "gemini", upstream_slots,
+    rate=GEMINI_RATE_LIMIT, burst=2 * GEMINI_RATE_LIMIT, timeout=GEMINI_TIMEOUT, retries=UPSTREAM_RETRIES,
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT
+)
+hf_upstream = Upstream(
+    "huggingface", upstream_slots,
+    rate=HF_RATE_LIMIT, burst=2 * HF_RATE_LIMIT, timeout=IMAGE_GEN_TIMEOUT, retries=UPSTREAM_RETRIES,
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT
+)
+
+
+def gemini_generate(contents, timeout=None, stage="generate", target=None, **kwargs):
+    # stage names the span (gemini.story, gemini.quiz, ...) so latency and tokens are split by use;
+    # target is a ModelProfile (or other Lazy model) to use instead of the plain model
+    target = target or model
+    with span(f"gemini.{stage}", model=MODEL_NAME) as s:
+        response = gemini_upstream.call(
+            lambda remaining: target.get().generate_content(contents, request_options={"timeout": remaining}, **kwargs),
+            timeout=timeout
+        )
+        record_usage(s, response)
+        return response
+
+
+def gemini_stream(contents, stage="stream", target=None, **kwargs):
+    # The span lives as long as the stream, so it is ended by hand rather than made current
+    target = target or model
+    s = start_span(f"gemini.{stage}", model=MODEL_NAME, stream=True)
+    status = "error"
+    chunk = None
+    try:
+        for chunk in gemini_upstream.stream(
+            lambda remaining: target.get().generate_content(contents, stream=True, request_options={"timeout": remaining}, **kwargs)
+        ):
+            if "first_chunk_ms" not in s.attrs:
+                s.set(first_chunk_ms=round((time.monotonic() - s.start) * 1000, 3))
+            yield chunk
+        record_usage(s, chunk)
+        status = "ok"
+    except GeneratorExit:
+        status = "cancelled"
+        raise
+    finally:
+        s.end(status)
+
+
+def record_usage(s, response):
+    # Gemini reports token counts on the response (on the last chunk of a stream)
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        s.tokens(
+            prompt=usage.prompt_token_count,
+            output=usage.candidates_token_count,
+            cached=getattr(usage, "cached_content_token_count", 0)
+        )
+
+
+def timed_hf_client(timeout):
+    # A shallow copy with this attempt's share of the render's deadline as its HTTP timeout,
+    # so a render that runs out of time frees its worker instead of waiting on a full timeout
+    client = copy.copy(hf_client.get())
+    client.timeout = max(timeout, 1)
+    return client
+
+
+def text_to_image(prompt):
+    with span("sdxl.render", model=HF_INFERENCE_URL) as s:
+        image = hf_upstream.call(lambda remaining: timed_hf_client(remaining).text_to_image(prompt))
+        s.set(width=image.width, height=image.height)
+        return image
+
+
+# ============ LLM ROUTING ============
+
+# Text generations go through a router. Each task belongs to a tier, and each
+# tier tries an ordered list of backends: "gemini", plus "local" when
+# LOCAL_LLM_URL points at an Ollama-compatible server. By default, short tasks
+# (image prompts, suggestions) go to the local model first and fall back to
+# Gemini, while stories and quizzes stay on Gemini. A backend that has not
+# answered within its p95 latency is hedged with the next one. Before there is
+# enough history for a p95, LLM_HEDGE_DEFAULT seconds is used; leave it empty
+# to not hedge until then.
+LOCAL_LLM_URL = os.environ.get("LOCAL_LLM_URL", "")
+LOCAL_LLM_MODEL = os.environ.get("LOCAL_LLM_MODEL", "llama3.2")
+LOCAL_LLM_RATE_LIMIT = float(os.environ.get("LOCAL_LLM_RATE_LIMIT", "20"))
+LOCAL_LLM_TIMEOUT = float(os.environ.get("LOCAL_LLM_TIMEOUT", "30"))
+LLM_SMALL_BACKENDS = os.environ.get("LLM_SMALL_BACKENDS", "local,gemini" if LOCAL_LLM_URL else "gemini").split(",")
+LLM_LARGE_BACKENDS = os.environ.get("LLM_LARGE_BACKENDS", "gemini").split(",")
+LLM_HEDGE_DEFAULT = os.environ.get("LLM_HEDGE_DEFAULT", "")
+LLM_TASK_TIERS = {
+    "image_prompts": "small", "suggestions": "small", "learn_summary": "small", "compaction": "small", "story": "large", "quiz": "large"
+}
+
+llm_backends = {"gemini": GeminiBackend(gemini_generate)}
+local_upstream = None
+if LOCAL_LLM_URL:
+    local_upstream = Upstream(
+        "local", upstream_slots,
+        rate=LOCAL_LLM_RATE_LIMIT, burst=2 * LOCAL_LLM_RATE_LIMIT, timeout=LOCAL_LLM_TIMEOUT, retries=UPSTREAM_RETRIES,
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT
+    )
+    llm_backends["local"] = OllamaBackend(LOCAL_LLM_URL, LOCAL_LLM_MODEL, local_upstream, hf_session)
+
+llm_router = LLMRouter(
+    llm_backends,
+    tiers={"small": LLM_SMALL_BACKENDS, "large": LLM_LARGE_BACKENDS},
+    tasks=LLM_TASK_TIERS,
+    hedge_default=float(LLM_HEDGE_DEFAULT) if LLM_HEDGE_DEFAULT else None
+)
+
+
+def upstream_backends():
+    # Every Upstream in use, for /UpstreamStats and /metrics
+    backends = {"gemini": gemini_upstream, "huggingface": hf_upstream}
+    if local_upstream is not None:
+        backends["local"] = local_upstream
+    return backends
+
+
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_SIZE,
+    ttl=RESPONSE_CACHE_TTL,
+    disk_dir=RESPONSE_CACHE_DIR or None
+)
+
+# Identical generations already in flight are shared instead of sent upstream twice
+generation_flights = SingleFlight()
+
+image_store = ImageStore(IMAGE_STORE_DIR, max_files=IMAGE_STORE_MAX_FILES)
+story_library = StoryLibrary(STORY_LIBRARY_DB)
 
 
 @app.after_request
@@ -28,18 +253,106 @@ def after_request(response):
     return response
 
 
-# ============ STORYTELLER CORE LOGIC (AGE-BASED) ============
+@app.before_request
+def start_request_span():
+    # Every span opened while handling the request is parented to this one
+    g.request_span = start_span("http.request", method=request.method, path=request.path)
+    g.request_span_token = current_span.set(g.request_span)
+    g.request_started = time.monotonic()
 
-def storyTeller(input_text, age=10):
-    # Get age-appropriate story instructions
-    story_instructions = get_age_appropriate_story_instructions(age)
 
-    response = model.generate_content(
-        f"{story_instructions}\n\nTell a story in exactly 4 paragraphs based on the given context: {input_text}"
+@app.after_request
+def record_request_metrics(response):
+    # For streamed responses this is the time until the first byte
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    http_seconds.observe(
+        time.monotonic() - g.request_started, route=route, method=request.method, status=response.status_code
     )
+    g.request_span.set(route=route, status_code=response.status_code)
+    return response
+
+
+@app.teardown_request
+def end_request_span(error=None):
+    request_span = g.pop("request_span", None)
+    if request_span is None:
+        return
+    try:
+        current_span.reset(g.pop("request_span_token"))
+    except ValueError:
+        # A streamed response is torn down from inside its generator's context
+        current_span.set(None)
+    request_span.end("error" if error else "ok")
+
+
+@app.errorhandler(UpstreamError)
+def upstream_error(e):
+    # Circuit open, rate limited or out of upstream slots: fail fast so the worker is freed
+    print("Upstream unavailable:", e)
+    return jsonify({"error": str(e)}), 503
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return jsonify({"error": f"Request body is larger than {request.max_content_length} bytes"}), 413
+
+
+# ============ STORYTELLER CORE LOGIC (AGE-BASED) ============
+
+def storyTeller(input_text, age=10, use_cache=True):
+    # Returns the story and {paragraph number: image key} for its illustrations
+    story = generate_story(input_text, age, use_cache)
+    prefetch_quiz(story, age)
+
+    images = ImageGen(story)
+    return story, images
+
+
+def generate_story(input_text, age=10, use_cache=True):
+    key = story_cache_key(input_text, age)
 
-    ImageGen(response.text)  # Uncomment if you want to generate images automatically
-    return response.text
+    def generate():
+        return llm_router.generate("story", build_story_prompt(input_text), system=story_model(age))
+
+    with span("story.generate", age_band=get_age_band(age)) as s:
+        story = response_cache.get_or_compute(
+            key, lambda: generation_flights.do(("story", key), generate), bypass=not use_cache
+        )
+        s.set(chars=len(story))
+    save_story(input_text, story, age)
+    return story
+
+
+def story_cache_key(input_text, age=10):
+    return cache_key("story", input_text, get_age_band(age), MODEL_NAME)
+
+
+def build_story_prompt(input_text):
+    # The age-appropriate instructions are the system instruction of story_model(age)
+    return f"Tell a story in exactly 4 paragraphs based on the given context: {input_text}"
+
+
+# Age bands used by both the story and quiz instructions below
+def get_age_band(age):
+    age = int(age)
+
+    if age < 7:
+        return "under-7"
+    elif age >= 7 and age < 13:
+        return "7-12"
+    elif age >= 13 and age <= 20:
+        return "13-20"
+    else:
+        return "20+"
+
+
+# How each age band reads inside a sentence ("their child who is younger than 7")
+AGE_BAND_PHRASES = {
+    "under-7": "younger than 7",
+    "7-12": "aged 7 to 12",
+    "13-20": "aged 13 to 20",
+    "20+": "aged 20 or older",
+}
 
 
 # Helper function to provide age-appropriate story instructions
@@ -113,20 +426,204 @@ def get_age_appropriate_story_instructions(age):
         """
 
 
+# ============ INPUT COMPACTION ============
+
+# Texts estimated at more than COMPACTION_THRESHOLD_TOKENS are shortened to
+# about COMPACTION_RATIO of their size before they go into the quiz and image
+# prompt calls. COMPACTION_MODE "extractive" keeps the most informative
+# sentences locally; "chunked" has the small LLM tier rewrite each paragraph.
+# A compaction that keeps less than COMPACTION_MIN_COVERAGE of the text's key
+# terms is retried longer, or skipped. Results are cached per story hash.
+COMPACTION_THRESHOLD_TOKENS = int(os.environ.get("COMPACTION_THRESHOLD_TOKENS", "1500"))
+COMPACTION_RATIO = float(os.environ.get("COMPACTION_RATIO", "0.4"))
+COMPACTION_MIN_COVERAGE = float(os.environ.get("COMPACTION_MIN_COVERAGE", "0.6"))
+COMPACTION_MODE = os.environ.get("COMPACTION_MODE", "extractive")
+
+
+def summarize_paragraph(paragraph, target_tokens):
+    return llm_router.generate(
+        "compaction",
+        f"Rewrite this story paragraph in about {target_tokens} tokens. Keep every character, place, event and "
+        f"number in it. Reply with the rewritten paragraph only.\n\n{paragraph}"
+    )
+
+
+compactor = Compactor(
+    threshold_tokens=COMPACTION_THRESHOLD_TOKENS,
+    ratio=COMPACTION_RATIO,
+    min_coverage=COMPACTION_MIN_COVERAGE,
+    summarize=summarize_paragraph if COMPACTION_MODE == "chunked" else None
+)
+
+
+def compact_paragraphs(text):
+    # The story's paragraphs, shortened when the story is long; same count and order either way
+    paragraphs = text.split("\n\n")
+    if not compactor.should_compact(text):
+        return paragraphs
+    settings = f"{compactor.mode}:{COMPACTION_RATIO}:{COMPACTION_MIN_COVERAGE}"
+    key = cache_key("compact", text, settings, MODEL_NAME)
+    return response_cache.get_or_compute(
+        key, lambda: generation_flights.do(("compact", key), lambda: compactor.compact(paragraphs))
+    )
+
+
+def compact_story(text):
+    return "\n\n".join(compact_paragraphs(text))
+
+
 # ============ QUIZBOT CORE LOGIC (AGE-BASED) ============
 
-def quizBot(input_text, age=10):
-    # Get age-appropriate quiz instructions
-    age_instructions = get_age_appropriate_quiz_instructions(age)
+def quizBot(input_text, age=10, use_cache=True):
+    def generate():
+        return generate_quiz_questions(compact_story(input_text), age)
+
+    key = quiz_cache_key(input_text, age)
+
+    # Empty (unparseable) quizzes are never cached, so they are retried next time
+    with span("quiz.generate", age_band=get_age_band(age)) as s:
+        quiz_data = response_cache.get_or_compute(
+            key, lambda: generation_flights.do(("quiz", key), generate), bypass=not use_cache
+        )
+        s.set(questions=len(quiz_data))
+    save_quiz(input_text, quiz_data, age)
+    return quiz_data
+
+
+def quiz_cache_key(input_text, age=10):
+    # "quiz.v2": answers are stored as their letter; older disk entries kept the model's wording
+    return cache_key("quiz.v2", input_text, get_age_band(age), MODEL_NAME)
+
+
+# ============ QUIZ PREFETCH ============
+
+# The quiz page asks /QuizBot about the story /StoryTeller just returned, so
+# as soon as a story exists its quiz is generated in the background, keyed
+# like the response cache (story hash + age band). The /QuizBot call then
+# finds it ready or joins it in flight. QUIZ_PREFETCH=0 turns this off; the
+# other settings cap the quota spent on quizzes nobody asks for. Hit rate
+# and waste are reported under "quiz_prefetch" in /CacheStats and /metrics.
+QUIZ_PREFETCH = os.environ.get("QUIZ_PREFETCH", "1") == "1"
+QUIZ_PREFETCH_WORKERS = int(os.environ.get("QUIZ_PREFETCH_WORKERS", "2"))
+QUIZ_PREFETCH_MAX_IN_FLIGHT = int(os.environ.get("QUIZ_PREFETCH_MAX_IN_FLIGHT", "4"))
+QUIZ_PREFETCH_MAX_ENTRIES = int(os.environ.get("QUIZ_PREFETCH_MAX_ENTRIES", "128"))
+QUIZ_PREFETCH_TTL = float(os.environ.get("QUIZ_PREFETCH_TTL", "1800"))
+
+quiz_prefetcher = Prefetcher(
+    workers=QUIZ_PREFETCH_WORKERS,
+    max_in_flight=QUIZ_PREFETCH_MAX_IN_FLIGHT,
+    max_entries=QUIZ_PREFETCH_MAX_ENTRIES,
+    ttl=QUIZ_PREFETCH_TTL
+)
+
+
+def prefetch_quiz(story, age=10):
+    if QUIZ_PREFETCH and story:
+        quiz_prefetcher.prefetch(quiz_cache_key(story, age), lambda: quizBot(story, age))
+
+
+def claim_prefetched_quiz(input_text, age=10, use_cache=True, wait=True):
+    # A no-cache request asks for a fresh quiz, so it never takes a prefetched one. A streamed
+    # quiz (wait=False) only takes a finished one, so its first question is not held up.
+    if not (QUIZ_PREFETCH and use_cache):
+        return None
+    return quiz_prefetcher.take(quiz_cache_key(input_text, age), timeout=GEMINI_TIMEOUT, wait=wait) or None
+
+
+# ============ QUIZ BATCHES ============
+
+# /QuizBot/batch takes up to QUIZ_BATCH_MAX_ITEMS {text, age} items (a reading
+# list, or one story for several age groups) and generates them
+# QUIZ_BATCH_WORKERS at a time across all batches. Each Gemini call still goes
+# through the shared upstream limits, and identical story + age band items
+# share one generation.
+QUIZ_BATCH_MAX_ITEMS = int(os.environ.get("QUIZ_BATCH_MAX_ITEMS", "50"))
+QUIZ_BATCH_WORKERS = int(os.environ.get("QUIZ_BATCH_WORKERS", "8"))
+
+quiz_batch_executor = ThreadPoolExecutor(max_workers=QUIZ_BATCH_WORKERS, thread_name_prefix="quizbatch")
+
+
+def read_quiz_batch(input_data):
+    # Returns (items, error message)
+    items = input_data.get("items")
+    if not isinstance(items, list) or not items:
+        return None, "items must be a non-empty list of {text, age} objects"
+    if len(items) > QUIZ_BATCH_MAX_ITEMS:
+        return None, f"A batch holds at most {QUIZ_BATCH_MAX_ITEMS} items"
+    return items, None
+
 
+def check_quiz_batch_item(index, item):
+    # Returns (result line so far, text, age, error); the line carries the item's index, id and age band
+    result = {"index": index}
+    if not isinstance(item, dict):
+        return result, None, None, "Each item must be an object with text and age"
+    if "id" in item:
+        result["id"] = item["id"]
+
+    text, age = item.get("text", ""), item.get("age", 10)
+    if not isinstance(text, str) or not text.strip():
+        return result, None, None, "No story text provided"
+    try:
+        result["age_band"] = get_age_band(age)
+    except (TypeError, ValueError):
+        return result, None, None, "Invalid age"
+    return result, text, age, None
+
+
+def run_quiz_batch_item(index, item, use_cache=True):
+    # Failures are reported on the item's own line, never raised
+    result, text, age, error = check_quiz_batch_item(index, item)
+    if error:
+        return {**result, "error": error}
+    try:
+        quiz = quizBot(text, age, use_cache)
+    except UpstreamError as e:
+        return {**result, "error": str(e)}
+    except Exception as e:
+        print(f"Error generating quiz for batch item {index}:", e)
+        quiz = None
+    if not quiz:
+        return {**result, "error": "Failed to generate quiz"}
+    return {**result, "response": quiz}
+
+
+def run_quiz_batch(items, use_cache=True):
+    # Yields one NDJSON line per item in completion order, then a summary line
+    futures = [
+        quiz_batch_executor.submit(contextvars.copy_context().run, run_quiz_batch_item, index, item, use_cache)
+        for index, item in enumerate(items)
+    ]
+    failed = 0
+    try:
+        for future in as_completed(futures):
+            result = future.result()
+            failed += "error" in result
+            yield json.dumps(result) + "\n"
+    finally:
+        # Items that have not started yet are dropped when the client goes away
+        for future in futures:
+            future.cancel()
+    yield json.dumps({"done": True, "items": len(items), "failed": failed}) + "\n"
+
+
+def stream_quiz(input_text, age=10):
+    # Yields each question as soon as its "Correct Answer" line has arrived
+    parser = QuizStreamParser()
+    for chunk in gemini_stream(build_quiz_prompt(compact_story(input_text)), stage="quiz", target=quiz_model(age)):
+        if chunk.parts:
+            yield from parser.feed(chunk.text)
+    yield from parser.close()
+
+
+def build_quiz_prompt(input_text):
+    # The streamed (text) quiz format; the age-appropriate instructions are the system instruction of quiz_model(age)
     text = f"""
-    Generate 10 multiple-choice questions based on the provided story. For each question, include:
+    Generate {QUIZ_QUESTIONS} multiple-choice questions based on the provided story. For each question, include:
     1. The question text.
     2. Four options (labeled a, b, c, d).
     3. skip 2 lines before starting the next question.
 
-    {age_instructions}
-
     Use this exact format for the response:
     Question 1: [Your question here]
     a) [Option 1]
@@ -135,18 +632,10 @@ def quizBot(input_text, age=10):
     d) [Option 4]
     Correct Answer: [Letter of the correct answer]
 
-    Repeat for all 10 questions.
+    Repeat for all {QUIZ_QUESTIONS} questions.
     """
 
-    response = model.generate_content(
-        f"in the following format: {text} \n Frame 10 questions and give 4 options with one correct answer on the following story: {input_text}"
-    )
-
-    print(response.text)
-    quiz_data = parse_quiz_response(response.text)
-    print(quiz_data)
-
-    return quiz_data
+    return f"in the following format: {text} \n Frame {QUIZ_QUESTIONS} questions and give 4 options with one correct answer on the following story: {input_text}"
 
 
 def get_age_appropriate_quiz_instructions(age):
@@ -214,74 +703,967 @@ def get_age_appropriate_quiz_instructions(age):
         """
 
 
-def parse_quiz_response(response):
-    questions = re.split(r"(?=Question \d+:)", response.strip())
-    parsed_questions = []
+class QuizStreamParser:
+    """Incremental parser for the "Question N / a)-d) / Correct Answer" quiz format.
+
+    Feed it model output in arbitrary chunks; every call returns the questions
+    completed by that chunk, normalized like the JSON quizzes (options
+    labelled "a) ..." and the answer reduced to its letter). Blank lines,
+    markdown bold and extra option lines are tolerated. A question missing its
+    answer is dropped when the next one starts, and so is one with fewer than
+    four options or an answer that names none of them.
+    """
+
+    QUESTION_LINE = re.compile(r"^\W*Question\s*\d+\s*[:.)\-–—]?\s*(.*)$", re.IGNORECASE)
+    OPTION_LINE = re.compile(r"^\W*[a-d]\s*[).:]", re.IGNORECASE)
+    ANSWER_LINE = re.compile(r"^\W*Correct Answer\W*\s*(.*)$", re.IGNORECASE)
+
+    def __init__(self):
+        self.buffer = ""
+        self.question = None
+        self.options = []
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        *lines, self.buffer = self.buffer.split("\n")
+        return self._consume(lines)
+
+    def close(self):
+        lines, self.buffer = [self.buffer], ""
+        return self._consume(lines)
+
+    def _consume(self, lines):
+        completed = []
+        for line in lines:
+            line = line.replace("**", "").strip()
+            if not line:
+                continue
+
+            question_match = self.QUESTION_LINE.match(line)
+            answer_match = self.ANSWER_LINE.match(line)
+
+            if question_match:
+                self.question = question_match.group(1).strip()
+                self.options = []
+            elif self.question is None:
+                continue
+            elif answer_match:
+                question = normalize_quiz_question({
+                    "question": self.question,
+                    "options": self.options[:4],
+                    "answer": answer_match.group(1).strip()
+                })
+                if question:
+                    completed.append(question)
+                self.question = None
+                self.options = []
+            elif self.OPTION_LINE.match(line):
+                self.options.append(line)
+            elif not self.options:
+                self.question = f"{self.question} {line}".strip()
+
+        return completed
+
+
+# ============ AGE-BAND MODELS ============
+
+# The story and quiz instructions for each age band are compiled once into
+# the system instruction of a prebuilt model handle, so requests carry only
+# the child's input. GEMINI_CONTEXT_CACHE=1 also stores each instruction set
+# as Gemini cached content for GEMINI_CONTEXT_CACHE_TTL seconds. Gemini only
+# caches contents above its minimum size; smaller sets fall back to a plain
+# system instruction.
+GEMINI_CONTEXT_CACHE = os.environ.get("GEMINI_CONTEXT_CACHE", "0") == "1"
+GEMINI_CONTEXT_CACHE_TTL = float(os.environ.get("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+
+# An age inside each band, to render that band's instructions
+AGE_BAND_AGES = {"under-7": 5, "7-12": 10, "13-20": 16, "20+": 30}
+
+QUIZ_SYSTEM_INSTRUCTION = (
+    "You write multiple-choice quizzes about stories. Every question has four options and exactly one correct "
+    "answer, and can be answered from the story alone."
+)
+
+model_registry = ModelRegistry(
+    genai_module, MODEL_NAME, context_cache=GEMINI_CONTEXT_CACHE, cache_ttl=GEMINI_CONTEXT_CACHE_TTL
+)
+for band, band_age in AGE_BAND_AGES.items():
+    model_registry.register("story", band, textwrap.dedent(get_age_appropriate_story_instructions(band_age)).strip())
+    model_registry.register(
+        "quiz", band,
+        f"{QUIZ_SYSTEM_INSTRUCTION}\n\n{textwrap.dedent(get_age_appropriate_quiz_instructions(band_age)).strip()}"
+    )
 
-    for question in questions:
-        lines = question.strip().split("\n")
 
-        if len(lines) >= 6:
-            question_text = re.sub(r"^Question \d+:\s*", "", lines[0]).strip()
-            options = [line.strip() for line in lines[1:5]]
-            correct_answer = lines[5].replace("Correct Answer: ", "").strip()
+def story_model(age=10):
+    return model_registry.profile("story", get_age_band(age))
+
+
+def quiz_model(age=10):
+    return model_registry.profile("quiz", get_age_band(age))
+
+
+# ============ STRUCTURED QUIZZES ============
+
+# Non-streamed quizzes are asked for as JSON that follows QUIZ_SCHEMA. Each
+# question is checked on its own, and only the malformed ones are asked for
+# again (up to QUIZ_REPAIR_ATTEMPTS follow-up calls), instead of retrying
+# the whole quiz. app_quiz_questions_total counts the outcomes.
+QUIZ_QUESTIONS = int(os.environ.get("QUIZ_QUESTIONS", "10"))
+QUIZ_REPAIR_ATTEMPTS = int(os.environ.get("QUIZ_REPAIR_ATTEMPTS", "1"))
+
+QUIZ_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "question": {"type": "string"},
+            "options": {"type": "array", "items": {"type": "string"}},
+            "answer": {"type": "string", "enum": ["a", "b", "c", "d"]},
+        },
+        "required": ["question", "options", "answer"],
+    },
+}
+OPTION_LABEL = re.compile(r"^\W*[a-d]\s*[).:]\s*", re.IGNORECASE)
+ANSWER_LABEL = re.compile(r"^(?:option\s+)?([a-d])\s*(?:[).:].*)?$", re.IGNORECASE)
+
+quiz_questions = REGISTRY.counter(
+    "app_quiz_questions_total", "Structured quiz questions: ok, malformed, or repaired by a follow-up call.",
+    ("outcome",)
+)
+
+
+def build_quiz_json_prompt(story, count, avoid=()):
+    repeat = ""
+    if avoid:
+        repeat = "\nDo not repeat any of these questions:\n" + "\n".join(f"- {question}" for question in avoid)
+    return (
+        f"Generate {count} multiple-choice questions based on the following story. For each, give the question, "
+        f"its four options (without letters) and the letter (a, b, c or d) of the correct option.{repeat}"
+        f"\n\nStory: {story}"
+    )
 
-            parsed_questions.append({
-                "question": question_text,
-                "options": options,
-                "correctAnswer": correct_answer
-            })
 
-    return parsed_questions
+def parse_quiz_json(text, count):
+    # Returns (questions in the frontend's format, how many of the count asked for are missing or malformed)
+    try:
+        items = json.loads(text)
+    except ValueError:
+        return [], count
+    if isinstance(items, dict):
+        # JSON mode without a schema (a local model) may wrap the list in an object
+        items = next((value for value in items.values() if isinstance(value, list)), [])
+    if not isinstance(items, list):
+        return [], count
+
+    questions = [question for question in map(normalize_quiz_question, items) if question]
+    return questions, max(count - len(questions), 0)
+
+
+def normalize_quiz_question(item):
+    if not isinstance(item, dict) or not isinstance(item.get("options"), list):
+        return None
+    question = str(item.get("question", "")).strip()
+    options = [OPTION_LABEL.sub("", str(option)).strip() for option in item["options"]]
+    if not question or len(options) != 4 or not all(options):
+        return None
+
+    answer = str(item.get("answer", "")).strip()
+    label = ANSWER_LABEL.match(answer)
+    if label:
+        letter = label.group(1).lower()
+    else:
+        # An answer given as the option text instead of its letter
+        matches = [letter for letter, option in zip("abcd", options) if option.lower() == answer.lower()]
+        if not matches:
+            return None
+        letter = matches[0]
+    return {
+        "question": question,
+        "options": [f"{letter}) {option}" for letter, option in zip("abcd", options)],
+        "correctAnswer": letter,
+    }
+
+
+def generate_quiz_questions(story, age=10):
+    system = quiz_model(age)
+
+    def ask(count, avoid=()):
+        text = llm_router.generate("quiz", build_quiz_json_prompt(story, count, avoid), schema=QUIZ_SCHEMA, system=system)
+        return parse_quiz_json(text, count)
+
+    questions, malformed = ask(QUIZ_QUESTIONS)
+    quiz_questions.inc(len(questions), outcome="ok")
+    quiz_questions.inc(malformed, outcome="malformed")
+    for _ in range(QUIZ_REPAIR_ATTEMPTS):
+        if not malformed:
+            break
+        repaired, _ = ask(malformed, [question["question"] for question in questions])
+        repaired = repaired[:malformed]
+        quiz_questions.inc(len(repaired), outcome="repaired")
+        quiz_questions.inc(malformed - len(repaired), outcome="malformed")
+        questions += repaired
+        malformed -= len(repaired)
+    return questions
 
 
 # ============ IMAGE GENERATION ============
 
 
-def ImageGen(text):
-    images_folder = "public/Images"
-    public_folder = "public"
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_GEN_CONCURRENCY, thread_name_prefix="imagegen")
 
-    # --- Step 1: Empty the public/Images folder before generating ---
-    if os.path.exists(images_folder):
-        shutil.rmtree(images_folder)
-    os.makedirs(images_folder, exist_ok=True)
 
+def generate_image_prompts(paragraphs):
+    # One call writes the prompts for every paragraph at once
+    key = cache_key("image-prompts", "\n\n".join(paragraphs), "", MODEL_NAME)
+
+    def write_prompts():
+        # A long story is shortened first; the prompts only need each paragraph's gist
+        compacted = compact_paragraphs("\n\n".join(paragraphs))
+        numbered = "\n\n".join(f"Paragraph {i + 1}: {paragraph}" for i, paragraph in enumerate(compacted))
+        try:
+            PromptImages = llm_router.generate(
+                "image_prompts",
+                f"For each of the following {len(paragraphs)} story paragraphs, generate a scenario-based prompt "
+                f"no more than 20 words to generate an image based on that paragraph. Respond with a JSON array "
+                f"of exactly {len(paragraphs)} strings, in paragraph order.\n\n{numbered}",
+                timeout=IMAGE_GEN_TIMEOUT,
+                json_output=True
+            )
+            return parse_image_prompts(PromptImages, len(paragraphs))
+        except Exception as e:
+            print(f"❌ Error generating image prompts: {e}")
+            return None
+
+    # Only well-formed prompt lists are cached; malformed output falls back locally
+    with span("story.image_prompts", paragraphs=len(paragraphs)) as s:
+        prompts = response_cache.get_or_compute(key, lambda: generation_flights.do(("image-prompts", key), write_prompts))
+        s.set(fallback=prompts is None)
+    if prompts is None:
+        print("⚠️ Falling back to local image prompts")
+        prompts = [local_image_prompt(paragraph) for paragraph in paragraphs]
+    return prompts
+
+
+def parse_image_prompts(response_text, count):
+    # Accepts a JSON array of strings (optionally inside a ```json fence) with one prompt per paragraph
+    match = re.search(r"\[.*\]", response_text, re.DOTALL)
+    if not match:
+        return None
+    try:
+        prompts = json.loads(match.group(0))
+    except ValueError:
+        return None
+
+    if len(prompts) != count or not all(isinstance(prompt, str) and prompt.strip() for prompt in prompts):
+        return None
+    return [prompt.strip() for prompt in prompts]
+
+
+def local_image_prompt(paragraph):
+    # Used when Gemini's batched output is unusable: the first 20 words of the paragraph
+    words = re.sub(r"\s+", " ", paragraph).strip().split(" ")[:20]
+    return f"Colorful children's storybook illustration: {' '.join(words)}"
+
+
+def render_illustration(number, prompt):
+    # Returns the image store key; a prompt rendered before is served from the store
+    with span("story.render", number=number, prompt=prompt) as s:
+        prompt_hash = cache_key("image", prompt, "", HF_INFERENCE_URL)
+        key = image_store.lookup_prompt(prompt_hash)
+        s.set(reused=key is not None)
+        if key is not None:
+            return key
+
+        def render():
+            image = text_to_image(prompt)
+            with span("image_store.write") as write:
+                key = image_store.put(image)
+                image_store.remember_prompt(prompt_hash, key)
+                write.bytes(written=os.path.getsize(image_store.path(f"{key}.webp")))
+            return key
+
+        key = generation_flights.do(("image", prompt_hash), render)
+        s.set(key=key)
+        return key
+
+
+def ImageGen(text, on_image=None):
+    # Returns {paragraph number: image key} for every illustration that finished in time
+    with span("story.images") as s:
+        images, tasks = generate_images(text, on_image)
+        s.set(images=len(images), tasks=len(tasks))
+    print(f"✅ {len(images)}/{len(tasks)} images generated and saved in {IMAGE_STORE_DIR}.")
+    save_images(text, images)
+    return images
+
+
+def generate_images(text, on_image=None):
     ParaList = text.split("\n\n")
 
-    # --- Step 2: Generate images for each paragraph except the last ---
-    for i in range(len(ParaList) - 1):
-        PromptImage = model.generate_content(
-            f"Generate a scenario-based prompt no more than 20 words to generate an image based on the following context: {ParaList[i]}"
+    # --- Step 1: Write every paragraph's image prompt in a single call ---
+    prompts = generate_image_prompts(ParaList)
+
+    # --- Step 2: One render per paragraph except the last ---
+    tasks = [(i + 1, prompts[i]) for i in range(len(ParaList) - 1)]
+
+    # --- Step 3: The fourth paragraph always gets a picture, even when it is the last one ---
+    if len(ParaList) == 4:
+        tasks.append((4, prompts[3]))
+    elif len(ParaList) < 4:
+        print("❌ Error generating final image: story has fewer than 4 paragraphs")
+
+    # --- Step 4: Run every render at once on the shared pool, noting when each one starts ---
+    started = {}
+
+    def render(number, prompt):
+        started[number] = time.monotonic()
+        return render_illustration(number, prompt)
+
+    futures = {}
+    for task in tasks:
+        # Each render runs in a copy of this context so its span is parented to this story
+        future = image_executor.submit(contextvars.copy_context().run, render, *task)
+        if on_image:
+            def notify(f, number=task[0]):
+                if not f.cancelled() and f.exception() is None:
+                    on_image(number, f.result())
+            future.add_done_callback(notify)
+        futures[future] = task[0]
+
+    # --- Step 5: Give each render IMAGE_GEN_TIMEOUT from its own start, and the batch IMAGE_BATCH_TIMEOUT ---
+    batch_deadline = time.monotonic() + IMAGE_BATCH_TIMEOUT
+    pending, timed_out, missed = set(futures), set(), set()
+    while pending:
+        now = time.monotonic()
+        if now >= batch_deadline:
+            missed = pending
+            break
+        left = {future: started[futures[future]] + IMAGE_GEN_TIMEOUT - now
+                for future in pending if futures[future] in started}
+        timed_out |= {future for future, seconds in left.items() if seconds <= 0}
+        pending -= timed_out
+        if pending:
+            # Queued renders have no clock yet, so check back at least every second for ones that started
+            seconds = min([seconds for seconds in left.values() if seconds > 0] + [1.0, batch_deadline - now])
+            wait(pending, timeout=seconds, return_when=FIRST_COMPLETED)
+            pending = {future for future in pending if not future.done()}
+
+    images = {}
+    for future, number in futures.items():
+        if future in timed_out:
+            print(f"⏱️ Image{number} timed out after {IMAGE_GEN_TIMEOUT:.0f}s")
+            continue
+        if future in missed:
+            # A render still queued is dropped, so it does not hold up the next story
+            future.cancel()
+            print(f"⏱️ Image{number} missed the story's {IMAGE_BATCH_TIMEOUT:g}s deadline")
+            continue
+        try:
+            images[number] = future.result()
+        except Exception as e:
+            print(f"❌ Error generating Image{number}: {e}")
+
+    return images, tasks
+
+
+# ============ STORY JOBS (BACKGROUND ILLUSTRATIONS) ============
+
+# Jobs only track which image store keys belong to a story; the pictures
+# themselves live in the store, so concurrent stories never clash.
+STORY_JOB_WORKERS = int(os.environ.get("STORY_JOB_WORKERS", "4"))
+STORY_JOB_TTL = float(os.environ.get("STORY_JOB_TTL", "3600"))
+
+story_job_executor = ThreadPoolExecutor(max_workers=STORY_JOB_WORKERS, thread_name_prefix="storyjob")
+story_jobs = {}
+story_jobs_lock = threading.Lock()
+
+
+def start_story_job(story):
+    expire_story_jobs()
+
+    job_id = uuid.uuid4().hex
+    with story_jobs_lock:
+        story_jobs[job_id] = {"status": "queued", "images": {}, "created": time.time()}
+
+    story_job_executor.submit(contextvars.copy_context().run, run_story_job, job_id, story)
+    return job_id
+
+
+def run_story_job(job_id, story):
+    with story_jobs_lock:
+        story_jobs[job_id]["status"] = "running"
+
+    def on_image(number, key):
+        with story_jobs_lock:
+            story_jobs[job_id]["images"][number] = key
+
+    try:
+        ImageGen(story, on_image=on_image)
+        status = "done"
+    except Exception as e:
+        print(f"❌ Story job {job_id} failed: {e}")
+        status = "failed"
+
+    with story_jobs_lock:
+        story_jobs[job_id]["status"] = status
+
+
+def get_story_job(job_id):
+    with story_jobs_lock:
+        job = story_jobs.get(job_id)
+        if job is None:
+            return None
+        return {"job_id": job_id, "status": job["status"], **image_urls(job["images"])}
+
+
+def image_urls(images):
+    # {paragraph number: key} -> the URL maps returned to the frontend
+    urls = {number: image_store.urls(key) for number, key in images.items()}
+    return {
+        "images": {str(number): url["image"] for number, url in urls.items()},
+        "thumbnails": {str(number): url["thumbnail"] for number, url in urls.items()},
+    }
+
+
+def expire_story_jobs():
+    cutoff = time.time() - STORY_JOB_TTL
+    with story_jobs_lock:
+        expired = [
+            job_id for job_id, job in story_jobs.items()
+            if job["created"] < cutoff and job["status"] in ("done", "failed")
+        ]
+        for job_id in expired:
+            del story_jobs[job_id]
+
+
+# ============ STORY LIBRARY ============
+
+# Stories are recorded as they are generated, quizzes and illustrations as
+# they are added to a recorded story. The library is a record, not part of
+# the request: a failed write is logged and the response goes out anyway.
+
+def save_story(prompt, story, age=10):
+    if not story:
+        return None
+    try:
+        return story_library.record_story(prompt, story, get_age_band(age))
+    except sqlite3.Error as e:
+        print(f"❌ Error saving story to the library: {e}")
+        return story_id(story)
+
+
+def save_quiz(story, quiz_data, age=10):
+    if not quiz_data:
+        return
+    try:
+        story_library.record_quiz(story, get_age_band(age), quiz_data)
+    except sqlite3.Error as e:
+        print(f"❌ Error saving quiz to the library: {e}")
+
+
+def save_images(story, images):
+    if not images:
+        return
+    try:
+        story_library.record_images(story, images)
+    except sqlite3.Error as e:
+        print(f"❌ Error saving image keys to the library: {e}")
+
+
+def library_summary(summary):
+    # The first illustration's thumbnail serves as the cover in listings
+    images = summary.pop("images")
+    cover = image_store.urls(images[min(images)])["thumbnail"] if images else None
+    return {**summary, "cover": cover}
+
+
+def read_page_args(args, default_limit=20, max_limit=100):
+    try:
+        limit = min(max(int(args.get("limit", default_limit)), 1), max_limit)
+        offset = max(int(args.get("offset", 0)), 0)
+    except ValueError:
+        return None, None, "limit and offset must be integers"
+    return limit, offset, None
+
+
+# ============ LEARNBOT CORE LOGIC ============
+
+# Uploaded images are size-checked before decoding, then downscaled to
+# LEARN_IMAGE_MAX_SIDE and re-encoded as JPEG before they are sent to Gemini
+LEARN_IMAGE_MAX_BYTES = int(os.environ.get("LEARN_IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+LEARN_IMAGE_MAX_PIXELS = int(os.environ.get("LEARN_IMAGE_MAX_PIXELS", "40000000"))
+LEARN_IMAGE_MAX_SIDE = int(os.environ.get("LEARN_IMAGE_MAX_SIDE", "1024"))
+LEARN_IMAGE_WORKERS = int(os.environ.get("LEARN_IMAGE_WORKERS", "2"))
+# Whole LearnBot request bodies are refused above this (an image as base64 plus
+# the other fields), before Werkzeug reads or spools them
+LEARN_MAX_BODY_BYTES = LEARN_IMAGE_MAX_BYTES * 4 // 3 + 64 * 1024
+
+learn_images = ImageIngest(
+    max_bytes=LEARN_IMAGE_MAX_BYTES,
+    max_pixels=LEARN_IMAGE_MAX_PIXELS,
+    max_side=LEARN_IMAGE_MAX_SIDE,
+    workers=LEARN_IMAGE_WORKERS
+)
+
+
+# LearnBot chats are kept on the server: the client sends its session_id and
+# the new message only. A session's history stays within
+# LEARN_SESSION_TOKEN_BUDGET (estimated) tokens: older exchanges are
+# summarized, keeping the last LEARN_SESSION_KEEP_TURNS verbatim. Images are
+# kept per session and counted by their 768px tiles, and a message can send
+# "image_hash" (returned with the reply) instead of uploading the same
+# picture again.
+LEARN_SESSION_MAX = int(os.environ.get("LEARN_SESSION_MAX", "1000"))
+LEARN_SESSION_TTL = float(os.environ.get("LEARN_SESSION_TTL", "1800"))
+LEARN_SESSION_TOKEN_BUDGET = int(os.environ.get("LEARN_SESSION_TOKEN_BUDGET", "4000"))
+LEARN_SESSION_KEEP_TURNS = int(os.environ.get("LEARN_SESSION_KEEP_TURNS", "2"))
+LEARN_SESSION_MAX_IMAGES = int(os.environ.get("LEARN_SESSION_MAX_IMAGES", "8"))
+# Session images are uploaded once to Gemini's File API and referenced by URI
+# on later turns; LEARN_IMAGE_UPLOAD=0 resends them inline every time
+LEARN_IMAGE_UPLOAD = os.environ.get("LEARN_IMAGE_UPLOAD", "1") == "1"
+
+
+def summarize_learn_session(summary, exchanges):
+    lines = []
+    for exchange in exchanges:
+        image = " (sent a picture)" if exchange["image"] else ""
+        lines.append(f"Child{image}: {exchange['text']}")
+        lines.append(f"Tutor: {exchange['reply']}")
+    earlier = f"Summary so far: {summary}\n\n" if summary else ""
+    prompt = (
+        "Summarize this conversation between a child and a kind tutor in at most 120 words. Keep what the child "
+        "asked, the mistakes that were corrected and anything the tutor promised to come back to.\n\n"
+        f"{earlier}" + "\n".join(lines)
+    )
+    return llm_router.generate("learn_summary", prompt)
+
+
+def upload_learn_image(image):
+    # Runs on the sessions' pool after the message that brought the image
+    with span("learn.image_upload") as s:
+        image_file = gemini_upstream.call(
+            lambda remaining: upload_file(io.BytesIO(image["data"]), image["mime_type"], display_name="learnbot-image")
         )
-        print(f"🖼️ Prompt {i+1}: {PromptImage.text}")
+        s.bytes(written=len(image["data"]))
+    return wait_for_file(image_file, stage="learn")
+
+
+learn_sessions = ChatSessions(
+    summarize_learn_session,
+    upload=upload_learn_image if LEARN_IMAGE_UPLOAD else None,
+    max_sessions=LEARN_SESSION_MAX,
+    ttl=LEARN_SESSION_TTL,
+    token_budget=LEARN_SESSION_TOKEN_BUDGET,
+    keep_turns=LEARN_SESSION_KEEP_TURNS,
+    max_images=LEARN_SESSION_MAX_IMAGES
+)
+
+
+def read_learn_request():
+    # Returns (turn, error_response) for both LearnBot routes. Accepts JSON
+    # {"text", "image": base64 data URL, "session_id", "image_hash"} or multipart
+    # with the same fields and an "image" file.
+    request.max_content_length = LEARN_MAX_BODY_BYTES
+    upload = request.files.get("image")
+    if upload or request.form:
+        fields = request.form
+        load_image = (lambda: learn_images.from_stream(upload.stream.read)) if upload else None
+    else:
+        fields = request.get_json()
+        image_base64 = fields.get("image", "")
+        load_image = (lambda: learn_images.from_base64(image_base64)) if image_base64 else None
 
+    image = None
+    if load_image:
         try:
-            image = client.text_to_image(PromptImage.text)
-            image.save(f"{images_folder}/Image{i + 1}.png")
+            with span("learn.image_ingest") as s:
+                image = load_image()
+                s.bytes(written=len(image["data"]))
+        except ImageTooLarge as e:
+            print("Rejected image:", e)
+            return None, (jsonify({"error": str(e)}), 413)
         except Exception as e:
-            print(f"❌ Error generating Image{i+1}: {e}")
+            print("Error decoding or verifying image:", e)
+            return None, (jsonify({"error": "Invalid image data"}), 400)
 
-    # --- Step 3: Use the Stable Diffusion XL model via the new endpoint ---
+    turn, error = start_learn_turn(
+        fields.get("session_id"), fields.get("text", ""), image, fields.get("image_hash")
+    )
+    if error is not None:
+        return None, (jsonify({"error": error}), 400)
+    return turn, None
+
+
+def start_learn_turn(session_id, input_text, image=None, image_hash=None):
+    # Returns (turn, error): the session's id, the message and the contents to send to Gemini
+    if not input_text and image is None and not image_hash:
+        return None, "No valid input provided"
+
+    session_id = learn_sessions.open(session_id)
+    if image is not None:
+        image_hash = learn_sessions.add_image(session_id, image)
+    elif image_hash:
+        image = learn_sessions.image(session_id, image_hash)
+        if image is None:
+            return None, "Unknown image_hash; send the image again"
+
+    with span("learn.history") as s:
+        summary, exchanges = learn_sessions.history(session_id)
+        s.set(exchanges=len(exchanges), summarized=bool(summary))
+    contents = build_learn_history(summary, exchanges)
+    current = build_learn_contents(input_text, image)
+    parts = current if isinstance(current, list) else [current]
+    if summary:
+        parts = [f"Earlier in this conversation: {summary}", *parts]
+    contents.append({"role": "user", "parts": parts})
+
+    turn = {"session_id": session_id, "text": input_text, "image_hash": image_hash if image is not None else None}
+    return {**turn, "contents": contents}, None
+
+
+def build_learn_history(summary, exchanges):
+    contents = []
+    for exchange in exchanges:
+        parts = [exchange["text"]] if exchange["text"] else []
+        if exchange["image"] is not None:
+            parts.append(exchange["image"])
+        contents.append({"role": "user", "parts": parts or ["(empty message)"]})
+        contents.append({"role": "model", "parts": [exchange["reply"]]})
+    return contents
+
+
+def finish_learn_turn(turn, reply):
+    # Adds the exchange to the session; the ids go back to the client for its next message
+    if reply:
+        learn_sessions.record(turn["session_id"], turn["text"], turn["image_hash"], reply)
+    return {"session_id": turn["session_id"], "image_hash": turn["image_hash"]}
+
+
+def build_learn_contents(input_text, image=None):
+    if image and input_text:
+        prompt = f"You are an Ai Agent; correct user's mistakes if wrong, respond kindly: {input_text}"
+        return [prompt, image]
+    elif image:
+        prompt = "You are an Ai Agent; correct user's text in the image if wrong, respond kindly."
+        return [prompt, image]
+    elif input_text:
+        return f"You are an Ai Agent; correct user's text if wrong, respond kindly: {input_text}"
+    return None
+
+
+# ============ STREAMING (SERVER-SENT EVENTS) ============
+
+def sse_event(data, event=None):
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    return message
+
+
+def stream_generation(contents, on_complete=None, stage="stream", target=None):
+    # Forward each chunk as soon as Gemini produces it; the final "done"
+    # event carries the complete text (plus anything on_complete adds).
+    chunks = []
     try:
-        client_1 = InferenceClient(
-            "stabilityai/stable-diffusion-xl-base-1.0",
-            token=""
-        )
+        for chunk in gemini_stream(contents, stage=stage, target=target):
+            if not chunk.parts:
+                continue
+            chunks.append(chunk.text)
+            yield sse_event({"delta": chunk.text})
+
+        text = "".join(chunks)
+        extra = on_complete(text) if on_complete else {}
+        yield sse_event({"response": text, **extra}, event="done")
+    except Exception as e:
+        print("Error streaming response:", e)
+        yield sse_event({"error": "Failed to generate response"}, event="error")
+
+
+def cache_requested(input_data):
+    # Clients opt out with {"cache": false} or a "Cache-Control: no-cache" header
+    if "no-cache" in request.headers.get("Cache-Control", ""):
+        return False
+    return input_data.get("cache", True) is not False
+
+
+def sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ============ AI SUGGESTIONS (PRE-GENERATED POOL) ============
+
+# Suggestions are served from memory and regenerated in the background every
+# SUGGESTION_REFRESH_INTERVAL seconds. The all-ages pool plus any bands listed
+# in SUGGESTION_PREWARM_BANDS (e.g. "under-7,7-12") are filled at startup;
+# other age bands are filled on first request.
+SUGGESTION_POOL_SIZE = int(os.environ.get("SUGGESTION_POOL_SIZE", "4"))
+SUGGESTION_REFRESH_INTERVAL = float(os.environ.get("SUGGESTION_REFRESH_INTERVAL", "3600"))
+SUGGESTION_PREWARM_BANDS = [
+    band for band in os.environ.get("SUGGESTION_PREWARM_BANDS", "").split(",") if band in AGE_BAND_PHRASES
+]
+
+
+def generate_suggestions(band=None):
+    text = """
+    Language Development: Language Development suggestion,
+    Physical Development: Physical Development suggestion,
+    Cognitive Skills: Cognitive Skills suggestion,
+    Communication Skills: Communication Skills suggestion,
+    """
+    audience = f" who is {AGE_BAND_PHRASES[band]}" if band else ""
 
-        PromptImage = model.generate_content(
-            f"Generate a scenario-based very short prompt to generate an image based on the following context: {ParaList[3]}"
+    def generate():
+        return llm_router.generate(
+            "suggestions",
+            f"Give 4 brief suggestions for parents on how to support the development of their child{audience}: {text}",
+            temperature=1.0
         )
-        print(f"🖼️ Final Prompt: {PromptImage.text}")
 
-        image = client_1.text_to_image(PromptImage.text)
-        image.save(f"{public_folder}/Image4.png")
+    return generation_flights.do(("suggestions", band), generate)
+
+
+SUGGESTION_PREWARM = os.environ.get("SUGGESTION_PREWARM", "1") == "1"
+
+# Filled by warmup (see below) rather than at import time
+suggestion_pool = SuggestionPool(generate_suggestions, size=SUGGESTION_POOL_SIZE, max_age=SUGGESTION_REFRESH_INTERVAL)
+
+
+# ============ VIDEO ANALYSIS ============
+
+# Recordings are streamed into a per-request temp file VIDEO_CHUNK_SIZE bytes
+# at a time and capped at VIDEO_MAX_BYTES. Uploads to Gemini are deduplicated
+# by content hash for as long as Gemini keeps the file (48 hours), and the
+# processing state is polled with exponential backoff.
+VIDEO_MAX_BYTES = int(os.environ.get("VIDEO_MAX_BYTES", str(200 * 1024 * 1024)))
+# The largest body any route accepts; LearnBot lowers it per request
+app.config["MAX_CONTENT_LENGTH"] = max(VIDEO_MAX_BYTES, LEARN_MAX_BODY_BYTES) + 64 * 1024
+VIDEO_CHUNK_SIZE = 64 * 1024
+VIDEO_POLL_INITIAL = float(os.environ.get("VIDEO_POLL_INITIAL", "0.5"))
+VIDEO_POLL_MAX = float(os.environ.get("VIDEO_POLL_MAX", "8"))
+VIDEO_UPLOAD_TTL = 46 * 3600
+VIDEO_PROMPT = "Pretend like you're talking to the person in the video"
+# Recordings are shrunk locally before upload: off, high, balanced, small or keyframes
+VIDEO_PROFILE = os.environ.get("VIDEO_PROFILE", "balanced")
+VIDEO_PREPROCESS_WORKERS = int(os.environ.get("VIDEO_PREPROCESS_WORKERS", "2"))
+VIDEO_TRIM_SILENCE = os.environ.get("VIDEO_TRIM_SILENCE", "1") == "1"
+
+video_model = Lazy("gemini-video", lambda: genai_module.get().GenerativeModel(model_name="models/gemini-2.5-flash"))
+# genai.upload_file sends every upload through one shared httplib2 connection,
+# which is not thread-safe (concurrent uploads hang), so uploads take turns
+file_upload_lock = threading.Lock()
+video_preprocessor = VideoPreprocessor(VIDEO_PROFILE, VIDEO_PREPROCESS_WORKERS, VIDEO_TRIM_SILENCE)
+uploaded_videos = OrderedDict()
+uploaded_videos_lock = threading.Lock()
+
+
+class VideoSpool:
+    """Writes an incoming recording to a temp file chunk by chunk, hashing it on the way."""
+
+    def __init__(self, suffix=".webm"):
+        fd, self.path = tempfile.mkstemp(prefix="video-", suffix=suffix)
+        self.file = os.fdopen(fd, "wb")
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > VIDEO_MAX_BYTES:
+            raise ValueError(f"Video is larger than {VIDEO_MAX_BYTES} bytes")
+        self.hash.update(chunk)
+        self.file.write(chunk)
 
+    def close(self):
+        self.file.close()
+        return self.hash.hexdigest()
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def find_uploaded_video(digest):
+    # Returns the Gemini file for an earlier upload of the same bytes, if it is still usable
+    with uploaded_videos_lock:
+        entry = uploaded_videos.get(digest)
+    if entry is None or time.time() - entry[1] > VIDEO_UPLOAD_TTL:
+        return None
+
+    try:
+        video_file = gemini_upstream.call(lambda remaining: genai_module.get().get_file(entry[0]))
     except Exception as e:
-        print(f"❌ Error generating final image: {e}")
+        print(f"Cached upload {entry[0]} is gone: {e}")
+        video_file = None
+
+    if video_file is None or video_file.state.name == "FAILED":
+        with uploaded_videos_lock:
+            uploaded_videos.pop(digest, None)
+        return None
+    return video_file
+
+
+def remember_uploaded_video(digest, file_name):
+    with uploaded_videos_lock:
+        uploaded_videos[digest] = (file_name, time.time())
+        uploaded_videos.move_to_end(digest)
+        while len(uploaded_videos) > 256:
+            uploaded_videos.popitem(last=False)
+
+
+def wait_for_file(gemini_file, stage="video"):
+    delay = VIDEO_POLL_INITIAL
+    with span(f"{stage}.processing_wait") as s:
+        polls = 0
+        while gemini_file.state.name == "PROCESSING":
+            time.sleep(delay)
+            delay = min(delay * 2, VIDEO_POLL_MAX)
+            gemini_file = gemini_upstream.call(lambda remaining: genai_module.get().get_file(gemini_file.name))
+            polls += 1
+        s.set(polls=polls)
+
+    if gemini_file.state.name == "FAILED":
+        raise ValueError(gemini_file.state.name)
+    return gemini_file
+
+
+def upload_file(path, mime_type=None, display_name=None):
+    # path may also be a file object (an in-memory image), which needs its mime_type
+    genai = genai_module.get()
+    with file_upload_lock:
+        return genai.upload_file(path, mime_type=mime_type, display_name=display_name)
+
+
+def preprocess_and_upload(path, mime_type=None):
+    # Returns (Gemini file, report) after shrinking the recording with the configured profile
+    with span("video.preprocess", profile=VIDEO_PROFILE) as s:
+        upload_path, report = video_preprocessor.run(path)
+        s.bytes(read=report["original_bytes"], written=report["uploaded_bytes"])
+    if upload_path != path:
+        mime_type = "video/mp4"
+
+    started = time.monotonic()
+    try:
+        with span("gemini.upload") as s:
+            video_file = gemini_upstream.call(
+                lambda remaining: upload_file(upload_path, mime_type), timeout=600
+            )
+            s.bytes(written=report["uploaded_bytes"])
+    finally:
+        if upload_path != path:
+            os.remove(upload_path)
+    elapsed = time.monotonic() - started
+    video_preprocessor.record_upload(report["uploaded_bytes"], elapsed)
+    report["upload_seconds"] = round(elapsed, 2)
+
+    print(f"Completed upload: {video_file.uri} ({report['bytes_saved']} bytes saved by {report['profile']} profile)")
+    return video_file, report
+
+
+def upload_video(path, digest, mime_type=None):
+    # Returns (processed Gemini file, report); the report is {"reused_upload": True} for a known recording
+    key = f"{VIDEO_PROFILE}:{digest}"
+
+    def upload():
+        video_file = find_uploaded_video(key)
+        if video_file is not None:
+            print(f"Reusing upload {video_file.name} for identical video")
+            report = {"reused_upload": True}
+        else:
+            video_file, report = preprocess_and_upload(path, mime_type)
+            remember_uploaded_video(key, video_file.name)
+        return wait_for_file(video_file), report
+
+    # Concurrent requests with the same recording share one upload
+    return generation_flights.do(("video", key), upload)
+
+
+def analyze_video(path, digest, mime_type=None):
+    # Returns (reply text, pre-processing report)
+    video_file, report = upload_video(path, digest, mime_type)
+    print(f'Video processing complete: {video_file.uri}')
+
+    with span("gemini.video", model=MODEL_NAME) as s:
+        response = gemini_upstream.call(
+            lambda remaining: video_model.get().generate_content([VIDEO_PROMPT, video_file], request_options={"timeout": remaining}),
+            timeout=600
+        )
+        record_usage(s, response)
+    return response.text, report
+
+
+def video_upload_type(mime_type):
+    # Returns (mime type, file suffix) for an uploaded recording; browsers record WebM
+    if not mime_type or not mime_type.startswith("video/"):
+        mime_type = "video/webm"
+    return mime_type, mimetypes.guess_extension(mime_type) or ".webm"
+
 
+# ============ WARMUP AND READINESS ============
 
-    print("✅ All images generated successfully and saved in /public.")
+# Each replica warms up in a background thread at startup (WARMUP_ON_START=0
+# leaves it to POST /warmup) and answers /readyz with 200 once Gemini has
+# responded; until then it is 503, so a load balancer only sends traffic to
+# warm replicas. A failed warmup is retried every WARMUP_RETRY_INTERVAL seconds.
+WARMUP_ON_START = os.environ.get("WARMUP_ON_START", "1") == "1"
+WARMUP_RETRY_INTERVAL = float(os.environ.get("WARMUP_RETRY_INTERVAL", "10"))
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", "15"))
+
+warmup = Warmup(retry_interval=WARMUP_RETRY_INTERVAL)
+suggestions_started = threading.Event()
+
+
+@warmup.check("gemini")
+def warm_gemini():
+    # count_tokens is free: it builds the clients, opens a pooled connection and checks the API key
+    video_model.get()
+    gemini_upstream.call(
+        lambda remaining: model.get().count_tokens("warmup", request_options={"timeout": remaining}),
+        timeout=WARMUP_TIMEOUT
+    )
+
+
+@warmup.check("models", required=False)
+def warm_models():
+    # Builds every age band's model handle (and its context cache, if enabled) ahead of the first story
+    model_registry.warm()
+
+
+@warmup.check("huggingface", required=False)
+def warm_huggingface():
+    hf_client.get()
+    # A URL endpoint gets a connection opened in the shared pool; any HTTP answer will do
+    if HF_INFERENCE_URL.startswith(("http://", "https://")):
+        hf_session.get().head(HF_INFERENCE_URL, timeout=WARMUP_TIMEOUT)
+
+
+@warmup.check("local_llm", required=False)
+def warm_local_llm():
+    # Ollama lists its models on /api/tags; this opens a pooled connection and checks the server is up
+    if LOCAL_LLM_URL:
+        response = hf_session.get().get(f"{LOCAL_LLM_URL.rstrip('/')}/api/tags", timeout=WARMUP_TIMEOUT)
+        response.raise_for_status()
+
+
+@warmup.check("ffmpeg", required=False)
+def warm_ffmpeg():
+    if VIDEO_PROFILE != "off" and find_ffmpeg() is None:
+        raise RuntimeError("ffmpeg not found; videos are uploaded unprocessed")
+
+
+@warmup.check("suggestions", required=False)
+def warm_suggestions():
+    if SUGGESTION_PREWARM and not suggestions_started.is_set():
+        suggestions_started.set()
+        suggestion_pool.start([None] + SUGGESTION_PREWARM_BANDS, SUGGESTION_REFRESH_INTERVAL)
+
+
+if WARMUP_ON_START:
+    warmup.start()
 
 
 # ============ FLASK ROUTES ============
@@ -291,8 +1673,63 @@ def story_teller_route():
     input_data = request.get_json()
     input_text = input_data.get("text", "")
     age = input_data.get("age", 10)
-    response = storyTeller(input_text, age)
-    return jsonify({"response": response})
+
+    use_cache = cache_requested(input_data)
+
+    # Job mode: return the story right away and render illustrations in the background
+    if input_data.get("async"):
+        response = generate_story(input_text, age, use_cache)
+        prefetch_quiz(response, age)
+        job_id = start_story_job(response)
+        return jsonify({"response": response, "story_id": story_id(response), "job_id": job_id})
+
+    response, images = storyTeller(input_text, age, use_cache)
+    return jsonify({"response": response, "story_id": story_id(response), **image_urls(images)})
+
+
+@app.route("/StoryTeller/stream", methods=["POST"])
+def story_teller_stream_route():
+    input_data = request.get_json()
+    input_text = input_data.get("text", "")
+    age = input_data.get("age", 10)
+    key = story_cache_key(input_text, age)
+
+    cached = response_cache.get(key) if cache_requested(input_data) else None
+    if cached:
+        prefetch_quiz(cached, age)
+        job_id = start_story_job(cached)
+        return sse_response(iter([
+            sse_event({"delta": cached}),
+            sse_event({"response": cached, "story_id": save_story(input_text, cached, age), "job_id": job_id}, event="done")
+        ]))
+
+    def finish_story(story):
+        if story:
+            response_cache.set(key, story)
+            prefetch_quiz(story, age)
+        return {"story_id": save_story(input_text, story, age), "job_id": start_story_job(story)}
+
+    return sse_response(stream_generation(
+        build_story_prompt(input_text), on_complete=finish_story, stage="story", target=story_model(age)
+    ))
+
+
+@app.route("/StoryTeller/jobs/<job_id>", methods=["GET"])
+def story_job_status_route(job_id):
+    job = get_story_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown story job"}), 404
+    return jsonify(job)
+
+
+@app.route("/images/<name>", methods=["GET"])
+def image_route(name):
+    # Keys are content hashes, so a URL never changes meaning and can be cached forever
+    if not IMAGE_NAME.match(name):
+        abort(404)
+    response = send_from_directory(os.path.abspath(IMAGE_STORE_DIR), name, max_age=31536000)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
 
 
 @app.route("/QuizBot", methods=["POST"])
@@ -300,98 +1737,228 @@ def quiz_bot_route():
     input_data = request.get_json()
     input_text = input_data.get("text", "")
     age = input_data.get("age", 10)
-    response = quizBot(input_text, age)
+    use_cache = cache_requested(input_data)
+
+    # Streaming mode: one NDJSON line per question, sent as soon as it is complete
+    if input_data.get("stream"):
+        key = quiz_cache_key(input_text, age)
+        cached = (
+            claim_prefetched_quiz(input_text, age, use_cache, wait=False)
+            or (response_cache.get(key) if use_cache else None)
+        )
+
+        def questions():
+            if cached:
+                for question in cached:
+                    yield json.dumps(question) + "\n"
+                return
+
+            quiz_data = []
+            try:
+                for question in stream_quiz(input_text, age):
+                    quiz_data.append(question)
+                    yield json.dumps(question) + "\n"
+            except Exception as e:
+                print("Error streaming quiz:", e)
+                yield json.dumps({"error": "Failed to generate quiz"}) + "\n"
+                return
+
+            if quiz_data:
+                response_cache.set(key, quiz_data)
+                save_quiz(input_text, quiz_data, age)
+
+        return Response(stream_with_context(questions()), mimetype="application/x-ndjson")
+
+    response = claim_prefetched_quiz(input_text, age, use_cache) or quizBot(input_text, age, use_cache)
     return jsonify({"response": response})
 
 
-@app.route("/LearnBot", methods=["POST"])
-def learnBot():
+@app.route("/QuizBot/batch", methods=["POST"])
+def quiz_batch_route():
     input_data = request.get_json()
-    input_text = input_data.get("text", "")
-    image_base64 = input_data.get("image", "")
+    items, error = read_quiz_batch(input_data)
+    if error:
+        return jsonify({"error": error}), 400
+    return Response(
+        stream_with_context(run_quiz_batch(items, cache_requested(input_data))), mimetype="application/x-ndjson"
+    )
 
-    image = None
-    if image_base64:
-        try:
-            if image_base64.startswith("data:image"):
-                image_base64 = image_base64.split(",")[1]
-            image_data = base64.b64decode(image_base64)
-            image = Image.open(BytesIO(image_data))
-        except Exception as e:
-            print("Error decoding or verifying image:", e)
-            return jsonify({"error": "Invalid image data"}), 400
 
-    try:
-        if image and input_text:
-            prompt = f"You are an Ai Agent; correct user's mistakes if wrong, respond kindly: {input_text}"
-            response = model.generate_content([prompt, image])
-        elif image:
-            prompt = "You are an Ai Agent; correct user's text in the image if wrong, respond kindly."
-            response = model.generate_content([prompt, image])
-        elif input_text:
-            prompt = f"You are an Ai Agent; correct user's text if wrong, respond kindly: {input_text}"
-            response = model.generate_content(prompt)
-        else:
-            return jsonify({"error": "No valid input provided"}), 400
+@app.route("/stories", methods=["GET"])
+def stories_route():
+    limit, offset, error = read_page_args(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    stories, total = story_library.list(limit, offset, request.args.get("age_band") or None)
+    return jsonify({"stories": [library_summary(story) for story in stories], "total": total})
+
+
+@app.route("/stories/search", methods=["GET"])
+def stories_search_route():
+    limit, _, error = read_page_args(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    stories = story_library.search(request.args.get("q", ""), limit)
+    return jsonify({"stories": [library_summary(story) for story in stories]})
+
+
+@app.route("/stories/<story_key>", methods=["GET"])
+def story_route(story_key):
+    story = story_library.get(story_key)
+    if story is None:
+        return jsonify({"error": "Unknown story"}), 404
+    images = story.pop("images")
+    return jsonify({**story, **image_urls(images)})
+
+
+@app.route("/CacheStats", methods=["GET"])
+def cache_stats_route():
+    return jsonify({
+        **response_cache.stats(),
+        "flights": generation_flights.stats(),
+        "suggestions": suggestion_pool.stats(),
+        "learn_images": learn_images.stats(),
+        "image_store": image_store.stats(),
+        "quiz_prefetch": quiz_prefetcher.stats(),
+        "story_library": story_library.stats(),
+        "learn_sessions": learn_sessions.stats(),
+        "compaction": compactor.stats()
+    })
+
+
+@app.route("/UpstreamStats", methods=["GET"])
+def upstream_stats_route():
+    return jsonify({
+        **{name: backend.stats() for name, backend in upstream_backends().items()},
+        "router": llm_router.stats(),
+        "models": model_registry.stats(),
+        "video_preprocess": video_preprocessor.stats()
+    })
+
+
+@REGISTRY.collector
+def component_metrics():
+    upstreams = {name: backend.stats() for name, backend in upstream_backends().items()}
+    components = {
+        "response_cache": response_cache.stats(),
+        "flights": generation_flights.stats(),
+        "suggestions": suggestion_pool.stats(),
+        "learn_images": learn_images.stats(),
+        "image_store": image_store.stats(),
+        "quiz_prefetch": quiz_prefetcher.stats(),
+        "story_library": story_library.stats(),
+        "learn_sessions": learn_sessions.stats(),
+        "compaction": compactor.stats(),
+        "llm_router": llm_router.stats(),
+        "models": model_registry.stats(),
+        "video_preprocess": video_preprocessor.stats(),
+        **{f"upstream_{name}": stats for name, stats in upstreams.items()},
+    }
+    circuits = [({"backend": name}, int(stats["circuit"] == "open")) for name, stats in upstreams.items()]
+    return [
+        ("app_component_stat", "gauge", "Counters and sizes also reported by /CacheStats and /UpstreamStats.",
+         stats_samples(components)),
+        ("app_upstream_circuit_open", "gauge", "1 while a backend's circuit breaker is open.", circuits),
+    ]
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz_route():
+    # Liveness: the process is up and serving; says nothing about the backends
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz_route():
+    return jsonify(warmup.report()), 200 if warmup.ready else 503
+
+
+@app.route("/warmup", methods=["POST"])
+def warmup_route():
+    report = warmup.run()
+    return jsonify(report), 200 if report["state"] == "ready" else 503
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_route():
+    return Response(telemetry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.route("/LearnBot", methods=["POST"])
+def learnBot():
+    turn, error = read_learn_request()
+    if error is not None:
+        return error
 
-        return jsonify({"response": response.text})
+    try:
+        response = gemini_generate(turn["contents"], stage="learn")
+        return jsonify({"response": response.text, **finish_learn_turn(turn, response.text)})
+    except UpstreamError:
+        raise
     except Exception as e:
         print("Error generating response:", e)
         return jsonify({"error": "Failed to generate response"}), 500
 
 
-@app.route("/AiSuggestionBot", methods=["GET"])
-def aiSuggestionBot():
-    text = """
-    Language Development: Language Development suggestion,
-    Physical Development: Physical Development suggestion,
-    Cognitive Skills: Cognitive Skills suggestion,
-    Communication Skills: Communication Skills suggestion,
-    """
-    response = model.generate_content(
-        f"Give 4 brief suggestions for parents on how to improve their child's development: {text}"
-    )
-    return jsonify({"response": response.text})
-
-
-def get_downloads_folder():
-    home = os.path.expanduser("~")
-    downloads_folder = os.path.join(home, "Downloads")
-    return downloads_folder
+@app.route("/LearnBot/stream", methods=["POST"])
+def learn_bot_stream_route():
+    turn, error = read_learn_request()
+    if error is not None:
+        return error
 
+    return sse_response(
+        stream_generation(turn["contents"], on_complete=lambda text: finish_learn_turn(turn, text), stage="learn")
+    )
 
-@app.route("/VideoAnalyzer", methods=["GET"])
-def videoAnalyzer():
-    downloads_path = get_downloads_folder()
-    file_name = "Video.mp4"
-    video_file_name = os.path.join(downloads_path, file_name)
-
-    print(f"Checking for file {file_name} in Downloads folder...")
-    while not os.path.exists(video_file_name):
-        print(f"Waiting for {file_name} to be available...")
-        time.sleep(5)
 
-    print(f"File {file_name} found. Uploading...")
-    video_file = genai.upload_file(path=video_file_name)
-    print(f"Completed upload: {video_file.uri}")
+@app.route("/AiSuggestionBot", methods=["GET"])
+def aiSuggestionBot():
+    age = request.args.get("age")
+    try:
+        band = get_age_band(age) if age else None
+    except ValueError:
+        return jsonify({"error": "Invalid age"}), 400
 
-    while video_file.state.name == "PROCESSING":
-        print('Waiting for video to be processed.')
-        time.sleep(10)
-        video_file = genai.get_file(video_file.name)
+    try:
+        return jsonify({"response": suggestion_pool.get(band)})
+    except Exception as e:
+        print("Error generating suggestions:", e)
+        return jsonify({"error": "Failed to generate suggestions"}), 500
 
-    if video_file.state.name == "FAILED":
-        raise ValueError(video_file.state.name)
 
-    print(f'Video processing complete: {video_file.uri}')
-    prompt = "Pretend like you're talking to the person in the video"
-    model = genai.GenerativeModel(model_name="models/gemini-2.5-flash")
+@app.route("/VideoAnalyzer", methods=["POST"])
+def video_analyzer_upload_route():
+    # The recording arrives as multipart ("video" field) or as the raw request body
+    upload = request.files.get("video")
+    if upload:
+        read_chunk, mime_type = upload.stream.read, upload.mimetype
+    else:
+        read_chunk, mime_type = request.stream.read, request.mimetype
+    mime_type, suffix = video_upload_type(mime_type)
 
-    response = model.generate_content([prompt, video_file], request_options={"timeout": 600})
-    print(response.text)
-    os.remove(video_file_name)
+    spool = VideoSpool(suffix)
+    try:
+        with span("video.receive") as s:
+            for chunk in iter(lambda: read_chunk(VIDEO_CHUNK_SIZE), b""):
+                spool.write(chunk)
+            s.bytes(written=spool.size)
+    except (ValueError, RequestEntityTooLarge) as e:
+        spool.discard()
+        return jsonify({"error": str(e)}), 413
+    digest = spool.close()
 
-    return jsonify({"response": response.text})
+    try:
+        if spool.size == 0:
+            return jsonify({"error": "No video provided"}), 400
+        response, report = analyze_video(spool.path, digest, mime_type)
+        return jsonify({"response": response, "video": report})
+    except UpstreamError:
+        raise
+    except Exception as e:
+        print("Error analyzing video:", e)
+        return jsonify({"error": "Failed to analyze video"}), 500
+    finally:
+        spool.discard()
 
 
 if __name__ == "__main__":
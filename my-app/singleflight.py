@@ -0,0 +1,85 @@
+"""Request coalescing for identical in-flight upstream calls.
+
+When several requests ask for the same thing at the same time (a class
+submitting the same story seed, a client retrying quickly), only the first
+one calls Gemini / SDXL. The others wait for it and share its result, or
+its exception. AsyncSingleFlight is the same idea for coroutines on one
+event loop. There the shared work runs as its own task, so it finishes for
+the remaining callers even if the one that started it is cancelled.
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.counters = {"calls": 0, "coalesced": 0}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.counters["calls"] += 1
+            else:
+                self.counters["coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "in_flight": len(self.calls)}
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self.calls = {}
+        self.counters = {"calls": 0, "coalesced": 0}
+
+    async def do(self, key, fn):
+        # The work runs as a task of its own, so a caller that is cancelled (its client
+        # went away) stops waiting without cancelling it for everyone else
+        task = self.calls.get(key)
+        if task is not None:
+            self.counters["coalesced"] += 1
+        else:
+            self.counters["calls"] += 1
+            task = self.calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {**self.counters, "in_flight": len(self.calls)}
+
+    def _finish(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            # Marks the exception retrieved, so a failure nobody waited for is not logged as unhandled
+            task.exception()
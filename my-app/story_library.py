@@ -0,0 +1,201 @@
+"""Persistent library of generated stories.
+
+Every story is recorded in SQLite together with the prompt it came from, its
+age band, the quizzes generated for it (one per age band) and the image
+store keys of its illustrations. A story can then be listed, reopened or
+searched without asking Gemini or SDXL again. The pictures themselves stay
+in the image store.
+
+A story's id is a hash of its normalized text, so recording the same story
+twice (a cache hit, a retried job) updates one row. Full-text search uses an
+FTS5 index over prompt and story when SQLite was built with FTS5, and a LIKE
+scan otherwise.
+
+Each thread has its own connection, and the database runs in WAL mode so
+reads never wait on a write.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from response_cache import normalize_text
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stories (
+    id TEXT PRIMARY KEY,
+    prompt TEXT NOT NULL,
+    age_band TEXT NOT NULL,
+    story TEXT NOT NULL,
+    quizzes TEXT NOT NULL DEFAULT '{}',
+    images TEXT NOT NULL DEFAULT '{}',
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stories_created ON stories (created);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts USING fts5(prompt, story, content='stories', content_rowid='rowid');
+CREATE TRIGGER IF NOT EXISTS stories_fts_insert AFTER INSERT ON stories BEGIN
+    INSERT INTO stories_fts (rowid, prompt, story) VALUES (new.rowid, new.prompt, new.story);
+END;
+CREATE TRIGGER IF NOT EXISTS stories_fts_delete AFTER DELETE ON stories BEGIN
+    INSERT INTO stories_fts (stories_fts, rowid, prompt, story) VALUES ('delete', old.rowid, old.prompt, old.story);
+END;
+"""
+
+SUMMARY_COLUMNS = "id, prompt, age_band, substr(story, 1, 200) AS preview, quizzes, images, created"
+
+
+def story_id(story):
+    return hashlib.sha256(normalize_text(story).encode("utf-8")).hexdigest()[:32]
+
+
+class StoryLibrary:
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.counters = {"stories_saved": 0, "quizzes_saved": 0, "images_saved": 0, "reads": 0, "searches": 0}
+
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(SCHEMA)
+        try:
+            db.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+
+    def record_story(self, prompt, story, age_band):
+        """Saves a story (or refreshes an existing one) and returns its id."""
+        key = story_id(story)
+        now = time.time()
+        with self._transaction() as db:
+            db.execute(
+                "INSERT INTO stories (id, prompt, age_band, story, created, updated) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET updated = excluded.updated",
+                (key, prompt, age_band, story, now, now)
+            )
+        self._count("stories_saved")
+        return key
+
+    def record_quiz(self, story, age_band, quiz):
+        # Quizzes for text that is not a library story (pasted by hand) are not kept
+        return self._merge(story, "quizzes", {age_band: quiz}, "quizzes_saved")
+
+    def record_images(self, story, images):
+        return self._merge(story, "images", {str(number): key for number, key in images.items()}, "images_saved")
+
+    def get(self, key):
+        row = self._db().execute("SELECT * FROM stories WHERE id = ?", (key,)).fetchone()
+        self._count("reads")
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "prompt": row["prompt"],
+            "age_band": row["age_band"],
+            "story": row["story"],
+            "quizzes": json.loads(row["quizzes"]),
+            "images": self._images(row["images"]),
+            "created": row["created"],
+        }
+
+    def list(self, limit=20, offset=0, age_band=None):
+        where, params = ("WHERE age_band = ?", [age_band]) if age_band else ("", [])
+        db = self._db()
+        total = db.execute(f"SELECT count(*) FROM stories {where}", params).fetchone()[0]
+        rows = db.execute(
+            f"SELECT {SUMMARY_COLUMNS} FROM stories {where} ORDER BY created DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        ).fetchall()
+        self._count("reads")
+        return [self._summary(row) for row in rows], total
+
+    def search(self, query, limit=20):
+        terms = re.findall(r"\w+", query)
+        if not terms:
+            return []
+        self._count("searches")
+        db = self._db()
+        if self.fts:
+            # Every term must match; the last one may be a prefix, for search-as-you-type
+            match = " ".join(f'"{term}"' for term in terms) + "*"
+            rows = db.execute(
+                "SELECT s.id, s.prompt, s.age_band, snippet(stories_fts, 1, '[', ']', '…', 16) AS preview, "
+                "s.quizzes, s.images, s.created "
+                "FROM stories_fts JOIN stories s ON s.rowid = stories_fts.rowid "
+                "WHERE stories_fts MATCH ? ORDER BY rank LIMIT ?",
+                (match, limit)
+            ).fetchall()
+        else:
+            conditions = " AND ".join("(prompt LIKE ? OR story LIKE ?)" for _ in terms)
+            params = [pattern for term in terms for pattern in (f"%{term}%", f"%{term}%")]
+            rows = db.execute(
+                f"SELECT {SUMMARY_COLUMNS} FROM stories WHERE {conditions} ORDER BY created DESC LIMIT ?",
+                params + [limit]
+            ).fetchall()
+        return [self._summary(row) for row in rows]
+
+    def stats(self):
+        count = self._db().execute("SELECT count(*) FROM stories").fetchone()[0]
+        with self.lock:
+            return {**self.counters, "stories": count, "fts": self.fts}
+
+    def _merge(self, story, column, values, counter):
+        # Read-modify-write under an immediate transaction so concurrent merges are not lost
+        key = story_id(story)
+        with self._transaction() as db:
+            row = db.execute(f"SELECT {column} FROM stories WHERE id = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            merged = {**json.loads(row[0]), **values}
+            db.execute(
+                f"UPDATE stories SET {column} = ?, updated = ? WHERE id = ?", (json.dumps(merged), time.time(), key)
+            )
+        self._count(counter)
+        return key
+
+    def _summary(self, row):
+        return {
+            "id": row["id"],
+            "prompt": row["prompt"],
+            "age_band": row["age_band"],
+            "preview": row["preview"],
+            "quiz_age_bands": sorted(json.loads(row["quizzes"])),
+            "images": self._images(row["images"]),
+            "created": row["created"],
+        }
+
+    def _images(self, text):
+        return {int(number): key for number, key in json.loads(text).items()}
+
+    def _db(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
@@ -0,0 +1,95 @@
+"""Pre-generated, stale-while-revalidate pool of parent suggestions.
+
+The dashboard asks for the same kind of advice on every load, so the
+suggestions are generated ahead of time into a small rotating pool per age
+band and refreshed in the background. Requests are answered from memory;
+a stale pool is still served while its replacement is being generated.
+"""
+
+import threading
+import time
+
+
+class SuggestionPool:
+    def __init__(self, generate, size=4, max_age=3600):
+        self.generate = generate
+        self.size = size
+        self.max_age = max_age
+
+        self.pools = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.counters = {"served": 0, "stale_served": 0, "cold_misses": 0, "refreshes": 0, "refresh_errors": 0}
+
+    def get(self, band=None):
+        with self.lock:
+            pool = self.pools.get(band)
+            if pool:
+                pool["next"] += 1
+                suggestion = pool["items"][pool["next"] % len(pool["items"])]
+                stale = time.time() - pool["refreshed"] >= self.max_age
+                self.counters["served"] += 1
+                if stale:
+                    self.counters["stale_served"] += 1
+            else:
+                self.counters["cold_misses"] += 1
+
+        if not pool:
+            # Cold band: answer with one fresh suggestion and fill the rest in the background
+            suggestion = self.generate(band)
+            self._store(band, [suggestion])
+            self.refresh_async(band)
+            return suggestion
+
+        if stale:
+            self.refresh_async(band)
+        return suggestion
+
+    def refresh_async(self, band=None):
+        with self.lock:
+            if band in self.refreshing:
+                return
+            self.refreshing.add(band)
+        threading.Thread(target=self._refresh, args=(band,), daemon=True, name="suggestions-refresh").start()
+
+    def start(self, bands, interval):
+        # Fill every band now, then regenerate each one on a fixed schedule
+        def loop():
+            while True:
+                for band in bands:
+                    self.refresh_async(band)
+                time.sleep(interval)
+
+        threading.Thread(target=loop, daemon=True, name="suggestions-scheduler").start()
+
+    def stats(self):
+        with self.lock:
+            return {
+                **self.counters,
+                "bands": {
+                    str(band): {"items": len(pool["items"]), "age": round(time.time() - pool["refreshed"], 1)}
+                    for band, pool in self.pools.items()
+                },
+            }
+
+    def _refresh(self, band):
+        try:
+            items = []
+            for _ in range(self.size):
+                try:
+                    items.append(self.generate(band))
+                except Exception as e:
+                    print(f"❌ Error refreshing suggestions for {band or 'all ages'}: {e}")
+                    with self.lock:
+                        self.counters["refresh_errors"] += 1
+            if items:
+                self._store(band, items)
+                with self.lock:
+                    self.counters["refreshes"] += 1
+        finally:
+            with self.lock:
+                self.refreshing.discard(band)
+
+    def _store(self, band, items):
+        with self.lock:
+            self.pools[band] = {"items": items, "refreshed": time.time(), "next": -1}
@@ -0,0 +1,255 @@
+"""Tracing spans and Prometheus metrics.
+
+span("stage") times a block of work. Spans nest through a context variable,
+so a render inside a story request knows its parent. Every finished span
+feeds the app_stage_seconds histogram (by stage and outcome). Token and byte
+counts set on a span are added to app_stage_tokens_total and
+app_stage_bytes_total. When TRACE_LOG is set, each span is also written as
+one JSON line with its trace and parent ids, to that file or to stderr for
+"-".
+
+render() produces the Prometheus text format served on /metrics. The few
+metric types needed are implemented here rather than pulling in
+prometheus_client.
+"""
+
+import contextvars
+import json
+import math
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = (
+        f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(dict(zip(self.labelnames, key)))} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.values.items()):
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    bucket_labels = format_labels({**labels, "le": format_value(bound)})
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(series['sum'])}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {series['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Register fn() -> [(name, type, help, [(labels, value), ...]), ...] for values kept elsewhere."""
+        self.collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+
+        # Collectors may add samples to the same family; each family is written once
+        families = {}
+        for fn in self.collectors:
+            try:
+                collected = fn()
+            except Exception as e:
+                print(f"❌ Error collecting metrics from {fn.__name__}: {e}")
+                continue
+            for name, kind, documentation, samples in collected:
+                families.setdefault(name, (kind, documentation, []))[2].extend(samples)
+        for name, (kind, documentation, samples) in families.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{format_labels(labels)} {format_value(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+stage_seconds = REGISTRY.histogram(
+    "app_stage_seconds", "Duration of pipeline stages and upstream calls.", ("stage", "status")
+)
+stage_tokens = REGISTRY.counter(
+    "app_stage_tokens_total", "Model tokens used per stage.", ("stage", "kind")
+)
+stage_bytes = REGISTRY.counter(
+    "app_stage_bytes_total", "Bytes read or written per stage.", ("stage", "direction")
+)
+http_seconds = REGISTRY.histogram(
+    "app_http_request_seconds", "Time spent handling an HTTP request (Flask streams: until the first byte).",
+    ("route", "method", "status")
+)
+
+# ============ SPANS ============
+
+current_span = contextvars.ContextVar("current_span", default=None)
+trace_log = None
+trace_log_lock = threading.Lock()
+
+
+def configure_trace_log(path):
+    global trace_log
+    if path == "-":
+        trace_log = sys.stderr
+    elif path:
+        trace_log = open(path, "a", buffering=1, encoding="utf-8")
+
+
+class Span:
+    def __init__(self, name, parent=None, attrs=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attrs = dict(attrs or {})
+        self.started = time.time()
+        self.start = time.monotonic()
+        self.ended = False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def tokens(self, prompt=0, output=0, cached=0):
+        # cached: the part of the prompt served from a context cache
+        self._add("prompt_tokens", prompt)
+        self._add("output_tokens", output)
+        self._add("cached_tokens", cached)
+
+    def bytes(self, read=0, written=0):
+        self._add("bytes_in", read)
+        self._add("bytes_out", written)
+
+    def _add(self, attr, amount):
+        if amount:
+            self.attrs[attr] = self.attrs.get(attr, 0) + amount
+
+    def end(self, status="ok"):
+        if self.ended:
+            return
+        self.ended = True
+        duration = time.monotonic() - self.start
+        stage_seconds.observe(duration, stage=self.name, status=status)
+        for attr, kind in (("prompt_tokens", "prompt"), ("output_tokens", "output"), ("cached_tokens", "cached")):
+            if self.attrs.get(attr):
+                stage_tokens.inc(self.attrs[attr], stage=self.name, kind=kind)
+        for attr, direction in (("bytes_in", "in"), ("bytes_out", "out")):
+            if self.attrs.get(attr):
+                stage_bytes.inc(self.attrs[attr], stage=self.name, direction=direction)
+
+        if trace_log is not None:
+            record = {
+                "trace": self.trace_id, "span": self.span_id, "parent": self.parent_id, "name": self.name,
+                "start": round(self.started, 6), "ms": round(duration * 1000, 3), "status": status, **self.attrs,
+            }
+            with trace_log_lock:
+                trace_log.write(json.dumps(record, default=str) + "\n")
+
+
+def start_span(name, **attrs):
+    """A span under the current one that is not made current itself; end() it when done (for generators)."""
+    return Span(name, current_span.get(), attrs)
+
+
+@contextmanager
+def span(name, **attrs):
+    current = start_span(name, **attrs)
+    token = current_span.set(current)
+    status = "ok"
+    try:
+        yield current
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        current_span.reset(token)
+        current.end(status)
+
+
+def stats_samples(sources):
+    """Flatten {component: stats dict} into (labels, value) samples; non-numeric entries are skipped."""
+    return [
+        ({"component": component, "stat": key}, value)
+        for component, stats in sources.items()
+        for key, value in stats.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    ]
+
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+
+# server.py reads its configuration at import time: keep it off the network and out of the working tree
+DATA_DIR = tempfile.mkdtemp(prefix="my-app-tests-")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ["WARMUP_ON_START"] = "0"
+os.environ["SUGGESTION_PREWARM"] = "0"
+os.environ["STORY_LIBRARY_DB"] = os.path.join(DATA_DIR, "story_library.sqlite3")
+os.environ["IMAGE_STORE_DIR"] = os.path.join(DATA_DIR, "image_store")
+os.environ["RESPONSE_CACHE_DIR"] = ""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeClock:
+    """Stands in for the time module; sleep() moves the clock instead of blocking."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+from llm_router import LLMRouter
+
+
+class FakeBackend:
+    def __init__(self, name, calls, text=None, error=None, release=None):
+        self.name = name
+        self.calls = calls
+        self.text = text or f"from {name}"
+        self.error = error
+        self.release = release
+
+    def generate(self, prompt, task, timeout=None, **options):
+        self.calls.append(self.name)
+        if self.release is not None:
+            self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+
+def make_router(*backends, hedge_default=None):
+    return LLMRouter(
+        {backend.name: backend for backend in backends},
+        {"large": [backend.name for backend in backends]},
+        {"story": "large"},
+        hedge_default=hedge_default,
+    )
+
+
+def test_primary_answers_without_fallback():
+    calls = []
+    router = make_router(FakeBackend("a", calls), FakeBackend("b", calls))
+    assert router.generate("story", "prompt") == "from a"
+    assert calls == ["a"]
+
+
+def test_fallback_follows_chain_order():
+    calls = []
+    router = make_router(
+        FakeBackend("a", calls, error=RuntimeError("a down")),
+        FakeBackend("b", calls, error=RuntimeError("b down")),
+        FakeBackend("c", calls),
+    )
+    assert router.generate("story", "prompt") == "from c"
+    assert calls == ["a", "b", "c"]
+    stats = router.stats()
+    assert stats["fallbacks"] == 2
+    assert stats["fallback_wins"] == 1
+
+
+def test_last_error_raised_when_every_backend_fails():
+    calls = []
+    router = make_router(
+        FakeBackend("a", calls, error=RuntimeError("a down")),
+        FakeBackend("b", calls, error=RuntimeError("b down")),
+    )
+    with pytest.raises(RuntimeError, match="b down"):
+        router.generate("story", "prompt")
+    assert router.stats()["failures"] == 1
+
+
+def test_slow_primary_is_hedged_by_next_backend():
+    calls = []
+    release = threading.Event()
+    router = make_router(
+        FakeBackend("a", calls, release=release), FakeBackend("b", calls), FakeBackend("c", calls),
+        hedge_default=0.05,
+    )
+    try:
+        assert router.generate("story", "prompt") == "from b"
+    finally:
+        release.set()
+    # Only the primary is hedged, and only by the next backend in the chain
+    assert calls == ["a", "b"]
+    stats = router.stats()
+    assert stats["hedged"] == 1
+    assert stats["hedge_wins"] == 1
+
+
+def test_no_hedge_until_latency_is_known():
+    calls = []
+    release = threading.Event()
+    router = make_router(FakeBackend("a", calls, release=release), FakeBackend("b", calls))
+    threading.Timer(0.1, release.set).start()
+    assert router.generate("story", "prompt") == "from a"
+    assert calls == ["a"]
+    assert router.stats()["hedged"] == 0
+
+
+def test_hedge_delay_is_p95_once_sampled():
+    router = make_router(FakeBackend("a", []))
+    router.min_samples = 20
+    for i in range(1, 21):
+        router.latencies.setdefault(("a", "large"), []).append(i / 10)
+    assert router.hedge_delay("a", "large") == pytest.approx(2.0)
+
+
+def test_tier_without_configured_backends_uses_first_backend():
+    calls = []
+    router = LLMRouter(
+        {"gemini": FakeBackend("gemini", calls)},
+        {"small": ["local"], "large": ["gemini"]},
+        {"quiz": "small"},
+    )
+    assert router.chain("quiz") == ["gemini"]
+    assert router.generate("quiz", "prompt") == "from gemini"
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+import server
+
+
+def question(text, answer="a"):
+    return {"question": text, "options": ["One", "Two", "Three", "Four"], "answer": answer}
+
+
+class ScriptedRouter:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.prompts = []
+
+    def generate(self, task, prompt, **options):
+        self.prompts.append(prompt)
+        response = self.responses.pop(0)
+        return response if isinstance(response, str) else json.dumps(response)
+
+
+@pytest.fixture
+def scripted(monkeypatch):
+    monkeypatch.setattr(server, "quiz_model", lambda age=10: None)
+    monkeypatch.setattr(server, "QUIZ_QUESTIONS", 3)
+
+    def install(*responses, attempts=1):
+        router = ScriptedRouter(*responses)
+        monkeypatch.setattr(server, "llm_router", router)
+        monkeypatch.setattr(server, "QUIZ_REPAIR_ATTEMPTS", attempts)
+        return router
+
+    return install
+
+
+def test_well_formed_quiz_needs_one_call(scripted):
+    router = scripted([question("Q1"), question("Q2"), question("Q3")])
+    assert [q["question"] for q in server.generate_quiz_questions("story")] == ["Q1", "Q2", "Q3"]
+    assert len(router.prompts) == 1
+
+
+def test_only_malformed_questions_are_asked_again(scripted):
+    router = scripted(
+        [question("Q1"), {"question": "Q2", "options": ["One", "Two"], "answer": "a"}, question("Q3", "z")],
+        [question("R1", "b"), question("R2", "c"), question("extra")],
+    )
+    questions = server.generate_quiz_questions("story")
+    assert [q["question"] for q in questions] == ["Q1", "R1", "R2"]
+    assert [q["correctAnswer"] for q in questions] == ["a", "b", "c"]
+
+    repair_prompt = router.prompts[1]
+    assert repair_prompt.startswith("Generate 2 multiple-choice questions")
+    assert "- Q1" in repair_prompt
+
+
+def test_repairs_stop_after_the_attempt_budget(scripted):
+    router = scripted([question("Q1")], [], [question("R2"), question("R3")], attempts=2)
+    questions = server.generate_quiz_questions("story")
+    assert [q["question"] for q in questions] == ["Q1", "R2", "R3"]
+    assert len(router.prompts) == 3
+
+
+def test_unparseable_output_is_repaired_in_full(scripted):
+    router = scripted("Sorry, here is the quiz: [{", [question("R1"), question("R2"), question("R3")])
+    assert len(server.generate_quiz_questions("story")) == 3
+    assert router.prompts[1].startswith("Generate 3 multiple-choice questions")
+
+
+def test_answer_given_as_option_text():
+    parsed = server.normalize_quiz_question({"question": "Q", "options": ["a) Red", "b) Blue", "Green", "Gold"],
+                                             "answer": "green"})
+    assert parsed["correctAnswer"] == "c"
+    assert parsed["options"] == ["a) Red", "b) Blue", "c) Green", "d) Gold"]
@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from server import QuizStreamParser
+
+QUIZ_TEXT = """Here is your quiz!
+
+**Question 1:** Who found the
+glowing map?
+a) The fox
+b) The owl
+c) The little dragon
+d) The miller
+**Correct Answer:** c
+
+Question 2 - Where did they sail?
+a) To the moon
+b) Across the lake
+c) Under the bridge
+d) Into the cave
+Correct Answer: b) Across the lake
+
+Question 3: What is missing an answer?
+a) One
+b) Two
+c) Three
+d) Four
+
+Question 4) "Why" did the owl laugh?
+a) A joke
+b) A tickle
+c) A song
+d) A dance
+Correct Answer: A song"""
+
+
+def parse(chunks):
+    parser = QuizStreamParser()
+    questions = []
+    for chunk in chunks:
+        questions += parser.feed(chunk)
+    return questions + parser.close()
+
+
+def test_whole_text():
+    questions = parse([QUIZ_TEXT])
+    assert [question["question"] for question in questions] == [
+        "Who found the glowing map?",
+        "Where did they sail?",
+        '"Why" did the owl laugh?',
+    ]
+    assert [question["correctAnswer"] for question in questions] == ["c", "b", "c"]
+    assert questions[0]["options"] == ["a) The fox", "b) The owl", "c) The little dragon", "d) The miller"]
+
+
+@pytest.mark.parametrize("split", range(len(QUIZ_TEXT) + 1))
+def test_any_single_split(split):
+    assert parse([QUIZ_TEXT[:split], QUIZ_TEXT[split:]]) == parse([QUIZ_TEXT])
+
+
+def test_one_character_at_a_time():
+    assert parse(list(QUIZ_TEXT)) == parse([QUIZ_TEXT])
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_chunks(seed):
+    rng = random.Random(seed)
+    cuts = sorted(rng.sample(range(1, len(QUIZ_TEXT)), rng.randint(2, 40)))
+    chunks = [QUIZ_TEXT[start:end] for start, end in zip([0] + cuts, cuts + [len(QUIZ_TEXT)])]
+    assert parse(chunks) == parse([QUIZ_TEXT])
+
+
+def test_questions_are_returned_as_soon_as_answered():
+    parser = QuizStreamParser()
+    first, rest = QUIZ_TEXT.split("Question 2", 1)
+    assert len(parser.feed(first)) == 1
+    assert len(parser.feed("Question 2" + rest)) == 1
+    assert len(parser.close()) == 1
@@ -0,0 +1,70 @@
+import pytest
+
+import response_cache
+from conftest import FakeClock
+from response_cache import ResponseCache, cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    return clock
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ResponseCache(ttl=60)
+    cache.set("a", 1)
+    clock.advance(59)
+    assert cache.get("a") == 1
+
+    clock.advance(1)
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_disk_tier_outlives_memory_and_expires_too(clock, tmp_path):
+    cache = ResponseCache(max_entries=1, ttl=60, disk_dir=str(tmp_path))
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert "a" not in cache.entries
+    assert cache.get("a") == 1
+    assert cache.stats()["disk_hits"] == 1
+
+    restarted = ResponseCache(ttl=60, disk_dir=str(tmp_path))
+    assert restarted.get("b") == 2
+    clock.advance(60)
+    assert ResponseCache(ttl=60, disk_dir=str(tmp_path)).get("b") is None
+
+
+def test_get_or_compute_caches_and_bypasses(clock):
+    cache = ResponseCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return f"value {len(calls)}"
+
+    assert cache.get_or_compute("k", compute) == "value 1"
+    assert cache.get_or_compute("k", compute) == "value 1"
+    assert cache.get_or_compute("k", compute, bypass=True) == "value 2"
+    assert cache.get("k") == "value 2"
+    assert len(calls) == 2
+
+
+def test_cache_key_ignores_whitespace_only():
+    assert cache_key("story", "a  dragon\n", "7-12", "m") == cache_key("story", "a dragon", "7-12", "m")
+    assert cache_key("story", "a dragon", "7-12", "m") != cache_key("story", "a dragon", "13-20", "m")
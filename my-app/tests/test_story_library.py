@@ -0,0 +1,77 @@
+import pytest
+
+from story_library import StoryLibrary, story_id
+
+DRAGON = "A little dragon named Ember learned to fly over the snowy mountains."
+LIGHTHOUSE = "The old lighthouse keeper found a message in a bottle on the beach."
+MOUNTAIN = "Two goats climbed the mountain to watch the sunrise together."
+
+
+@pytest.fixture
+def library(tmp_path):
+    library = StoryLibrary(str(tmp_path / "library.sqlite3"))
+    library.record_story("a dragon who is afraid of heights", DRAGON, "under-7")
+    library.record_story("a lighthouse story", LIGHTHOUSE, "7-12")
+    library.record_story("goats at dawn", MOUNTAIN, "7-12")
+    return library
+
+
+def ids(results):
+    return {result["id"] for result in results}
+
+
+@pytest.mark.parametrize("fts", [True, False])
+def test_search_matches_prompt_and_story(library, fts):
+    if fts and not library.fts:
+        pytest.skip("SQLite built without FTS5")
+    library.fts = fts
+    assert ids(library.search("lighthouse")) == {story_id(LIGHTHOUSE)}
+    assert ids(library.search("afraid")) == {story_id(DRAGON)}
+    assert ids(library.search("mountain")) == {story_id(DRAGON), story_id(MOUNTAIN)}
+
+
+@pytest.mark.parametrize("fts", [True, False])
+def test_every_term_must_match(library, fts):
+    if fts and not library.fts:
+        pytest.skip("SQLite built without FTS5")
+    library.fts = fts
+    assert ids(library.search("goats mountain")) == {story_id(MOUNTAIN)}
+    assert library.search("dragon lighthouse") == []
+
+
+def test_last_term_matches_as_prefix(library):
+    if not library.fts:
+        pytest.skip("SQLite built without FTS5")
+    assert ids(library.search("snowy drag")) == {story_id(DRAGON)}
+    assert library.search("dra snowy") == []
+
+
+def test_search_preview_highlights_the_match(library):
+    if not library.fts:
+        pytest.skip("SQLite built without FTS5")
+    [result] = library.search("bottle")
+    assert "[bottle]" in result["preview"]
+    assert result["age_band"] == "7-12"
+
+
+def test_query_syntax_is_not_interpreted(library):
+    assert library.search('"') == []
+    assert library.search("NOT OR AND") == []
+    assert ids(library.search('ember" OR "goats')) == set()
+
+
+def test_recording_a_story_twice_keeps_one_row(library):
+    assert library.record_story("again", "  A little dragon named Ember learned to fly over the snowy mountains. ",
+                                "under-7") == story_id(DRAGON)
+    assert library.stats()["stories"] == 3
+    assert ids(library.search("ember")) == {story_id(DRAGON)}
+
+
+def test_quizzes_and_images_are_merged(library):
+    library.record_quiz(DRAGON, "under-7", [{"question": "Q"}])
+    library.record_quiz(DRAGON, "7-12", [{"question": "R"}])
+    library.record_images(DRAGON, {1: "k1", 2: "k2"})
+    story = library.get(story_id(DRAGON))
+    assert set(story["quizzes"]) == {"under-7", "7-12"}
+    assert story["images"] == {1: "k1", 2: "k2"}
+    assert library.record_quiz("not in the library", "7-12", []) is None
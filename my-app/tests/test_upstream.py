@@ -0,0 +1,110 @@
+import pytest
+
+import upstream
+from conftest import FakeClock
+from upstream import CircuitBreaker, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(upstream, "time", clock)
+    return clock
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_success_resets_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=3)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_breaker_half_open_allows_one_trial(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.advance(29)
+    assert breaker.state == "open"
+
+    clock.advance(1)
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    breaker.cancel_trial()
+    assert breaker.allow()
+
+
+def test_breaker_trial_success_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.advance(30)
+    assert breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+    assert breaker.allow()
+
+
+def test_breaker_trial_failure_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.advance(30)
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.advance(29)
+    assert not breaker.allow()
+    clock.advance(1)
+    assert breaker.state == "half-open"
+
+
+def test_bucket_spends_burst_then_refills(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert all(bucket._take() == 0 for _ in range(3))
+    assert bucket._take() == pytest.approx(0.5)
+
+    clock.advance(0.5)
+    assert bucket._take() == 0
+    assert bucket._take() == pytest.approx(0.5)
+
+
+def test_bucket_refill_is_capped_at_burst(clock):
+    bucket = TokenBucket(rate=10, burst=2)
+    bucket._take()
+    bucket._take()
+    clock.advance(60)
+    assert bucket._take() == 0
+    assert bucket._take() == 0
+    assert bucket._take() > 0
+
+
+def test_bucket_acquire_waits_within_timeout(clock):
+    bucket = TokenBucket(rate=1, burst=1)
+    assert bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0.5)
+
+    started = clock.now
+    assert bucket.acquire(timeout=2)
+    assert clock.now - started == pytest.approx(1)
+
+
+def test_bucket_without_rate_never_waits(clock):
+    bucket = TokenBucket(rate=0, burst=1)
+    assert all(bucket.acquire(timeout=0) for _ in range(100))
@@ -0,0 +1,331 @@
+"""Shared upstream layer for the Gemini and Hugging Face backends.
+
+Every remote call goes through an Upstream, which adds:
+
+- a concurrency semaphore shared by all backends, so a burst cannot tie up
+  every Flask worker waiting on remote calls
+- a token-bucket rate limit per backend
+- a deadline per call, passed down to the client as its timeout
+- retries with jittered exponential backoff for 429s, 5xx and timeouts
+- a circuit breaker that fails fast while a backend keeps failing
+
+Calls that are refused (circuit open, rate limit or concurrency wait longer
+than the deadline) raise UpstreamUnavailable so routes can answer 503
+quickly. acall() is the asyncio flavour used by async_server.py; it shares
+the rate limit and circuit breaker but takes its own asyncio.Semaphore.
+"""
+
+import asyncio
+import random
+import sys
+import threading
+import time
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class UpstreamUnavailable(UpstreamError):
+    pass
+
+
+class UpstreamTimeout(UpstreamError):
+    pass
+
+
+def is_retryable(error):
+    if isinstance(error, (UpstreamTimeout, TimeoutError, ConnectionError)):
+        return True
+    # The client libraries are imported on first use, and an error can only come from one that is loaded
+    google_exceptions = sys.modules.get("google.api_core.exceptions")
+    if google_exceptions and isinstance(error, (
+            google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError, google_exceptions.DeadlineExceeded,
+            google_exceptions.GatewayTimeout, google_exceptions.TooManyRequests)):
+        return True
+    requests_exceptions = sys.modules.get("requests.exceptions")
+    if requests_exceptions and isinstance(error, (requests_exceptions.ConnectionError, requests_exceptions.Timeout)):
+        return True
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) in RETRYABLE_STATUS
+
+
+def pooled_session(pool_size):
+    # One keep-alive connection pool shared by every thread
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout):
+        # Waits for a token for at most `timeout` seconds; False if none came
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._take()
+            if wait == 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+    def _take(self):
+        # Takes a token if one is available, otherwise returns how long until the next one
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        # Half-open lets exactly one trial call through to probe the backend
+        with self.lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def cancel_trial(self):
+        with self.lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class Upstream:
+    def __init__(self, name, semaphore, rate=0, burst=1, timeout=60, retries=2,
+                 backoff_base=0.5, backoff_max=8, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.semaphore = semaphore
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.lock = threading.Lock()
+        self.counters = {"attempts": 0, "retries": 0, "failures": 0, "rejected": 0}
+
+    def call(self, fn, timeout=None):
+        """Run fn(timeout) under this backend's limits, retrying transient errors.
+
+        fn receives the seconds left until the deadline and should pass them
+        on as the client's own request timeout.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            self._admit(deadline)
+            try:
+                result = fn(deadline - time.monotonic())
+            except Exception as e:
+                # The slot goes back before the backoff, so a retrying call does not starve the other backends
+                self.semaphore.release()
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self.semaphore.release()
+                self.breaker.cancel_trial()
+                raise
+
+            self.semaphore.release()
+            self.breaker.record_success()
+            return result
+
+    async def acall(self, fn, slots, timeout=None):
+        """Async call(): fn(timeout) returns an awaitable, slots is an asyncio.Semaphore."""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            await self._aadmit(deadline, slots)
+            try:
+                remaining = deadline - time.monotonic()
+                try:
+                    result = await asyncio.wait_for(fn(remaining), remaining)
+                except asyncio.TimeoutError:
+                    raise UpstreamTimeout(f"{self.name} call exceeded its {remaining:.0f}s deadline")
+            except Exception as e:
+                slots.release()
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled (the client went away): the backend's health is unknown, so a trial is given up
+                slots.release()
+                self.breaker.cancel_trial()
+                raise
+
+            slots.release()
+            self.breaker.record_success()
+            return result
+
+    def stream(self, fn, timeout=None):
+        """Like call(), for a fn that returns an iterator of chunks.
+
+        The concurrency slot is held until the stream is exhausted. Only the
+        call that opens the stream is retried; once chunks have been sent a
+        failure is raised to the caller.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            self._admit(deadline)
+            try:
+                chunks = fn(deadline - time.monotonic())
+                break
+            except Exception as e:
+                self.semaphore.release()
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+            except BaseException:
+                self.semaphore.release()
+                self.breaker.cancel_trial()
+                raise
+
+        try:
+            yield from chunks
+            self.breaker.record_success()
+        except Exception as e:
+            if is_retryable(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        except BaseException:
+            # GeneratorExit when the client disconnects mid-stream; a half-open trial must not stay running
+            self.breaker.cancel_trial()
+            raise
+        finally:
+            self.semaphore.release()
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "circuit": self.breaker.state}
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _admit(self, deadline):
+        # Circuit breaker, then rate limit, then a concurrency slot, all within the deadline
+        self._check_circuit()
+        if not self.bucket.acquire(max(deadline - time.monotonic(), 0)):
+            self._reject("rate limit exceeded")
+        if not self.semaphore.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            self._reject("has too many calls in flight")
+
+    async def _aadmit(self, deadline, slots):
+        self._check_circuit()
+        try:
+            if not await self.bucket.acquire_async(max(deadline - time.monotonic(), 0)):
+                self._reject("rate limit exceeded")
+            await asyncio.wait_for(slots.acquire(), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            self._reject("has too many calls in flight")
+        except asyncio.CancelledError:
+            self.breaker.cancel_trial()
+            raise
+
+    def _check_circuit(self):
+        self._count("attempts")
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise UpstreamUnavailable(f"{self.name} circuit is open")
+
+    def _reject(self, reason):
+        self._count("rejected")
+        self.breaker.cancel_trial()
+        raise UpstreamUnavailable(f"{self.name} {reason}")
+
+    def _retry_delay(self, error, attempt, deadline):
+        # Seconds to back off before the next attempt, or None to give up
+        self._count("failures")
+        if not is_retryable(error):
+            # The backend answered (e.g. a 400), so it counts as healthy
+            self.breaker.record_success()
+            return None
+
+        self.breaker.record_failure()
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.5)
+        if attempt >= self.retries or time.monotonic() + delay >= deadline:
+            return None
+
+        print(f"⚠️ {self.name} call failed ({error}); retrying in {delay:.1f}s")
+        self._count("retries")
+        return delay
@@ -0,0 +1,188 @@
+"""Local pre-processing of recordings before they are uploaded to Gemini.
+
+Gemini samples uploaded video at about one frame per second, so a browser
+recording at full resolution and 30 fps mostly costs upload time and
+PROCESSING wait. Before the upload, the clip is re-encoded to H.264/AAC MP4
+with the resolution and frame rate of a quality profile, and leading and
+trailing silence is cut off. The "keyframes" profile goes furthest: one
+sampled frame per second plus the audio track.
+
+Encodes run in a small process pool, which also caps how many ffmpeg jobs
+run at once. ffmpeg comes from imageio-ffmpeg when it is installed,
+otherwise from PATH. When it is missing, or a clip fails to encode, or the
+result is not smaller, the original recording is uploaded unchanged.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+PROFILES = {
+    "off": None,
+    "high": {"height": 720, "fps": 15, "crf": 28, "audio_bitrate": "64k"},
+    "balanced": {"height": 480, "fps": 5, "crf": 32, "audio_bitrate": "48k"},
+    "small": {"height": 360, "fps": 2, "crf": 35, "audio_bitrate": "32k"},
+    "keyframes": {"height": 360, "fps": 1, "crf": 30, "audio_bitrate": "32k"},
+}
+
+SILENCE_NOISE = "-35dB"
+SILENCE_MIN_SECONDS = 1.0
+SILENCE_PADDING = 0.3
+
+SILENCE_START = re.compile(r"silence_start: (-?[\d.]+)")
+SILENCE_END = re.compile(r"silence_end: (-?[\d.]+)")
+PROGRESS_TIME = re.compile(r"time=(\d+):(\d+):([\d.]+)")
+
+
+def find_ffmpeg():
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return shutil.which("ffmpeg")
+
+
+def speech_bounds(ffmpeg, path):
+    # Returns (start, end) of the span between leading and trailing silence; end is None when the clip ends on speech
+    result = subprocess.run(
+        [ffmpeg, "-hide_banner", "-i", path, "-vn",
+         "-af", f"silencedetect=noise={SILENCE_NOISE}:d={SILENCE_MIN_SECONDS}", "-f", "null", "-"],
+        capture_output=True, text=True, timeout=300
+    )
+    events = []
+    for line in result.stderr.splitlines():
+        match = SILENCE_START.search(line)
+        if match:
+            events.append(("start", float(match.group(1))))
+        match = SILENCE_END.search(line)
+        if match:
+            events.append(("end", float(match.group(1))))
+
+    # ffmpeg closes a trailing silence at end of stream, so compare against the last progress time
+    progress = PROGRESS_TIME.findall(result.stderr)
+    duration = None
+    if progress:
+        hours, minutes, seconds = progress[-1]
+        duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    start, end = 0.0, None
+    if len(events) >= 2 and events[0][0] == "start" and events[0][1] <= 0.05 and events[1][0] == "end":
+        start = max(events[1][1] - SILENCE_PADDING, 0.0)
+        events = events[2:]
+    if events and events[-1][0] == "end" and duration is not None and events[-1][1] >= duration - 0.1:
+        events = events[:-1]
+    if events and events[-1][0] == "start":
+        end = events[-1][1] + SILENCE_PADDING
+    return start, end
+
+
+def preprocess_video(path, profile, trim_silence=True):
+    """Encode `path` with a profile; returns (output path or None, details). Runs in a pool worker."""
+    settings = PROFILES[profile]
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None:
+        return None, {"skipped": "ffmpeg not found"}
+
+    start, end = speech_bounds(ffmpeg, path) if trim_silence else (0.0, None)
+    if end is not None and end <= start:
+        # Nothing but silence; keep the whole clip rather than send an empty one
+        start, end = 0.0, None
+
+    fd, output_path = tempfile.mkstemp(prefix="video-small-", suffix=".mp4")
+    os.close(fd)
+    command = [ffmpeg, "-hide_banner", "-nostats", "-loglevel", "error", "-y"]
+    if start > 0:
+        command += ["-ss", f"{start:.2f}"]
+    command += ["-i", path]
+    if end is not None:
+        command += ["-t", f"{end - start:.2f}"]
+    command += [
+        "-vf", f"fps={settings['fps']},scale=-2:'min({settings['height']},ih)'",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", str(settings["crf"]), "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-ac", "1", "-b:a", settings["audio_bitrate"],
+        "-movflags", "+faststart", output_path,
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, timeout=600)
+    if result.returncode != 0:
+        os.remove(output_path)
+        return None, {"skipped": result.stderr.strip()[-300:] or "ffmpeg failed"}
+
+    return output_path, {"trimmed_start": round(start, 2), "trimmed_end": None if end is None else round(end, 2)}
+
+
+class VideoPreprocessor:
+    def __init__(self, profile="balanced", workers=2, trim_silence=True):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown video profile {profile!r}; choose one of {', '.join(PROFILES)}")
+        self.profile = profile
+        self.workers = workers
+        self.trim_silence = trim_silence
+
+        self.pool = None
+        self.lock = threading.Lock()
+        self.upload_rate = None  # bytes per second, moving average over recent uploads
+        self.counters = {"processed": 0, "skipped": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0}
+
+    def run(self, path):
+        """Returns (path to upload, report). The path is a new temp file when it differs from `path`."""
+        original_bytes = os.path.getsize(path)
+        report = {"profile": self.profile, "original_bytes": original_bytes}
+        if PROFILES[self.profile] is None:
+            return path, {**report, "uploaded_bytes": original_bytes, "bytes_saved": 0}
+
+        started = time.monotonic()
+        try:
+            output_path, details = self._executor().submit(
+                preprocess_video, path, self.profile, self.trim_silence
+            ).result()
+        except Exception as e:
+            output_path, details = None, {"skipped": str(e)}
+        elapsed = time.monotonic() - started
+        report.update(details, preprocess_seconds=round(elapsed, 2))
+
+        if output_path is not None and os.path.getsize(output_path) >= original_bytes:
+            os.remove(output_path)
+            output_path, report["skipped"] = None, "encoded clip was not smaller"
+
+        uploaded_bytes = os.path.getsize(output_path) if output_path else original_bytes
+        bytes_saved = original_bytes - uploaded_bytes
+        report.update(uploaded_bytes=uploaded_bytes, bytes_saved=bytes_saved)
+        with self.lock:
+            rate = self.upload_rate
+            self.counters["processed" if output_path else "skipped"] += 1
+            self.counters["bytes_in"] += original_bytes
+            self.counters["bytes_out"] += uploaded_bytes
+            self.counters["seconds"] += elapsed
+        if rate:
+            # Upload time avoided, net of the time spent encoding
+            report["time_saved_seconds"] = round(bytes_saved / rate - elapsed, 2)
+
+        return output_path or path, report
+
+    def record_upload(self, size, seconds):
+        if seconds <= 0:
+            return
+        with self.lock:
+            rate = size / seconds
+            self.upload_rate = rate if self.upload_rate is None else 0.7 * self.upload_rate + 0.3 * rate
+
+    def stats(self):
+        with self.lock:
+            return {
+                **self.counters,
+                "seconds": round(self.counters["seconds"], 2),
+                "bytes_saved": self.counters["bytes_in"] - self.counters["bytes_out"],
+                "profile": self.profile,
+                "upload_rate": round(self.upload_rate) if self.upload_rate else None,
+            }
+
+    def _executor(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self.pool